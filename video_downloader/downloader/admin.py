@@ -1,3 +1,153 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils.html import format_html
 
-# Register your models here.
+from .models import ApiKey, ApiKeyUsage, MediaFingerprint, VideoDownload
+from .ops import ops_snapshot
+from .prefetch import evict
+from .scheduler import LANES, reprioritize, retry_download
+
+STATUSES = ('pending', 'queued', 'downloading', 'merging', 'completed', 'failed', 'evicted')
+
+
+# Fixed lookups: the default filters run SELECT DISTINCT over the whole table
+class StatusFilter(admin.SimpleListFilter):
+    title = 'status'
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return [(s, s) for s in STATUSES]
+
+    def queryset(self, request, queryset):
+        return queryset.filter(status=self.value()) if self.value() else queryset
+
+
+class LaneFilter(admin.SimpleListFilter):
+    title = 'lane'
+    parameter_name = 'lane'
+
+    def lookups(self, request, model_admin):
+        return [(lane, lane) for lane in LANES]
+
+    def queryset(self, request, queryset):
+        return queryset.filter(lane=self.value()) if self.value() else queryset
+
+
+class PlatformFilter(admin.SimpleListFilter):
+    title = 'platform'
+    parameter_name = 'platform'
+
+    def lookups(self, request, model_admin):
+        platforms = cache.get('admin:platforms')
+        if platforms is None:
+            platforms = sorted(p for p in VideoDownload.objects.values_list('platform', flat=True).distinct() if p)
+            cache.set('admin:platforms', platforms, 600)
+        return [(p, p) for p in platforms]
+
+    def queryset(self, request, queryset):
+        return queryset.filter(platform=self.value()) if self.value() else queryset
+
+
+@admin.register(VideoDownload)
+class VideoDownloadAdmin(admin.ModelAdmin):
+    list_display = ('id', 'short_title', 'platform', 'status', 'lane', 'progress', 'file_size',
+                    'owner', 'attempts', 'created_at')
+    list_filter = (StatusFilter, LaneFilter, PlatformFilter, 'storage_backend')
+    search_fields = ('=client_id', '=owner', '^title')
+    list_per_page = 50
+    # COUNT(*) over a large table on every page load is the slow part of a changelist
+    show_full_result_count = False
+    list_select_related = ('api_key',)
+    raw_id_fields = ('api_key',)
+    readonly_fields = ('created_at', 'queued_at', 'started_at', 'worker_id', 'lease_expires_at', 'fair_tag')
+    actions = ('retry', 'evict_files', 'prioritize', 'move_to_bulk')
+    change_list_template = 'admin/downloader/videodownload/change_list.html'
+
+    @admin.display(description='title', ordering='title')
+    def short_title(self, obj):
+        return format_html('<span title="{}">{}</span>', obj.url, (obj.title or obj.url)[:60])
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        # Ids and URLs are looked up by their indexes
+        if term.isdigit():
+            return queryset.filter(pk=int(term)), False
+        if term.startswith(('http://', 'https://')):
+            return queryset.filter(url__startswith=term), False
+        return super().get_search_results(request, queryset, search_term)
+
+    def _apply(self, request, queryset, action, verb: str):
+        done = sum(1 for video_download in queryset.iterator() if action(video_download))
+        skipped = queryset.count() - done
+        self.message_user(request, f"{verb} {done} download(s)" + (f", skipped {skipped}" if skipped else ''),
+                          messages.SUCCESS if done else messages.WARNING)
+
+    @admin.action(description='Retry (failed or evicted video downloads)')
+    def retry(self, request, queryset):
+        self._apply(request, queryset, retry_download, 'Queued')
+
+    @admin.action(description='Evict files (completed)')
+    def evict_files(self, request, queryset):
+        self._apply(request, queryset, evict, 'Evicted')
+
+    @admin.action(description='Move to the front of the interactive lane (queued)')
+    def prioritize(self, request, queryset):
+        self._apply(request, queryset, lambda vd: reprioritize(vd, 'interactive'), 'Prioritized')
+
+    @admin.action(description='Move to the bulk lane (queued)')
+    def move_to_bulk(self, request, queryset):
+        self._apply(request, queryset, lambda vd: reprioritize(vd, 'bulk'), 'Moved')
+
+    def get_urls(self):
+        return [
+            path('ops/', self.admin_site.admin_view(self.ops_view), name='downloader_videodownload_ops'),
+        ] + super().get_urls()
+
+    def ops_view(self, request):
+        snapshot = ops_snapshot()
+        if request.GET.get('format') == 'json':
+            return JsonResponse(snapshot)
+        return TemplateResponse(request, 'admin/downloader/ops.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Operations',
+            'opts': self.model._meta,
+            'snapshot': snapshot,
+            'refresh': 5,
+        })
+
+
+@admin.register(ApiKey)
+class ApiKeyAdmin(admin.ModelAdmin):
+    list_display = ('name', 'prefix', 'is_active', 'weight', 'created_at')
+    list_filter = ('is_active',)
+    search_fields = ('name', '=prefix')
+    # Keys are created with `manage.py create_api_key`, which shows the secret once
+    readonly_fields = ('prefix', 'key_hash', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ApiKeyUsage)
+class ApiKeyUsageAdmin(admin.ModelAdmin):
+    list_display = ('api_key', 'period', 'requests', 'extraction_seconds', 'bytes_downloaded',
+                    'bytes_served', 'storage_byte_seconds', 'updated_at')
+    list_filter = ('period',)
+    list_select_related = ('api_key',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(MediaFingerprint)
+class MediaFingerprintAdmin(admin.ModelAdmin):
+    list_display = ('download', 'download__sha256', 'video_hash', 'duration', 'file_size', 'created_at')
+    search_fields = ('=download__sha256', '=video_hash')
+    raw_id_fields = ('download',)
+    list_select_related = ('download',)
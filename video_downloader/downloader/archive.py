@@ -0,0 +1,295 @@
+"""
+ZIP / tar export of many downloads, streamed straight from the media store.
+
+The archive is never built anywhere: its layout (headers, manifest, file
+spans, ZIP central directory) is computed up front from each download's
+size and precomputed CRC-32 / SHA-256, and the bytes are produced while
+the response is sent, reading files in ARCHIVE_CHUNK_SIZE pieces (ranged
+GETs on S3). The layout depends only on the downloads, so the same request
+always yields the same bytes and a Range request resumes anywhere in it.
+
+ZIP entries are stored (method 0, media does not compress) with sizes and
+CRC in the local headers, so no data descriptors are needed; ZIP64 records
+are added only when a size or offset needs them.
+"""
+import hashlib
+import json
+import re
+import struct
+import tarfile
+import zlib
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import VideoDownload
+from .storage import get_storage
+
+ARCHIVE_FORMATS = {
+    'zip': 'application/zip',
+    'tar': 'application/x-tar',
+}
+
+ZIP64_LIMIT = 0xFFFFFFFF
+# Stands in for a 32-bit field whose value is in the ZIP64 extra / end record
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP_UTF8_FLAG = 0x0800
+TAR_BLOCK = 512
+
+
+def file_checksums(path: str) -> tuple:
+    """(crc32, sha256 hex) of a local file in one pass"""
+    crc = 0
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            crc = zlib.crc32(chunk, crc)
+            digest.update(chunk)
+    return crc, digest.hexdigest()
+
+
+def has_checksums(video_download) -> bool:
+    return bool(video_download.sha256) and video_download.crc32 is not None and video_download.file_size is not None
+
+
+def needs_checksums():
+    """Completed downloads whose stored file predates checksums"""
+    return (VideoDownload.objects
+            .filter(status='completed')
+            .exclude(file_path='')
+            .filter(Q(sha256='') | Q(crc32__isnull=True) | Q(file_size__isnull=True)))
+
+
+def ensure_checksums(video_download):
+    """
+    Checksum a stored file that predates checksums. It is read in full
+    from the media store, so this runs in the download worker (or
+    `manage.py backfill_checksums`), never inside a request.
+    """
+    if has_checksums(video_download):
+        return video_download
+
+    crc = 0
+    size = 0
+    digest = hashlib.sha256()
+    body = get_storage(video_download.storage_backend).open(video_download.file_path)
+    try:
+        for chunk in iter(lambda: body.read(_chunk_size()), b''):
+            crc = zlib.crc32(chunk, crc)
+            digest.update(chunk)
+            size += len(chunk)
+    finally:
+        body.close()
+
+    fields = {'crc32': crc, 'sha256': digest.hexdigest(), 'file_size': size}
+    VideoDownload.objects.filter(pk=video_download.pk).update(**fields)
+    for name, value in fields.items():
+        setattr(video_download, name, value)
+    return video_download
+
+
+def _chunk_size() -> int:
+    return getattr(settings, 'ARCHIVE_CHUNK_SIZE', 1024 * 1024)
+
+
+def entry_name(video_download) -> str:
+    """'<id> - <title>.<ext>', safe for any unpacker"""
+    ext = video_download.file_path.rsplit('.', 1)[-1] if '.' in video_download.file_path else 'bin'
+    title = re.sub(r'[\x00-\x1f/\\:*?"<>|]+', ' ', video_download.title or '').strip(' .')[:80]
+    return f'{video_download.pk} - {title}.{ext}' if title else f'{video_download.pk}.{ext}'
+
+
+class Entry:
+    """One archive member: in-memory bytes or a file in the media store"""
+
+    def __init__(self, name: str, size: int, crc32: int, mtime: datetime, data: bytes = None,
+                 storage_backend: str = None, key: str = None):
+        self.name = name
+        self.size = size
+        self.crc32 = crc32
+        self.mtime = mtime
+        self.data = data
+        self.storage_backend = storage_backend
+        self.key = key
+
+    @classmethod
+    def from_bytes(cls, name: str, data: bytes, mtime: datetime):
+        return cls(name, len(data), zlib.crc32(data), mtime, data=data)
+
+
+class ArchiveLayout:
+    """Byte-exact plan of an archive: a list of in-memory parts and file spans"""
+
+    def __init__(self, archive_format: str, parts: list, etag: str):
+        self.format = archive_format
+        self.parts = parts
+        self.etag = etag
+        self.size = sum(part.size if isinstance(part, Entry) else len(part) for part in parts)
+
+    def iter_range(self, start: int = 0, end: int = None):
+        """Yield bytes start..end (inclusive) of the archive"""
+        end = self.size - 1 if end is None else end
+        offset = 0
+        for part in self.parts:
+            length = part.size if isinstance(part, Entry) else len(part)
+            part_start, offset = offset, offset + length
+            if offset <= start or part_start > end or not length:
+                continue
+            lo = max(start, part_start) - part_start
+            hi = min(end + 1, offset) - part_start
+            if not isinstance(part, Entry):
+                yield part[lo:hi]
+            elif part.data is not None:
+                yield part.data[lo:hi]
+            else:
+                yield from self._read_file(part, lo, hi - lo)
+
+    def _read_file(self, entry: Entry, start: int, length: int):
+        body = get_storage(entry.storage_backend).open_range(entry.key, start, length)
+        try:
+            remaining = length
+            while remaining:
+                chunk = body.read(min(_chunk_size(), remaining))
+                if not chunk:
+                    raise IOError(f'{entry.key} is shorter than recorded')
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            body.close()
+
+
+def _dos_datetime(value: datetime) -> tuple:
+    value = max(value.astimezone(dt_timezone.utc).replace(tzinfo=None), datetime(1980, 1, 1))
+    dos_time = (value.hour << 11) | (value.minute << 5) | (value.second // 2)
+    dos_date = ((value.year - 1980) << 9) | (value.month << 5) | value.day
+    return dos_time, dos_date
+
+
+def _zip_parts(entries: list) -> list:
+    parts = []
+    central = []
+    offset = 0
+    for entry in entries:
+        name = entry.name.encode('utf-8')
+        dos_time, dos_date = _dos_datetime(entry.mtime)
+        large = entry.size >= ZIP64_LIMIT
+        size32 = ZIP64_MARKER if large else entry.size
+
+        local_extra = struct.pack('<HHQQ', 0x0001, 16, entry.size, entry.size) if large else b''
+        header = struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, 45 if large else 20, ZIP_UTF8_FLAG, 0,
+            dos_time, dos_date, entry.crc32, size32, size32, len(name), len(local_extra),
+        ) + name + local_extra
+        parts += [header, entry]
+
+        # Central ZIP64 extra holds only the fields that overflowed, in this order
+        zip64_fields = [entry.size, entry.size] if large else []
+        if offset >= ZIP64_LIMIT:
+            zip64_fields.append(offset)
+        central_extra = b''
+        if zip64_fields:
+            central_extra = struct.pack('<HH', 0x0001, 8 * len(zip64_fields)) + \
+                struct.pack(f'<{len(zip64_fields)}Q', *zip64_fields)
+        version = 45 if zip64_fields else 20
+        central.append(struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, ZIP_UTF8_FLAG, 0,
+            dos_time, dos_date, entry.crc32, size32, size32, len(name), len(central_extra), 0,
+            0, 0, 0o100644 << 16, ZIP64_MARKER if offset >= ZIP64_LIMIT else offset,
+        ) + name + central_extra)
+        offset += len(header) + entry.size
+
+    directory = b''.join(central)
+    count = len(entries)
+    end = b''
+    if offset >= ZIP64_LIMIT or len(directory) >= ZIP64_LIMIT or count >= 0xFFFF:
+        zip64_end_offset = offset + len(directory)
+        end += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, len(directory), offset)
+        end += struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+    end += struct.pack(
+        '<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+        ZIP64_MARKER if len(directory) >= ZIP64_LIMIT else len(directory),
+        ZIP64_MARKER if offset >= ZIP64_LIMIT else offset, 0,
+    )
+    return parts + [directory + end]
+
+
+def _tar_parts(entries: list) -> list:
+    parts = []
+    for entry in entries:
+        info = tarfile.TarInfo(entry.name)
+        info.size = entry.size
+        info.mtime = int(entry.mtime.timestamp())
+        info.mode = 0o644
+        # GNU format: long names and sizes over 8 GiB are encoded, not rejected
+        parts += [info.tobuf(tarfile.GNU_FORMAT, 'utf-8', 'surrogateescape'), entry]
+        padding = -entry.size % TAR_BLOCK
+        if padding:
+            parts.append(b'\0' * padding)
+    parts.append(b'\0' * (TAR_BLOCK * 2))
+    return parts
+
+
+def build_archive(downloads: list, archive_format: str = 'zip') -> ArchiveLayout:
+    """
+    Layout of an archive of completed downloads (in the given order) plus
+    manifest.json and SHA256SUMS, which come first so a partial archive is
+    still verifiable. Every download must already have its checksums.
+    """
+    unchecked = [video_download.pk for video_download in downloads if not has_checksums(video_download)]
+    if unchecked:
+        raise ValueError(f'Downloads without checksums: {unchecked}')
+    mtime = max(video_download.created_at for video_download in downloads)
+
+    files = []
+    entries = []
+    for video_download in downloads:
+        name = entry_name(video_download)
+        files.append({
+            'id': video_download.pk,
+            'name': name,
+            'title': video_download.title,
+            'url': video_download.url,
+            'platform': video_download.platform,
+            'size': video_download.file_size,
+            'crc32': f'{video_download.crc32:08x}',
+            'sha256': video_download.sha256,
+        })
+        entries.append(Entry(
+            name, video_download.file_size, video_download.crc32, video_download.created_at,
+            storage_backend=video_download.storage_backend, key=video_download.file_path,
+        ))
+
+    manifest = json.dumps({
+        'format': archive_format,
+        'count': len(files),
+        'total_size': sum(f['size'] for f in files),
+        'files': files,
+    }, indent=2, sort_keys=True).encode('utf-8')
+    sums = ''.join(f"{f['sha256']}  {f['name']}\n" for f in files).encode('utf-8')
+    entries = [Entry.from_bytes('manifest.json', manifest, mtime), Entry.from_bytes('SHA256SUMS', sums, mtime)] + entries
+
+    parts = _zip_parts(entries) if archive_format == 'zip' else _tar_parts(entries)
+    etag = hashlib.sha256(archive_format.encode() + b'\0' + manifest).hexdigest()[:32]
+    return ArchiveLayout(archive_format, parts, etag)
+
+
+def parse_range(header: str, size: int):
+    """
+    (start, end) for a single `bytes=` range, None to send everything
+    (no/unsupported header). Raises ValueError when it cannot be satisfied.
+    """
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', header or '')
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        raise ValueError('Range not satisfiable')
+    return start, end
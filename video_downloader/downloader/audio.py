@@ -0,0 +1,112 @@
+import os
+import subprocess
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .storage import get_storage
+
+# Output container / ffmpeg encoder per requested audio format
+AUDIO_CODECS = {
+    'mp3': ('mp3', ['-c:a', 'libmp3lame']),
+    'm4a': ('m4a', ['-c:a', 'aac']),
+    'wav': ('wav', ['-c:a', 'pcm_s16le']),
+    'flac': ('flac', ['-c:a', 'flac']),
+}
+
+# Lossless/PCM outputs ignore the requested bitrate
+FIXED_BITRATE_FORMATS = ('wav', 'flac')
+
+
+def has_audio(f: dict) -> bool:
+    return f.get('acodec') != 'none'
+
+
+def is_audio_only(f: dict) -> bool:
+    return f.get('vcodec') == 'none' and has_audio(f)
+
+
+def pick_audio_source(info: dict):
+    """
+    Choose the cheapest source that carries the best audio.
+
+    Returns (format, audio_only). Audio-only formats always win; otherwise the
+    muxed format with the best audio bitrate and the smallest size is used so
+    as few video bytes as possible have to be read.
+    """
+    formats = [f for f in (info.get('formats') or [info]) if f.get('url')]
+
+    audio_only = [f for f in formats if is_audio_only(f)]
+    if audio_only:
+        best = max(audio_only, key=lambda f: (f.get('abr') or f.get('tbr') or 0, f.get('quality') or 0))
+        return best, True
+
+    muxed = [f for f in formats if has_audio(f)]
+    if not muxed:
+        raise Exception('No audio stream available for this video')
+
+    def size(f):
+        return f.get('filesize') or f.get('filesize_approx') or (f.get('tbr') or 0) * 1000
+
+    best = min(muxed, key=lambda f: (-(f.get('abr') or 0), size(f)))
+    return best, False
+
+
+def extract_audio_stream(source: dict, output_path: str, audio_format: str, bitrate: str,
+                         ffmpeg_location: str = None):
+    """
+    Pull only the audio track out of a muxed stream with ffmpeg.
+
+    ffmpeg reads the remote stream directly and encodes the audio as it
+    arrives, so the video is never written to disk.
+    """
+    ffmpeg = os.path.join(ffmpeg_location, 'ffmpeg') if ffmpeg_location else 'ffmpeg'
+    _, codec_args = AUDIO_CODECS[audio_format]
+
+    cmd = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y']
+    headers = source.get('http_headers') or {}
+    if headers:
+        cmd += ['-headers', ''.join(f'{k}: {v}\r\n' for k, v in headers.items())]
+    cmd += ['-i', source['url'], '-vn', '-map', '0:a:0', *codec_args]
+    if audio_format not in FIXED_BITRATE_FORMATS:
+        cmd += ['-b:a', f'{bitrate}k']
+    cmd.append(output_path)
+
+    result = subprocess.run(
+        cmd,
+        capture_output=True,
+        text=True,
+        timeout=getattr(settings, 'AUDIO_EXTRACT_TIMEOUT', 280),
+    )
+    if result.returncode != 0:
+        raise Exception(f'ffmpeg audio extraction failed: {result.stderr.strip()[-500:]}')
+
+
+def audio_cache_key(info: dict, audio_format: str, bitrate: str) -> str:
+    video_key = f"{info.get('extractor_key', '')}:{info.get('id') or info.get('webpage_url')}"
+    if audio_format in FIXED_BITRATE_FORMATS:
+        bitrate = 'lossless'
+    return f"audio:{video_key}:{audio_format}:{bitrate}"
+
+
+def get_cached_audio(info: dict, audio_format: str, bitrate: str):
+    """Return a completed download of the same audio rendition, if its file still exists"""
+    from .models import VideoDownload
+
+    pk = cache.get(audio_cache_key(info, audio_format, bitrate))
+    if not pk:
+        return None
+    video_download = VideoDownload.objects.filter(pk=pk, status='completed').first()
+    if not video_download or not video_download.file_path:
+        return None
+    if not get_storage(video_download.storage_backend).exists(video_download.file_path):
+        return None
+    return video_download
+
+
+def cache_audio(info: dict, audio_format: str, bitrate: str, video_download):
+    cache.set(
+        audio_cache_key(info, audio_format, bitrate),
+        video_download.pk,
+        getattr(settings, 'AUDIO_CACHE_TTL', 60 * 60 * 24),
+    )
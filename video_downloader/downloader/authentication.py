@@ -0,0 +1,44 @@
+import hmac
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication
+
+from .models import ApiKey
+
+API_KEY_HEADER = 'HTTP_X_API_KEY'
+# EventSource and plain download links cannot send headers
+API_KEY_QUERY_PARAM = 'api_key'
+
+
+def get_api_key(raw_key: str):
+    """Active ApiKey for a raw key (looked up by prefix, compared by hash), or None"""
+    key_hash = ApiKey.hash_key(raw_key)
+    cache_key = f'apikey:{key_hash}'
+    api_key = cache.get(cache_key)
+    if api_key is None:
+        api_key = ApiKey.objects.filter(prefix=raw_key[:ApiKey.PREFIX_LENGTH], is_active=True).first()
+        if api_key is None or not hmac.compare_digest(api_key.key_hash, key_hash):
+            return None
+        cache.set(cache_key, api_key, 60)
+    return api_key
+
+
+class ApiKeyAuthentication(BaseAuthentication):
+    """
+    `X-API-Key: <key>` (or `?api_key=`). Authenticated requests have the
+    ApiKey as `request.auth`; requests without a key stay anonymous.
+    """
+
+    def authenticate(self, request):
+        raw_key = request.META.get(API_KEY_HEADER) or request.query_params.get(API_KEY_QUERY_PARAM)
+        if not raw_key:
+            return None
+        api_key = get_api_key(raw_key)
+        if api_key is None:
+            raise exceptions.AuthenticationFailed('Invalid or revoked API key')
+        return AnonymousUser(), api_key
+
+    def authenticate_header(self, request):
+        return 'X-API-Key'
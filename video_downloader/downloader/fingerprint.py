@@ -0,0 +1,232 @@
+"""
+Media fingerprints for finding the same clip behind different URLs.
+
+Exact copies (re-uploads of the same file, mirrors) are found by the
+download's own sha256 (VideoDownload.sha256, recorded for every download).
+Every fingerprinted download also gets
+    frame hashes  a 64-bit difference hash (dHash) of FINGERPRINT_FRAMES frames
+                  at fixed fractions of the duration (decoded at that exact
+                  time, not the nearest keyframe, so another encode's GOP
+                  does not shift them); they survive re-encoding, rescaling
+                  and watermark-free re-posts
+    audio         a raw Chromaprint from `fpcalc`, when it is installed
+
+Near-duplicate lookup is a two-step search: candidates share at least one
+16-bit band of the video hash (the bitwise majority of the frame hashes; two
+hashes within 3 bits always share a band), then are scored on the mean
+Hamming distance of all frame hashes and, when both have one, the bit
+agreement of their audio fingerprints.
+"""
+import json
+import shutil
+import subprocess
+import time
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import MediaFingerprint, VideoDownload
+from .packaging import _ffmpeg_bin
+from .storage import get_storage
+
+HASH_BITS = 64
+BANDS = 4
+# dHash input: 9x8 grayscale, each pixel compared with its right neighbour
+DHASH_WIDTH = 9
+DHASH_HEIGHT = 8
+
+
+def dhash(pixels: bytes) -> int:
+    value = 0
+    for row in range(DHASH_HEIGHT):
+        offset = row * DHASH_WIDTH
+        for col in range(DHASH_WIDTH - 1):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def sample_times(duration: float, samples: int) -> list:
+    """Midpoints of `samples` equal slices of the duration (never the first frame, often black)"""
+    return [duration * (i + 0.5) / samples for i in range(samples)]
+
+
+def frame_hashes(path: str, duration: float, samples: int, ffmpeg_location: str = None) -> list:
+    """
+    dHashes of `samples` frames at fixed fractions of the duration. Each
+    is an accurate seek (decode from the previous keyframe up to the exact
+    time) so every encode of a clip yields the same frames; only one GOP
+    per sample is decoded.
+    """
+    if not duration or samples <= 0:
+        return []
+    size = DHASH_WIDTH * DHASH_HEIGHT
+    deadline = time.monotonic() + getattr(settings, 'FINGERPRINT_TIMEOUT', 120)
+    hashes = []
+    for at in sample_times(duration, samples):
+        result = subprocess.run(
+            [
+                _ffmpeg_bin('ffmpeg', ffmpeg_location), '-hide_banner', '-loglevel', 'error',
+                '-ss', f'{at:.3f}', '-i', path, '-map', '0:v:0',
+                '-vf', f'scale={DHASH_WIDTH}:{DHASH_HEIGHT}:flags=area,format=gray',
+                '-frames:v', '1', '-f', 'rawvideo', '-',
+            ],
+            capture_output=True,
+            timeout=max(deadline - time.monotonic(), 1),
+        )
+        if result.returncode != 0:
+            raise Exception(f'ffmpeg frame sampling failed: {result.stderr.decode(errors="replace").strip()[-300:]}')
+        if len(result.stdout) >= size:
+            hashes.append(dhash(result.stdout[:size]))
+    return hashes
+
+
+def audio_fingerprint(path: str) -> list:
+    """Raw Chromaprint (32-bit ints) of the first two minutes, or [] without fpcalc"""
+    fpcalc = shutil.which('fpcalc')
+    if not fpcalc:
+        return []
+    result = subprocess.run(
+        [fpcalc, '-raw', '-json', '-length', '120', path],
+        capture_output=True,
+        text=True,
+        timeout=getattr(settings, 'FINGERPRINT_TIMEOUT', 120),
+    )
+    if result.returncode != 0:
+        # No audio stream, or a container fpcalc cannot read
+        return []
+    return json.loads(result.stdout or '{}').get('fingerprint') or []
+
+
+def majority_hash(hashes: list) -> int:
+    value = 0
+    for bit in range(HASH_BITS):
+        if sum((h >> bit) & 1 for h in hashes) * 2 > len(hashes):
+            value |= 1 << bit
+    return value
+
+
+def bands(value: int) -> list:
+    width = HASH_BITS // BANDS
+    return [f'{(value >> (i * width)) & 0xffff:04x}' for i in range(BANDS)]
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def frame_distance(a: list, b: list):
+    """Mean Hamming distance (bits of 64) between aligned frame hashes"""
+    pairs = list(zip(a, b))
+    if not pairs:
+        return None
+    return sum(hamming(int(x, 16), int(y, 16)) for x, y in pairs) / len(pairs)
+
+
+def audio_similarity(a: list, b: list, max_shift: int = 8):
+    """Share of matching bits (0..1) at the best alignment of two Chromaprints"""
+    if not a or not b:
+        return None
+    best = 0.0
+    for shift in range(-max_shift, max_shift + 1):
+        pairs = list(zip(a[max(shift, 0):], b[max(-shift, 0):]))
+        if len(pairs) < 10:
+            continue
+        errors = sum(bin((x ^ y) & 0xffffffff).count('1') for x, y in pairs)
+        best = max(best, 1 - errors / (32 * len(pairs)))
+    return round(best, 3)
+
+
+def fingerprint_file(path: str, duration: float = None, has_ffmpeg: bool = False, ffmpeg_location: str = None) -> dict:
+    """
+    MediaFingerprint fields for a local file. The perceptual parts are best
+    effort: without ffmpeg (or fpcalc) only what can be computed is filled in.
+    """
+    fields = {'duration': duration}
+    if has_ffmpeg:
+        try:
+            hashes = frame_hashes(path, duration, getattr(settings, 'FINGERPRINT_FRAMES', 16), ffmpeg_location)
+        except Exception as e:
+            print(f"Frame fingerprint of {path} failed: {e}")
+            hashes = []
+        if hashes:
+            video_hash = majority_hash(hashes)
+            fields['frame_hashes'] = [f'{h:016x}' for h in hashes]
+            fields['video_hash'] = f'{video_hash:016x}'
+            fields.update(zip(('band0', 'band1', 'band2', 'band3'), bands(video_hash)))
+    try:
+        fields['audio_fingerprint'] = audio_fingerprint(path)
+    except Exception as e:
+        print(f"Audio fingerprint of {path} failed: {e}")
+    return fields
+
+
+def save_fingerprint(video_download, fields: dict):
+    fingerprint, _ = MediaFingerprint.objects.update_or_create(
+        download=video_download,
+        defaults={**fields, 'file_size': video_download.file_size},
+    )
+    return fingerprint
+
+
+def stored_original(sha256: str, exclude_pk=None):
+    """An earlier completed download of the exact same file that is still in the media store"""
+    if not sha256:
+        return None
+    originals = (VideoDownload.objects
+                 .filter(sha256=sha256, status='completed')
+                 .exclude(pk=exclude_pk)
+                 .exclude(file_path='')
+                 .order_by('pk'))
+    for original in originals[:5]:
+        if get_storage(original.storage_backend).exists(original.file_path):
+            return original
+    return None
+
+
+def file_shared(video_download) -> bool:
+    """Whether another completed download points at the same stored file (exact duplicates do)"""
+    return (VideoDownload.objects
+            .filter(file_path=video_download.file_path, storage_backend=video_download.storage_backend,
+                    status='completed')
+            .exclude(pk=video_download.pk)
+            .exists())
+
+
+def find_duplicates(fingerprint, max_distance: float = None, min_audio: float = None, limit: int = 20) -> list:
+    """
+    Completed downloads with the same or near-identical media, closest
+    first: [(fingerprint, frame distance, audio similarity, exact)].
+    """
+    if max_distance is None:
+        max_distance = getattr(settings, 'FINGERPRINT_MAX_DISTANCE', 10)
+    if min_audio is None:
+        min_audio = getattr(settings, 'FINGERPRINT_MIN_AUDIO_SIMILARITY', 0.8)
+
+    sha256 = fingerprint.download.sha256
+    query = Q(download__sha256=sha256) if sha256 else Q()
+    if fingerprint.video_hash:
+        for i in range(BANDS):
+            band = getattr(fingerprint, f'band{i}')
+            query |= Q(**{f'band{i}': band})
+    if not query:
+        return []
+    candidates = (MediaFingerprint.objects
+                  .filter(query, download__status='completed')
+                  .exclude(pk=fingerprint.pk)
+                  .select_related('download')[:500])
+
+    matches = []
+    for candidate in candidates:
+        exact = bool(sha256) and candidate.download.sha256 == sha256
+        distance = frame_distance(fingerprint.frame_hashes, candidate.frame_hashes)
+        audio = audio_similarity(fingerprint.audio_fingerprint, candidate.audio_fingerprint)
+        if not exact:
+            if distance is None or distance > max_distance:
+                continue
+            if audio is not None and audio < min_audio:
+                # Same footage, different soundtrack: not the same clip
+                continue
+        matches.append((candidate, distance, audio, exact))
+
+    matches.sort(key=lambda m: (not m[3], m[1] if m[1] is not None else HASH_BITS))
+    return matches[:limit]
@@ -0,0 +1,278 @@
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+# Registrable domains per platform; subdomains (www., m., vm., ...) match too
+PLATFORM_DOMAINS = {
+    'facebook': ('facebook.com', 'fb.watch', 'fb.com'),
+    'instagram': ('instagram.com',),
+    'twitter': ('twitter.com', 'x.com'),
+    'tiktok': ('tiktok.com',),
+    'youtube': ('youtube.com', 'youtu.be'),
+}
+
+QUALITY_HEIGHTS = {
+    'best': None,
+    '1080p': 1080,
+    '720p': 720,
+    '480p': 480,
+    '360p': 360,
+}
+
+# Relative bytes needed for the same visual quality (lower is better)
+CODEC_EFFICIENCY = {
+    'av01': 0.6,
+    'vp9': 0.75,
+    'hevc': 0.75,
+    'avc1': 1.0,
+}
+
+# Video codecs each merge container accepts, best player compatibility first
+CONTAINER_VIDEO_CODECS = {
+    'mp4': ('avc1', 'av01', 'hevc', 'vp9'),
+    'webm': ('vp9', 'av01'),
+    'mkv': ('avc1', 'vp9', 'av01', 'hevc'),
+}
+
+CONTAINER_AUDIO_CODECS = {
+    'mp4': ('mp4a', 'opus'),
+    'webm': ('opus', 'vorbis'),
+    'mkv': ('opus', 'mp4a', 'vorbis'),
+}
+
+# A separate audio download + ffmpeg merge costs roughly this much extra time
+MERGE_PENALTY = 1.3
+
+# Formats listed by /api/info/
+MAX_INFO_FORMATS = 20
+
+
+def summarize_format(f: dict) -> dict:
+    vcodec = f.get('vcodec')
+    acodec = f.get('acodec')
+    return {
+        'format_id': f.get('format_id'),
+        'quality': f.get('format_note', f.get('quality', 'unknown')),
+        'ext': f.get('ext'),
+        'filesize': f.get('filesize'),
+        'resolution': f.get('resolution'),
+        'fps': f.get('fps'),
+        'has_video': vcodec != 'none',
+        'has_audio': acodec != 'none',
+    }
+
+
+def detect_platform(url: str):
+    """Platform key for a URL by its hostname (not a substring of the whole URL)"""
+    host = (urlparse(url or '').hostname or '').lower().rstrip('.')
+    for platform, domains in PLATFORM_DOMAINS.items():
+        if any(host == d or host.endswith('.' + d) for d in domains):
+            return platform
+    return None
+
+
+def codec_family(codec) -> str:
+    codec = (codec or '').lower()
+    if codec in ('', 'none'):
+        return codec
+    if codec.startswith(('avc', 'h264')):
+        return 'avc1'
+    if codec.startswith(('hev', 'hvc', 'h265')):
+        return 'hevc'
+    if codec.startswith('av01'):
+        return 'av01'
+    if codec.startswith('vp9') or codec.startswith('vp09'):
+        return 'vp9'
+    if codec.startswith('mp4a') or codec == 'aac':
+        return 'mp4a'
+    return codec.split('.')[0]
+
+
+def has_video(f: dict) -> bool:
+    # Unknown codecs (None) are assumed present, as yt-dlp does
+    return f.get('vcodec') != 'none' and f.get('ext') != 'mhtml'
+
+
+def has_audio(f: dict) -> bool:
+    return f.get('acodec') != 'none'
+
+
+def estimate_size(f: dict, duration=None, total_duration=None):
+    """
+    Bytes fetched for `duration` seconds of a format: exact, approximate,
+    or from its bitrate. Listed sizes are for the whole video
+    (`total_duration`), so a clip gets its share of them.
+    """
+    size = f.get('filesize') or f.get('filesize_approx')
+    if size:
+        if duration and total_duration and duration < total_duration:
+            return int(size * duration / total_duration)
+        return size
+    if f.get('tbr') and duration:
+        return int(f['tbr'] * 1000 / 8 * duration)
+    return None
+
+
+@dataclass
+class FormatChoice:
+    video: dict
+    audio: dict = None
+    estimated_size: int = None
+
+    @property
+    def needs_merge(self) -> bool:
+        return self.audio is not None
+
+    @property
+    def format_spec(self) -> str:
+        if self.audio is not None:
+            return f"{self.video['format_id']}+{self.audio['format_id']}"
+        return self.video['format_id']
+
+    @property
+    def height(self) -> int:
+        return self.video.get('height') or 0
+
+    @property
+    def vcodec(self) -> str:
+        return codec_family(self.video.get('vcodec'))
+
+    def summary(self) -> dict:
+        return {
+            'format_id': self.format_spec,
+            'height': self.video.get('height'),
+            'vcodec': self.vcodec,
+            'acodec': codec_family((self.audio or self.video).get('acodec')),
+            'estimated_size': self.estimated_size,
+            'merged': self.needs_merge,
+        }
+
+
+def _codec_compat(vcodec: str, container: str) -> int:
+    """0 = best compatibility with the container; larger is worse"""
+    allowed = CONTAINER_VIDEO_CODECS.get(container) or ()
+    return allowed.index(vcodec) if vcodec in allowed else len(allowed) + 1
+
+
+def _unmergeable(o, container: str) -> bool:
+    # ffmpeg cannot merge e.g. H.264 into webm; only pick these as a last resort
+    return o.needs_merge and o.vcodec not in (CONTAINER_VIDEO_CODECS.get(container) or ())
+
+
+def _best_audio(audio_formats: list, container: str):
+    allowed = CONTAINER_AUDIO_CODECS.get(container) or ()
+    compatible = [a for a in audio_formats if codec_family(a.get('acodec')) in allowed]
+    if compatible:
+        # Container's native codec first (AAC for mp4), then bitrate
+        return min(compatible, key=lambda a: (
+            allowed.index(codec_family(a.get('acodec'))), -(a.get('abr') or a.get('tbr') or 0)))
+    if not audio_formats:
+        return None
+    return max(audio_formats, key=lambda a: (a.get('abr') or a.get('tbr') or 0))
+
+
+def candidates(formats: list, container: str = 'mp4', can_merge: bool = True, duration=None,
+               total_duration=None) -> list:
+    """Every deliverable option: progressive files, plus video-only + best audio if merging is possible"""
+    formats = [f for f in formats or [] if f.get('format_id') and f.get('url')]
+    options = []
+
+    for f in formats:
+        if has_video(f) and has_audio(f):
+            options.append(FormatChoice(f, None, estimate_size(f, duration, total_duration)))
+
+    if can_merge:
+        audio = _best_audio([f for f in formats if f.get('vcodec') == 'none' and has_audio(f)], container)
+        if audio is not None:
+            audio_size = estimate_size(audio, duration, total_duration) or 0
+            for f in formats:
+                if f.get('acodec') == 'none' and has_video(f):
+                    video_size = estimate_size(f, duration, total_duration)
+                    size = video_size + audio_size if video_size else None
+                    options.append(FormatChoice(f, audio, size))
+    return options
+
+
+def rank_formats(formats: list, quality: str = 'best', container: str = 'mp4', preference: str = 'quality',
+                 max_filesize: int = None, can_merge: bool = True, duration=None, total_duration=None) -> list:
+    """
+    Order delivery options best first.
+
+    quality:  highest resolution up to the target, then container
+              compatibility, codec efficiency and bitrate
+    max_size: like quality, but only options estimated under max_filesize
+    fastest:  fewest bytes to fetch (a merge counts as extra), at the
+              target resolution when available
+
+    `duration` is the length to fetch (a clip) of a `total_duration` video.
+    Formats without a known height rank below every known height.
+    """
+    options = candidates(formats, container, can_merge, duration, total_duration)
+    if not options:
+        return []
+
+    target = QUALITY_HEIGHTS.get(quality)
+    if target:
+        within = [o for o in options if o.height and o.height <= target]
+        unknown = [o for o in options if not o.height]
+        # Nothing known at or below the target: an unknown height may well be,
+        # else fall back to the smallest known height
+        options = within or unknown or sorted(options, key=lambda o: o.height)[:1]
+
+    if preference == 'max_size' and max_filesize:
+        fitting = [o for o in options if o.estimated_size and o.estimated_size <= max_filesize]
+        options = fitting or sorted(options, key=lambda o: o.estimated_size or float('inf'))[:1]
+
+    def quality_key(o):
+        return (
+            _unmergeable(o, container),
+            not o.height,
+            -o.height,
+            -(o.video.get('fps') or 0),
+            _codec_compat(o.vcodec, container),
+            CODEC_EFFICIENCY.get(o.vcodec, 1.0),
+            o.needs_merge,
+            -(o.video.get('tbr') or 0),
+        )
+
+    def delivery_key(o):
+        size = o.estimated_size or float('inf')
+        return (
+            _unmergeable(o, container),
+            size * (MERGE_PENALTY if o.needs_merge else 1.0),
+            _codec_compat(o.vcodec, container),
+            not o.height,
+            -o.height,
+        )
+
+    if preference == 'fastest':
+        if target:
+            # Stay at the requested resolution, just deliver it the cheapest way
+            top = max(o.height for o in options)
+            options = [o for o in options if o.height == top]
+        return sorted(options, key=delivery_key)
+    return sorted(options, key=quality_key)
+
+
+def choose_format(info: dict, quality: str = 'best', container: str = 'mp4', preference: str = 'quality',
+                  max_filesize: int = None, can_merge: bool = True, duration=None):
+    """
+    Best FormatChoice for an extracted info dict (None when it has no
+    format list). `duration` is the clip length when only a range is fetched.
+    """
+    ranked = rank_formats(
+        info.get('formats') or [],
+        quality=quality,
+        container=container,
+        preference=preference,
+        max_filesize=max_filesize,
+        can_merge=can_merge,
+        duration=duration or info.get('duration'),
+        total_duration=info.get('duration'),
+    )
+    return ranked[0] if ranked else None
+
+
+def apply_format(ydl, format_spec: str):
+    """Switch an open YoutubeDL to another format (its selector is compiled in __init__)"""
+    ydl.params['format'] = format_spec
+    ydl.format_selector = ydl.build_format_selector(format_spec)
@@ -0,0 +1,254 @@
+import importlib.util
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+from .formats import detect_platform
+
+DEFAULT_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+)
+
+PLATFORM_REFERERS = {
+    'tiktok': 'https://www.tiktok.com/',
+    'instagram': 'https://www.instagram.com/',
+    'facebook': 'https://www.facebook.com/',
+}
+
+# Error text that means the platform throttled us or wants a (different) login
+RATE_LIMIT_MARKERS = ('429', 'too many requests', 'rate-limit', 'rate limit')
+AUTH_MARKERS = ('login required', 'log in', 'cookies', '403', 'forbidden', 'not available in your country')
+
+
+@dataclass
+class Identity:
+    """A cookie jar and/or browser impersonation profile requests are made as"""
+    name: str
+    cookiefile: str = None
+    impersonate: str = None
+    user_agent: str = DEFAULT_USER_AGENT
+    platforms: tuple = ()
+    max_per_minute: int = 30
+
+    successes: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    in_flight: int = 0
+    cooldown_until: float = 0.0
+    last_used: float = 0.0
+    avg_latency: float = None
+    recent: deque = field(default_factory=deque)
+
+    def serves(self, platform) -> bool:
+        return not self.platforms or platform in self.platforms
+
+    def success_rate(self) -> float:
+        # Laplace-smoothed so new identities get a fair chance
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+    def over_rate_limit(self, now: float) -> bool:
+        while self.recent and now - self.recent[0] > 60:
+            self.recent.popleft()
+        return len(self.recent) >= self.max_per_minute
+
+    def stats(self) -> dict:
+        return {
+            'name': self.name,
+            'platforms': list(self.platforms),
+            'impersonate': self.impersonate,
+            'has_cookies': bool(self.cookiefile),
+            'successes': self.successes,
+            'failures': self.failures,
+            'success_rate': round(self.success_rate(), 3),
+            'in_flight': self.in_flight,
+            'cooling_down': self.cooldown_until > time.time(),
+            'avg_latency': round(self.avg_latency, 3) if self.avg_latency is not None else None,
+        }
+
+
+class IdentityPool:
+    """
+    Rotates identities across requests, preferring healthy, idle ones and
+    benching identities that get rate limited or repeatedly rejected.
+    """
+
+    def __init__(self, identities):
+        self.identities = list(identities)
+        self._lock = threading.Lock()
+
+    def acquire(self, platform=None) -> Identity:
+        now = time.time()
+        with self._lock:
+            eligible = [i for i in self.identities if i.serves(platform)] or self.identities
+            usable = [i for i in eligible if i.cooldown_until <= now and not i.over_rate_limit(now)]
+            if usable:
+                identity = min(usable, key=lambda i: (
+                    # Platform-specific identities (e.g. logged-in cookies) first
+                    not i.platforms,
+                    -round(i.success_rate(), 1),
+                    i.in_flight,
+                    i.last_used,
+                ))
+            else:
+                # Everything is benched: use whichever recovers first rather than failing
+                identity = min(eligible, key=lambda i: i.cooldown_until)
+            identity.in_flight += 1
+            identity.last_used = now
+            identity.recent.append(now)
+            return identity
+
+    def release(self, identity: Identity, error: Exception = None, latency: float = None):
+        now = time.time()
+        with self._lock:
+            identity.in_flight = max(identity.in_flight - 1, 0)
+            message = str(error).lower() if error is not None else ''
+
+            if error is None:
+                identity.successes += 1
+                identity.consecutive_failures = 0
+                if latency is not None:
+                    identity.avg_latency = latency if identity.avg_latency is None else (
+                        0.8 * identity.avg_latency + 0.2 * latency)
+            elif any(m in message for m in RATE_LIMIT_MARKERS):
+                identity.failures += 1
+                identity.consecutive_failures += 1
+                # Exponential back-off, capped at 15 minutes
+                identity.cooldown_until = now + min(30 * 2 ** (identity.consecutive_failures - 1), 900)
+            elif any(m in message for m in AUTH_MARKERS):
+                identity.failures += 1
+                identity.consecutive_failures += 1
+                if identity.consecutive_failures >= 3:
+                    identity.cooldown_until = now + 300
+            # Other errors (bad URL, missing format, ...) say nothing about the identity
+
+    def stats(self) -> list:
+        with self._lock:
+            return [i.stats() for i in self.identities]
+
+
+def impersonation_available() -> bool:
+    return importlib.util.find_spec('curl_cffi') is not None
+
+
+def load_identities() -> list:
+    """
+    Identities from YTDLP_IDENTITIES (a list of dicts), plus an anonymous
+    identity and one for the legacy cookies.txt when present.
+    """
+    impersonate = None
+    if getattr(settings, 'YTDLP_ENABLE_IMPERSONATION', False) and impersonation_available():
+        impersonate = getattr(settings, 'YTDLP_IMPERSONATE_TARGET', None)
+
+    identities = []
+    for i, spec in enumerate(getattr(settings, 'YTDLP_IDENTITIES', None) or []):
+        identities.append(Identity(
+            name=spec.get('name') or f'identity-{i}',
+            cookiefile=spec.get('cookiefile'),
+            impersonate=spec.get('impersonate', impersonate) if impersonation_available() else None,
+            user_agent=spec.get('user_agent') or DEFAULT_USER_AGENT,
+            platforms=tuple(spec.get('platforms') or ()),
+            max_per_minute=spec.get('max_per_minute') or settings.YTDLP_IDENTITY_MAX_PER_MINUTE,
+        ))
+
+    legacy_cookies = os.path.join(settings.BASE_DIR, 'cookies.txt')
+    if os.path.exists(legacy_cookies):
+        identities.append(Identity(
+            name='cookies.txt',
+            cookiefile=legacy_cookies,
+            impersonate=impersonate,
+            max_per_minute=settings.YTDLP_IDENTITY_MAX_PER_MINUTE,
+        ))
+
+    identities.append(Identity(
+        name='anonymous',
+        impersonate=impersonate,
+        max_per_minute=settings.YTDLP_IDENTITY_MAX_PER_MINUTE,
+    ))
+    return identities
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> IdentityPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = IdentityPool(load_identities())
+    return _pool
+
+
+def request_headers(identity: Identity = None, platform=None) -> dict:
+    """Plain HTTP headers for fetching media URLs outside yt-dlp"""
+    headers = {
+        'User-Agent': identity.user_agent if identity else DEFAULT_USER_AGENT,
+        'Accept-Language': 'en-US,en;q=0.9',
+    }
+    if platform in PLATFORM_REFERERS:
+        headers['Referer'] = PLATFORM_REFERERS[platform]
+    return headers
+
+
+def identity_options(identity: Identity, platform=None) -> dict:
+    """YoutubeDL options that make requests as this identity"""
+    options = {}
+    headers = request_headers(identity, platform)
+    # Impersonation only where TLS fingerprinting gates extraction
+    if identity.impersonate and platform in getattr(settings, 'YTDLP_IMPERSONATE_PLATFORMS', ()):
+        from yt_dlp.networking.impersonate import ImpersonateTarget
+
+        options['impersonate'] = ImpersonateTarget.from_str(identity.impersonate)
+        # The impersonated browser brings a matching User-Agent
+        headers.pop('User-Agent')
+    options['http_headers'] = headers
+    if identity.cookiefile:
+        options['cookiefile'] = identity.cookiefile
+
+    if platform == 'tiktok' and getattr(settings, 'YTDLP_TIKTOK_API_HOSTNAMES', None):
+        options['extractor_args'] = {'tiktok': {'api_hostname': list(settings.YTDLP_TIKTOK_API_HOSTNAMES)}}
+    return options
+
+
+@contextmanager
+def identity_for(url: str, ydl_opts: dict):
+    """
+    Pick an identity for `url`, merge its options into `ydl_opts` and
+    report the outcome back to the pool when the block exits.
+
+    The latency reported is the time to the first download progress (or
+    to the end of the block when nothing is downloaded): extraction and
+    first response, not how long the file took.
+    """
+    platform = detect_platform(url)
+    pool = get_pool()
+    identity = pool.acquire(platform)
+
+    options = identity_options(identity, platform)
+    ydl_opts['http_headers'] = {**options.pop('http_headers'), **(ydl_opts.get('http_headers') or {})}
+    ydl_opts.update(options)
+
+    started = time.monotonic()
+    first_progress = []
+
+    def on_progress(d):
+        if not first_progress:
+            first_progress.append(time.monotonic())
+
+    ydl_opts['progress_hooks'] = [on_progress, *(ydl_opts.get('progress_hooks') or [])]
+    try:
+        yield identity
+    except Exception as e:
+        pool.release(identity, error=e)
+        raise
+    else:
+        responded = first_progress[0] if first_progress else time.monotonic()
+        pool.release(identity, latency=responded - started)
+
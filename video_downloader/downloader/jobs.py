@@ -0,0 +1,208 @@
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from .models import VideoDownload
+from .notifications import publish_status
+
+# Statuses a download may be in before moving to the key status
+ALLOWED_TRANSITIONS = {
+    'queued': ('pending', 'downloading', 'merging'),
+    'downloading': ('pending', 'queued'),
+    'merging': ('downloading',),
+    'completed': ('downloading', 'merging'),
+    'failed': ('pending', 'queued', 'downloading', 'merging'),
+    'evicted': ('completed',),
+}
+
+# Statuses in which a worker holds the job's lease
+RUNNING_STATUSES = ('downloading', 'merging')
+
+# Job kinds the queue worker can run (audio jobs only run inside their request)
+QUEUE_KINDS = ('video',)
+
+
+class ProgressBuffer:
+    """
+    Coalesces high-frequency progress updates in memory and writes them
+    with a single bulk_update per flush interval.
+    """
+
+    def __init__(self, flush_interval: float = None):
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def _interval(self) -> float:
+        if self.flush_interval is not None:
+            return self.flush_interval
+        return getattr(settings, 'PROGRESS_FLUSH_INTERVAL', 2.0)
+
+    def record(self, pk: int, progress: float):
+        with self._lock:
+            self._pending[pk] = progress
+            due = time.monotonic() - self._last_flush >= self._interval()
+        if due:
+            self.flush()
+
+    def discard(self, pk: int):
+        with self._lock:
+            self._pending.pop(pk, None)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        rows = [VideoDownload(pk=pk, progress=progress) for pk, progress in pending.items()]
+        try:
+            VideoDownload.objects.bulk_update(rows, ['progress'])
+        except DatabaseError as e:
+            print(f"Progress flush failed: {e}")
+            return 0
+        return len(rows)
+
+
+progress_buffer = ProgressBuffer()
+
+
+def transition(video_download, new_status: str, event: dict = None, expected: tuple = None, **fields) -> bool:
+    """
+    Move a download to `new_status` with a single conditional UPDATE.
+
+    Only the status and the given columns are written, and only if the row
+    is still in one of the statuses allowed to precede `new_status` (or in
+    `expected`, for operator actions such as a retry).
+    `event` adds extra keys to the published notification.
+    """
+    expected = expected or ALLOWED_TRANSITIONS.get(new_status)
+    qs = VideoDownload.objects.filter(pk=video_download.pk)
+    if expected:
+        qs = qs.filter(status__in=expected)
+
+    if new_status in ('completed', 'failed', 'evicted'):
+        # A later flush must not overwrite the final progress value
+        progress_buffer.discard(video_download.pk)
+
+    if not qs.update(status=new_status, **fields):
+        return False
+
+    video_download.status = new_status
+    for name, value in fields.items():
+        setattr(video_download, name, value)
+    publish_status(video_download, **(event or {}))
+    return True
+
+
+def job_kind(video_download) -> str:
+    """'video' or 'audio', as recorded in the job's options"""
+    kind = (video_download.options or {}).get('kind')
+    if kind:
+        return kind
+    # Audio rows from before the kind was recorded
+    return 'audio' if video_download.quality == 'audio' else 'video'
+
+
+def is_queue_runnable(video_download) -> bool:
+    return job_kind(video_download) in QUEUE_KINDS
+
+
+def fail_download(video_download, error_message: str = '') -> bool:
+    """Mark a download as failed without letting a DB error mask the original one"""
+    try:
+        return transition(video_download, 'failed', event={'error': error_message})
+    except DatabaseError as e:
+        print(f"Could not mark download {video_download.pk} as failed: {e}")
+        return False
+
+
+def track_progress(video_download, d: dict):
+    """yt-dlp progress hook: buffer the download percentage"""
+    if d.get('status') != 'downloading':
+        return
+    total = d.get('total_bytes') or d.get('total_bytes_estimate')
+    if not total:
+        return
+    progress = min(round(d.get('downloaded_bytes', 0) * 100 / total, 1), 100.0)
+    progress_buffer.record(video_download.pk, progress)
+
+
+def worker_name() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def lease_seconds() -> int:
+    return getattr(settings, 'JOB_LEASE_SECONDS', 90)
+
+
+def lease_fields(worker_id: str) -> dict:
+    """Columns that hand a job's lease to `worker_id`"""
+    return {
+        'worker_id': worker_id,
+        'lease_expires_at': timezone.now() + timedelta(seconds=lease_seconds()),
+    }
+
+
+def renew_lease(video_download) -> bool:
+    """Extend the lease; False when the job was requeued or finished meanwhile"""
+    return bool(VideoDownload.objects
+                .filter(pk=video_download.pk, worker_id=video_download.worker_id, status__in=RUNNING_STATUSES)
+                .update(lease_expires_at=timezone.now() + timedelta(seconds=lease_seconds())))
+
+
+class LeaseHeartbeat:
+    """
+    Renews a running job's lease from a background thread.
+
+    If the process dies (gunicorn timeout, redeploy, OOM) the renewals stop,
+    the lease runs out and the worker's recovery pass requeues the job.
+    `lost` is set when a renewal finds the job no longer ours.
+    """
+
+    def __init__(self, video_download, interval: float = None):
+        self.video_download = video_download
+        self.interval = interval or lease_seconds() / 3
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    if not renew_lease(self.video_download):
+                        self.lost = True
+                        return
+                except DatabaseError as e:
+                    print(f"Lease renewal for download {self.video_download.pk} failed: {e}")
+        finally:
+            connection.close()
+
+    def check(self):
+        """yt-dlp progress hook: abort when another worker now owns the job"""
+        if self.lost:
+            raise Exception(f'Lease on download {self.video_download.pk} was lost')
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join(timeout=5)
+        return False
+
+
+def release_job(video_download) -> bool:
+    """Put a running job back in the queue now (graceful shutdown); partial files are kept"""
+    return transition(video_download, 'queued', event={'requeued': True},
+                      worker_id='', lease_expires_at=None)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from downloader.archive import ensure_checksums, needs_checksums
+
+
+class Command(BaseCommand):
+    help = 'Record size, CRC-32 and SHA-256 of stored downloads that predate checksums (archive exports need them)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Checksum at most this many downloads')
+
+    def handle(self, *args, **options):
+        downloads = needs_checksums().order_by('pk')
+        if options['limit'] is not None:
+            downloads = downloads[:options['limit']]
+
+        done = failed = 0
+        for video_download in downloads.iterator():
+            try:
+                ensure_checksums(video_download)
+                done += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"Download {video_download.pk}: {e}")
+        self.stdout.write(f"Checksummed {done} download(s), {failed} failed")
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from downloader.metering import METRICS
+from downloader.models import ApiKey
+
+
+class Command(BaseCommand):
+    help = 'Create an API key and print it (it is not stored and cannot be shown again)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name')
+        parser.add_argument('--weight', type=float, default=1.0, help='Fair-share weight in the download queue')
+        parser.add_argument('--soft', action='append', default=[], metavar='METRIC=N',
+                            help='Soft monthly quota, e.g. bytes_downloaded=10000000000 (repeatable)')
+        parser.add_argument('--hard', action='append', default=[], metavar='METRIC=N',
+                            help='Hard monthly quota (repeatable)')
+
+    def handle(self, *args, **options):
+        quotas = {}
+        for level in ('soft', 'hard'):
+            for item in options[level]:
+                metric, _, value = item.partition('=')
+                if metric not in METRICS:
+                    raise CommandError(f"Unknown metric {metric!r}; choose from {', '.join(METRICS)}")
+                try:
+                    quotas.setdefault(metric, {})[level] = float(value)
+                except ValueError:
+                    raise CommandError(f"Invalid quota value for {metric}: {value!r}")
+
+        api_key, raw_key = ApiKey.generate(options['name'], weight=options['weight'], quotas=quotas)
+        self.stdout.write(f"Created API key {api_key} (id {api_key.pk})")
+        self.stdout.write(raw_key)
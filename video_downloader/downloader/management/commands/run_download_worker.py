@@ -0,0 +1,107 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from downloader.archive import ensure_checksums, needs_checksums
+from downloader.jobs import progress_buffer, release_job
+from downloader.metering import account_storage, usage_meter
+from downloader.notifications import cache_is_shared
+from downloader.scheduler import LANES, Scheduler, WorkerHeartbeat, requeue_stale_jobs
+from downloader.tasks import claim_preview, requeue_stale_previews, run_preview_packaging, run_queued_download
+
+
+def _terminate(signum, frame):
+    # Redeploys send SIGTERM: unwind so the running job is handed back
+    raise SystemExit(0)
+
+
+class Command(BaseCommand):
+    help = 'Run queued downloads: lanes by weight, clients by fair share, short jobs first'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lanes', default=','.join(LANES),
+                            help='Comma-separated lanes to serve (e.g. "interactive" for a dedicated worker)')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument('--poll-interval', type=float,
+                            default=getattr(settings, 'DOWNLOAD_WORKER_POLL_INTERVAL', 2.0))
+
+    def recover(self):
+        requeued, failed = requeue_stale_jobs()
+        if requeued or failed:
+            self.stdout.write(f"Recovered stale jobs: {requeued} requeued, {failed} failed")
+        previews = requeue_stale_previews()
+        if previews:
+            self.stdout.write(f"Recovered stale previews: {previews} requeued")
+        account_storage()
+
+    def backfill_checksum(self, unreadable: set) -> bool:
+        """Checksum one stored file that predates checksums; False when none is left"""
+        video_download = needs_checksums().exclude(pk__in=unreadable).order_by('pk').first()
+        if video_download is None:
+            return False
+        try:
+            ensure_checksums(video_download)
+        except Exception as e:
+            self.stdout.write(f"Checksum backfill of download {video_download.pk} failed: {e}")
+            unreadable.add(video_download.pk)
+        return True
+
+    def handle(self, *args, **options):
+        lanes = [lane.strip() for lane in options['lanes'].split(',') if lane.strip()]
+        unknown = set(lanes) - set(LANES)
+        if unknown:
+            raise CommandError(f"Unknown lanes: {', '.join(sorted(unknown))}")
+        if not cache_is_shared():
+            raise CommandError("The download worker needs a cache shared with the web process "
+                               "(set REDIS_URL): job events would never reach /api/events/ streams")
+
+        signal.signal(signal.SIGTERM, _terminate)
+        scheduler = Scheduler(lanes)
+        recovery_interval = getattr(settings, 'JOB_RECOVERY_INTERVAL', 30)
+        self.stdout.write(f"Download worker {scheduler.worker_id} serving lanes: {', '.join(lanes)}")
+
+        video_download = None
+        last_recovery = 0.0
+        # Downloads whose checksum backfill failed (e.g. file gone); not retried by this process
+        unreadable = set()
+        heartbeat = WorkerHeartbeat(scheduler.worker_id)
+        heartbeat.start()
+        try:
+            while True:
+                if time.monotonic() - last_recovery >= recovery_interval:
+                    self.recover()
+                    last_recovery = time.monotonic()
+
+                # Previews first: whoever asked for one already has the file and is waiting
+                preview = claim_preview()
+                if preview is not None:
+                    self.stdout.write(f"[preview] download {preview.pk}")
+                    ok = run_preview_packaging(preview)
+                    self.stdout.write(f"  -> {'packaged' if ok else 'failed'}")
+                    continue
+
+                video_download = scheduler.claim_next()
+                if video_download is None:
+                    # Idle: checksum one stored file that predates checksums (archive exports need them)
+                    if self.backfill_checksum(unreadable):
+                        continue
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                self.stdout.write(f"[{video_download.lane}] download {video_download.pk} "
+                                  f"(attempt {video_download.attempts}): {video_download.url}")
+                ok = run_queued_download(video_download)
+                self.stdout.write(f"  -> {'completed' if ok else 'failed'}")
+                video_download = None
+        except (KeyboardInterrupt, SystemExit):
+            # Hand the job back right away instead of waiting for its lease to run out
+            if video_download is not None and release_job(video_download):
+                self.stdout.write(f"Released download {video_download.pk} back to the queue")
+        finally:
+            heartbeat.stop()
+            progress_buffer.flush()
+            usage_meter.flush()
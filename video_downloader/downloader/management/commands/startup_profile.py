@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Imports the same modules a gunicorn worker needs before serving a request
+PROFILE_SCRIPT = """
+import os, time, json
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'video_downloader.settings')
+started = time.perf_counter()
+import django
+django.setup()
+setup_done = time.perf_counter()
+from downloader.warmup import warm_up, warm_up_report
+warm_up()
+print(json.dumps({
+    'django_setup': round(setup_done - started, 3),
+    'warm_up': warm_up_report(),
+    'total': round(time.perf_counter() - started, 3),
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = 'Profile worker startup: slowest imports and warm-up stage timings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=25, help='Number of imports to list')
+
+    def handle(self, *args, **options):
+        # Fresh interpreter so nothing is already imported
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROFILE_SCRIPT],
+            capture_output=True,
+            text=True,
+            cwd=settings.BASE_DIR,
+            env={**os.environ, 'PYTHONPATH': str(settings.BASE_DIR)},
+        )
+        if result.returncode != 0:
+            self.stderr.write(result.stderr[-2000:])
+            return
+
+        top_level = []
+        for line in result.stderr.splitlines():
+            # "import time: self [us] | cumulative | imported package"
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            # Nested imports are indented; top-level ones include their submodules
+            if name.startswith('  '):
+                continue
+            top_level.append((int(cumulative_us), name.strip()))
+        top_level.sort(reverse=True)
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Slowest top-level imports (cumulative ms)'))
+        for cumulative_us, name in top_level[:options['top']]:
+            self.stdout.write(f'  {cumulative_us / 1000:9.1f}  {name}')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Startup stages (s)'))
+        self.stdout.write(f'  {result.stdout.strip().splitlines()[-1]}')
@@ -0,0 +1,147 @@
+"""
+Per-API-key usage metering.
+
+Amounts are summed in memory per (key, metric) and written with one
+UPDATE ... SET metric = metric + n per key and flush interval, so metering
+a busy endpoint does not add a write per request. Quota checks read the
+stored totals (cached briefly) plus whatever this process has not flushed.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import ApiKeyUsage, VideoDownload
+
+METRICS = ('requests', 'extraction_seconds', 'bytes_downloaded', 'bytes_served', 'storage_byte_seconds')
+
+
+def current_period():
+    """Usage is accounted per calendar month (UTC)"""
+    return timezone.now().date().replace(day=1)
+
+
+class UsageMeter:
+    def __init__(self, flush_interval: float = None):
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def _interval(self) -> float:
+        if self.flush_interval is not None:
+            return self.flush_interval
+        return getattr(settings, 'USAGE_FLUSH_INTERVAL', 10.0)
+
+    def record(self, api_key_id, **amounts):
+        if not api_key_id:
+            return
+        with self._lock:
+            pending = self._pending.setdefault(api_key_id, dict.fromkeys(METRICS, 0))
+            for metric, amount in amounts.items():
+                pending[metric] += amount
+            due = time.monotonic() - self._last_flush >= self._interval()
+        if due:
+            self.flush()
+
+    def pending(self, api_key_id) -> dict:
+        with self._lock:
+            return dict(self._pending.get(api_key_id) or dict.fromkeys(METRICS, 0))
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        period = current_period()
+        try:
+            ApiKeyUsage.objects.bulk_create(
+                [ApiKeyUsage(api_key_id=pk, period=period) for pk in pending],
+                ignore_conflicts=True,
+            )
+            for pk, amounts in pending.items():
+                ApiKeyUsage.objects.filter(api_key_id=pk, period=period).update(
+                    **{metric: F(metric) + amount for metric, amount in amounts.items() if amount},
+                    updated_at=timezone.now(),
+                )
+        except DatabaseError as e:
+            print(f"Usage flush failed: {e}")
+            return 0
+        return len(pending)
+
+
+usage_meter = UsageMeter()
+
+
+def record_usage(api_key_id, **amounts):
+    usage_meter.record(api_key_id, **amounts)
+
+
+@contextmanager
+def measure(api_key_id, metric: str = 'extraction_seconds'):
+    """Meter the wall time of a block (e.g. a yt-dlp extraction)"""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        record_usage(api_key_id, **{metric: time.monotonic() - started})
+
+
+def usage_totals(api_key) -> dict:
+    """This period's usage: stored totals (cached for a few seconds) plus unflushed amounts"""
+    cache_key = f'usage:{api_key.pk}:{current_period():%Y%m}'
+    stored = cache.get(cache_key)
+    if stored is None:
+        row = (ApiKeyUsage.objects
+               .filter(api_key=api_key, period=current_period())
+               .values(*METRICS)
+               .first())
+        stored = row or dict.fromkeys(METRICS, 0)
+        cache.set(cache_key, stored, getattr(settings, 'USAGE_CACHE_SECONDS', 10))
+    pending = usage_meter.pending(api_key.pk)
+    return {metric: stored[metric] + pending[metric] for metric in METRICS}
+
+
+def check_quota(api_key):
+    """Returns (hard-exceeded metrics, soft-exceeded metrics)"""
+    quotas = api_key.quotas or {}
+    if not quotas:
+        return [], []
+    totals = usage_totals(api_key)
+    hard, soft = [], []
+    for metric, limits in quotas.items():
+        if metric not in totals or not isinstance(limits, dict):
+            continue
+        if limits.get('hard') is not None and totals[metric] >= limits['hard']:
+            hard.append(metric)
+        elif limits.get('soft') is not None and totals[metric] >= limits['soft']:
+            soft.append(metric)
+    return hard, soft
+
+
+def account_storage():
+    """
+    Charge every key storage-seconds for its stored files. Runs at most once
+    per USAGE_STORAGE_INTERVAL across all processes (the cache decides who).
+    """
+    interval = getattr(settings, 'USAGE_STORAGE_INTERVAL', 300)
+    bucket = int(time.time() // interval)
+    if not cache.add(f'usage:storage:{bucket}', 1, interval * 2):
+        return 0
+
+    stored = (VideoDownload.objects
+              .filter(status='completed', api_key__isnull=False)
+              .values('api_key')
+              .annotate(total=Sum('file_size')))
+    for row in stored:
+        if row['total']:
+            record_usage(row['api_key'], storage_byte_seconds=row['total'] * interval)
+    usage_meter.flush()
+    return len(stored)
@@ -0,0 +1,137 @@
+import gzip
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    'application/json',
+    'application/vnd.apple.mpegurl',
+    'text/',
+)
+
+
+def _compress_zstd(content: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=getattr(settings, 'COMPRESSION_ZSTD_LEVEL', 3)).compress(content)
+
+
+def _compress_br(content: bytes) -> bytes:
+    return brotli.compress(content, quality=getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 5))
+
+
+def _compress_gzip(content: bytes) -> bytes:
+    return gzip.compress(content, compresslevel=getattr(settings, 'COMPRESSION_GZIP_LEVEL', 6), mtime=0)
+
+
+# Server preference, best ratio/speed first; only codecs whose module is installed
+ENCODERS = [
+    (name, encoder) for name, encoder, available in (
+        ('zstd', _compress_zstd, zstandard is not None),
+        ('br', _compress_br, brotli is not None),
+        ('gzip', _compress_gzip, True),
+    ) if available
+]
+
+
+def parse_accept_encoding(header: str) -> dict:
+    """{'gzip': 1.0, 'br': 0.5, ...} from an Accept-Encoding header"""
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def negotiate_encoding(header: str):
+    accepted = parse_accept_encoding(header or '')
+    best = None
+    for name, encoder in ENCODERS:
+        q = accepted.get(name, accepted.get('*', 0.0))
+        if q > 0 and (best is None or q > best[0]):
+            best = (q, name, encoder)
+    return best[1:] if best else (None, None)
+
+
+class CompressionMiddleware:
+    """
+    Compress API responses with zstd, brotli or gzip, negotiated on
+    Accept-Encoding. Streaming/file responses (media, SSE) are left alone.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '')
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        if len(response.content) < getattr(settings, 'COMPRESSION_MIN_SIZE', 500):
+            return response
+
+        name, encoder = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if not name:
+            return response
+
+        compressed = encoder(response.content)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = name
+        if response.has_header('ETag'):
+            # Strong ETags must differ between encodings
+            response['ETag'] = response['ETag'].rstrip('"') + f'-{name}"'
+        return response
+
+
+class UsageMiddleware:
+    """
+    Meter one request per call for API-key authenticated requests (DRF sets
+    `request.auth` on the underlying request) and surface soft-quota
+    overruns in an X-Quota-Warning header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        api_key = getattr(request, 'auth', None)
+        if api_key is None or not hasattr(api_key, 'quotas'):
+            return response
+
+        from .metering import record_usage
+
+        record_usage(api_key.pk, requests=1)
+        warning = getattr(api_key, 'quota_warning', '')
+        if warning:
+            response['X-Quota-Warning'] = f'Soft quota exceeded: {warning}'
+        return response
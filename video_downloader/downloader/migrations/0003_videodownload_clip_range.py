@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0002_alter_videodownload_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videodownload',
+            name='clip_start',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='videodownload',
+            name='clip_end',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='videodownload',
+            name='clip_chapters',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0003_videodownload_clip_range'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videodownload',
+            name='callback_url',
+            field=models.URLField(blank=True, max_length=1000),
+        ),
+        migrations.AddField(
+            model_name='videodownload',
+            name='client_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0004_videodownload_notifications'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videodownload',
+            name='progress',
+            field=models.FloatField(default=0),
+        ),
+    ]
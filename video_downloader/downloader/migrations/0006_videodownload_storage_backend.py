@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0005_videodownload_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videodownload',
+            name='storage_backend',
+            field=models.CharField(default='local', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0006_videodownload_storage_backend'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videodownload',
+            name='hls_path',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
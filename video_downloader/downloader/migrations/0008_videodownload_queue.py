@@ -0,0 +1,56 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0007_videodownload_hls_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videodownload',
+            name='lane',
+            field=models.CharField(default='interactive', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='videodownload',
+            name='owner',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='videodownload',
+            name='options',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='videodownload',
+            name='estimated_cost',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='videodownload',
+            name='fair_tag',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='videodownload',
+            name='queued_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='videodownload',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='videodownload',
+            index=models.Index(fields=['status', 'lane', 'fair_tag'], name='downloader_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videodownload',
+            index=models.Index(fields=['lane', 'started_at'], name='downloader_lane_started_idx'),
+        ),
+    ]
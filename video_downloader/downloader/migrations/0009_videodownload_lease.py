@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0008_videodownload_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videodownload',
+            name='worker_id',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='videodownload',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='videodownload',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='videodownload',
+            index=models.Index(fields=['status', 'lease_expires_at'], name='downloader_lease_idx'),
+        ),
+    ]
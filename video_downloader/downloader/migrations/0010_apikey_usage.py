@@ -0,0 +1,51 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0009_videodownload_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('prefix', models.CharField(max_length=12, unique=True)),
+                ('key_hash', models.CharField(max_length=64)),
+                ('is_active', models.BooleanField(default=True)),
+                ('quotas', models.JSONField(blank=True, default=dict)),
+                ('weight', models.FloatField(default=1.0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ApiKeyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('requests', models.BigIntegerField(default=0)),
+                ('extraction_seconds', models.FloatField(default=0)),
+                ('bytes_downloaded', models.BigIntegerField(default=0)),
+                ('bytes_served', models.BigIntegerField(default=0)),
+                ('storage_byte_seconds', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('api_key', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='downloader.apikey')),
+            ],
+            options={
+                'ordering': ['-period'],
+                'constraints': [models.UniqueConstraint(fields=('api_key', 'period'), name='downloader_usage_key_period')],
+            },
+        ),
+        migrations.AddField(
+            model_name='videodownload',
+            name='api_key',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='downloads', to='downloader.apikey'),
+        ),
+    ]
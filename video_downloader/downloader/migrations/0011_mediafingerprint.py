@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-18 16:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0010_apikey_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64)),
+                ('file_size', models.BigIntegerField(blank=True, null=True)),
+                ('duration', models.FloatField(blank=True, null=True)),
+                ('frame_hashes', models.JSONField(blank=True, default=list)),
+                ('video_hash', models.CharField(blank=True, max_length=16)),
+                ('band0', models.CharField(blank=True, max_length=4)),
+                ('band1', models.CharField(blank=True, max_length=4)),
+                ('band2', models.CharField(blank=True, max_length=4)),
+                ('band3', models.CharField(blank=True, max_length=4)),
+                ('audio_fingerprint', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('download', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint', to='downloader.videodownload')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['sha256'], name='downloader_fp_sha256_idx'), models.Index(fields=['band0'], name='downloader_fp_band0_idx'), models.Index(fields=['band1'], name='downloader_fp_band1_idx'), models.Index(fields=['band2'], name='downloader_fp_band2_idx'), models.Index(fields=['band3'], name='downloader_fp_band3_idx')],
+            },
+        ),
+    ]
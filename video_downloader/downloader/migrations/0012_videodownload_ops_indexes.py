@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-18 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0011_mediafingerprint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='videodownload',
+            name='url',
+            field=models.URLField(db_index=True, max_length=1000),
+        ),
+        migrations.AddIndex(
+            model_name='videodownload',
+            index=models.Index(fields=['created_at', 'platform', 'status'], name='downloader_recent_idx'),
+        ),
+    ]
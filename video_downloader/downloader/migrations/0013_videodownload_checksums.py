@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0012_videodownload_ops_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videodownload',
+            name='crc32',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='videodownload',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
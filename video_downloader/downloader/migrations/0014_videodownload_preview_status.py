@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0013_videodownload_checksums'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videodownload',
+            name='preview_status',
+            field=models.CharField(blank=True, db_index=True, max_length=20),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:00
+
+from django.db import migrations, models
+
+
+def copy_fingerprint_sha256(apps, schema_editor):
+    # Downloads fingerprinted before their checksums were recorded
+    MediaFingerprint = apps.get_model('downloader', 'MediaFingerprint')
+    VideoDownload = apps.get_model('downloader', 'VideoDownload')
+    for download_id, sha256 in (MediaFingerprint.objects
+                                .filter(download__sha256='')
+                                .values_list('download_id', 'sha256')
+                                .iterator()):
+        VideoDownload.objects.filter(pk=download_id).update(sha256=sha256)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('downloader', '0014_videodownload_preview_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='videodownload',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.RunPython(copy_fingerprint_sha256, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='mediafingerprint',
+            name='downloader_fp_sha256_idx',
+        ),
+        migrations.RemoveField(
+            model_name='mediafingerprint',
+            name='sha256',
+        ),
+    ]
@@ -1,8 +1,73 @@
+import hashlib
+import secrets
+
 from django.db import models
 from django.utils import timezone
 
+
+class ApiKey(models.Model):
+    """
+    Credentials of one integration. Only a SHA-256 of the key is stored;
+    `prefix` (its first characters) finds the row.
+
+    `quotas` maps a usage metric to {"soft": n, "hard": n} per monthly period:
+    past soft a warning header is sent, past hard requests are refused.
+    """
+    name = models.CharField(max_length=100)
+    prefix = models.CharField(max_length=12, unique=True)
+    key_hash = models.CharField(max_length=64)
+    is_active = models.BooleanField(default=True)
+    quotas = models.JSONField(default=dict, blank=True)
+    # Fair-share weight of this key's jobs in the download queue
+    weight = models.FloatField(default=1.0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    PREFIX_LENGTH = 8
+
+    def __str__(self):
+        return f"{self.name} ({self.prefix})"
+
+    @staticmethod
+    def hash_key(raw_key: str) -> str:
+        return hashlib.sha256(raw_key.encode()).hexdigest()
+
+    @classmethod
+    def generate(cls, name: str, **fields):
+        """Create a key; returns (api_key, raw_key). The raw key is not stored."""
+        raw_key = secrets.token_urlsafe(32)
+        api_key = cls.objects.create(
+            name=name,
+            prefix=raw_key[:cls.PREFIX_LENGTH],
+            key_hash=cls.hash_key(raw_key),
+            **fields
+        )
+        return api_key, raw_key
+
+
+class ApiKeyUsage(models.Model):
+    """Metered usage of one API key in one monthly period"""
+    api_key = models.ForeignKey(ApiKey, on_delete=models.CASCADE, related_name='usage')
+    period = models.DateField()
+    requests = models.BigIntegerField(default=0)
+    extraction_seconds = models.FloatField(default=0)
+    bytes_downloaded = models.BigIntegerField(default=0)
+    bytes_served = models.BigIntegerField(default=0)
+    storage_byte_seconds = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-period']
+        constraints = [
+            models.UniqueConstraint(fields=['api_key', 'period'], name='downloader_usage_key_period'),
+        ]
+
+    def __str__(self):
+        return f"{self.api_key} {self.period:%Y-%m}"
+
+
 class VideoDownload(models.Model):
-    url = models.URLField(max_length=1000)
+    # Indexed for URL-prefix search in the admin
+    url = models.URLField(max_length=1000, db_index=True)
     title = models.CharField(max_length=500, blank=True)
     platform = models.CharField(max_length=100, blank=True)
     thumbnail = models.URLField(max_length=1000, blank=True)
@@ -10,11 +75,79 @@ class VideoDownload(models.Model):
     quality = models.CharField(max_length=50, default='best')
     file_path = models.CharField(max_length=500, blank=True)
     file_size = models.BigIntegerField(null=True, blank=True)
+    # Checksums of the stored file, for archive exports (see archive.py);
+    # sha256 also finds exact duplicates (see fingerprint.py)
+    crc32 = models.BigIntegerField(null=True, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+    storage_backend = models.CharField(max_length=20, default='local')
+    hls_path = models.CharField(max_length=500, blank=True)
+    # HLS preview: '' (none), 'pending' / 'packaging' (queue worker), 'ready' or 'failed'
+    preview_status = models.CharField(max_length=20, blank=True, db_index=True)
     status = models.CharField(max_length=50, default='pending')
+    progress = models.FloatField(default=0)
+    clip_start = models.FloatField(null=True, blank=True)
+    clip_end = models.FloatField(null=True, blank=True)
+    clip_chapters = models.JSONField(default=list, blank=True)
+    callback_url = models.URLField(max_length=1000, blank=True)
+    client_id = models.CharField(max_length=100, blank=True, db_index=True)
+    api_key = models.ForeignKey(ApiKey, null=True, blank=True, on_delete=models.SET_NULL,
+                                related_name='downloads')
+    # Job queue (see scheduler.py): lane, fair-share owner and WFQ finish tag
+    lane = models.CharField(max_length=20, default='interactive')
+    owner = models.CharField(max_length=100, blank=True)
+    options = models.JSONField(default=dict, blank=True)
+    estimated_cost = models.FloatField(null=True, blank=True)
+    fair_tag = models.FloatField(null=True, blank=True)
+    queued_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Lease held by the process running the job, renewed by its heartbeat
+    worker_id = models.CharField(max_length=100, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'lane', 'fair_tag'], name='downloader_queue_idx'),
+            models.Index(fields=['lane', 'started_at'], name='downloader_lane_started_idx'),
+            models.Index(fields=['status', 'lease_expires_at'], name='downloader_lease_idx'),
+            # Recent jobs per platform/status (ops dashboard)
+            models.Index(fields=['created_at', 'platform', 'status'], name='downloader_recent_idx'),
+        ]
     
     def __str__(self):
         return f"{self.title[:50]} - {self.platform}"
+
+
+class MediaFingerprint(models.Model):
+    """
+    Content fingerprint of a completed download, for finding the same media
+    behind different URLs (see fingerprint.py).
+
+    `frame_hashes` are 64-bit dHashes (hex) of frames sampled at fixed
+    fractions of the duration; `video_hash` is their bitwise majority and is
+    indexed as four 16-bit bands. `audio_fingerprint` is a raw Chromaprint.
+    """
+    download = models.OneToOneField(VideoDownload, on_delete=models.CASCADE, related_name='fingerprint')
+    file_size = models.BigIntegerField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    frame_hashes = models.JSONField(default=list, blank=True)
+    video_hash = models.CharField(max_length=16, blank=True)
+    band0 = models.CharField(max_length=4, blank=True)
+    band1 = models.CharField(max_length=4, blank=True)
+    band2 = models.CharField(max_length=4, blank=True)
+    band3 = models.CharField(max_length=4, blank=True)
+    audio_fingerprint = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['band0'], name='downloader_fp_band0_idx'),
+            models.Index(fields=['band1'], name='downloader_fp_band1_idx'),
+            models.Index(fields=['band2'], name='downloader_fp_band2_idx'),
+            models.Index(fields=['band3'], name='downloader_fp_band3_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.video_hash or 'no video hash'} ({self.download_id})"
@@ -0,0 +1,239 @@
+import hashlib
+import hmac
+import ipaddress
+import json
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Statuses pushed to webhooks / SSE streams
+NOTIFY_STATUSES = ('queued', 'downloading', 'merging', 'completed', 'failed', 'evicted')
+TERMINAL_STATUSES = ('completed', 'failed', 'evicted')
+
+EVENT_LOG_SIZE = 50
+EVENT_LOG_TTL = 3600
+# Publishers take a short lock per channel; a stuck lock expires on its own
+EVENT_LOCK_TIMEOUT = 5
+EVENT_LOCK_ATTEMPTS = 50
+
+# Cache backends private to one process: events published by the download
+# worker would never reach the web process's SSE streams
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def job_channel(pk) -> str:
+    return f"events:job:{pk}"
+
+
+def client_channel(client_id: str) -> str:
+    return f"events:client:{client_id}"
+
+
+def build_event(video_download, status: str, **extra) -> dict:
+    event = {
+        'id': video_download.id,
+        'status': status,
+        'title': video_download.title,
+        'platform': video_download.platform,
+        'timestamp': time.time(),
+    }
+    if status == 'completed':
+        event['download_url'] = f'/api/file/{video_download.id}/'
+        event['size'] = video_download.file_size
+    event.update(extra)
+    return event
+
+
+def _append_event(channel: str, seq: int, event: dict):
+    # Small capped log per channel so SSE clients can catch up via Last-Event-ID.
+    # The read-modify-write runs under a lock (cache.add is atomic) so
+    # concurrent publishers do not drop each other's events.
+    lock_key = f'{channel}:lock'
+    for _ in range(EVENT_LOCK_ATTEMPTS):
+        if cache.add(lock_key, 1, EVENT_LOCK_TIMEOUT):
+            break
+        time.sleep(0.01)
+    else:
+        print(f"Event log {channel} is busy, appending without the lock")
+        lock_key = None
+    try:
+        log = cache.get(channel) or []
+        log.append((seq, event))
+        log.sort(key=lambda item: item[0])
+        cache.set(channel, log[-EVENT_LOG_SIZE:], EVENT_LOG_TTL)
+    finally:
+        if lock_key:
+            cache.delete(lock_key)
+
+
+def _next_seq() -> int:
+    # add() only creates the counter when it is missing, so racing first publishers share it
+    cache.add('events:seq', 0, None)
+    return cache.incr('events:seq')
+
+
+def cache_is_shared() -> bool:
+    """Whether the event log is visible to every process (Redis, memcached, database, ...)"""
+    return settings.CACHES.get('default', {}).get('BACKEND') not in PROCESS_LOCAL_CACHES
+
+
+def read_events(channel: str, after: int = 0) -> list:
+    """Return (seq, event) pairs on a channel newer than `after`"""
+    return [(seq, event) for seq, event in (cache.get(channel) or []) if seq > after]
+
+
+def sign_payload(body: bytes, timestamp: str) -> str:
+    secret = getattr(settings, 'WEBHOOK_SIGNING_SECRET', None) or settings.SECRET_KEY
+    message = timestamp.encode() + b'.' + body
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split('%')[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def resolve_callback(callback_url: str) -> list:
+    """
+    Addresses to deliver a callback to: only http(s) URLs whose host
+    resolves to public addresses ([] otherwise), so a callback cannot
+    reach the internal network or cloud metadata endpoints.
+    """
+    parts = urlsplit(callback_url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return []
+    try:
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        addresses = sorted({info[4][0] for info in socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)})
+    except (socket.gaierror, ValueError):
+        return []
+    if getattr(settings, 'WEBHOOK_ALLOW_PRIVATE_ADDRESSES', False):
+        return addresses
+    return addresses if all(is_public_address(address) for address in addresses) else []
+
+
+def callback_url_allowed(callback_url: str) -> bool:
+    return bool(resolve_callback(callback_url))
+
+
+def pinned_request(callback_url: str, address: str) -> tuple:
+    """
+    (url, Host header, session) that connect to `address`, already
+    validated, instead of resolving the callback's host again: a second
+    lookup could return an internal address (DNS rebinding). The hostname
+    is still what goes into Host, SNI and the certificate check.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    parts = urlsplit(callback_url)
+    userinfo, _, host = parts.netloc.rpartition('@')
+
+    class PinnedHostAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            # Ignored by plain-http pools
+            kwargs.update(server_hostname=parts.hostname, assert_hostname=parts.hostname)
+            super().init_poolmanager(*args, **kwargs)
+
+    netloc = f'[{address}]' if ':' in address else address
+    if parts.port:
+        netloc = f'{netloc}:{parts.port}'
+    if userinfo:
+        netloc = f'{userinfo}@{netloc}'
+    session = requests.Session()
+    session.mount(f'{parts.scheme}://', PinnedHostAdapter())
+    return parts._replace(netloc=netloc).geturl(), host, session
+
+
+def deliver_webhook(callback_url: str, event: dict):
+    """POST a signed event to a callback URL with bounded retry"""
+    import requests  # only needed when a callback URL is registered
+
+    addresses = resolve_callback(callback_url)
+    if not addresses:
+        print(f"Webhook delivery to {callback_url} refused: not a public http(s) address")
+        return False
+    url, host, session = pinned_request(callback_url, addresses[0])
+
+    max_attempts = getattr(settings, 'WEBHOOK_MAX_ATTEMPTS', 3)
+    timeout = getattr(settings, 'WEBHOOK_TIMEOUT', 5)
+
+    body = json.dumps(event, separators=(',', ':'), sort_keys=True).encode()
+    timestamp = str(int(time.time()))
+    headers = {
+        'Host': host,
+        'Content-Type': 'application/json',
+        'X-Webhook-Timestamp': timestamp,
+        'X-Webhook-Signature': f'sha256={sign_payload(body, timestamp)}',
+    }
+
+    try:
+        for attempt in range(max_attempts):
+            try:
+                # Redirects are not followed: they could point at an internal address
+                r = session.post(url, data=body, headers=headers, timeout=timeout, allow_redirects=False)
+                # Client errors (other than rate limiting) will not succeed on retry
+                if r.status_code < 500 and r.status_code != 429:
+                    return r.status_code < 400
+            except requests.RequestException as e:
+                print(f"Webhook delivery to {callback_url} failed: {e}")
+            if attempt < max_attempts - 1:
+                time.sleep(2 ** attempt)
+        return False
+    finally:
+        session.close()
+
+
+def publish_status(video_download, status: str = None, **extra):
+    """Push a status transition to SSE channels and the job's callback URL"""
+    status = status or video_download.status
+    if status not in NOTIFY_STATUSES:
+        return None
+
+    event = build_event(video_download, status, **extra)
+    seq = _next_seq()
+    _append_event(job_channel(video_download.id), seq, event)
+    if video_download.client_id:
+        _append_event(client_channel(video_download.client_id), seq, event)
+
+    if video_download.callback_url:
+        threading.Thread(
+            target=deliver_webhook,
+            args=(video_download.callback_url, event),
+            daemon=True,
+        ).start()
+    return event
+
+
+def event_stream(channel: str, last_event_id: int = 0, stop_on_terminal: bool = False):
+    """Generator producing Server-Sent-Events for a channel"""
+    poll_interval = getattr(settings, 'SSE_POLL_INTERVAL', 0.5)
+    keepalive = getattr(settings, 'SSE_KEEPALIVE_SECONDS', 15)
+    # Each open stream holds a web thread: keep streams short, clients
+    # reconnect (after `retry`) and resume from Last-Event-ID
+    max_seconds = getattr(settings, 'SSE_MAX_SECONDS', 30)
+
+    yield f"retry: {int(poll_interval * 1000)}\n\n"
+
+    started = last_sent = time.monotonic()
+    while time.monotonic() - started < max_seconds:
+        for seq, event in read_events(channel, last_event_id):
+            last_event_id = seq
+            last_sent = time.monotonic()
+            yield f"id: {seq}\nevent: {event['status']}\ndata: {json.dumps(event)}\n\n"
+            if stop_on_terminal and event['status'] in TERMINAL_STATUSES:
+                return
+
+        if time.monotonic() - last_sent >= keepalive:
+            last_sent = time.monotonic()
+            yield ": keepalive\n\n"
+        time.sleep(poll_interval)
@@ -0,0 +1,150 @@
+"""
+Aggregates for the operations dashboard (admin: Video downloads > Operations).
+
+Every query is an indexed range or grouped count on a narrow slice of the
+table (queued/running rows, rows created in the last OPS_WINDOW_SECONDS),
+and the whole snapshot is cached for OPS_CACHE_SECONDS, so the page can
+refresh every few seconds against a large table. The total stored size
+needs a wider scan and is cached separately for longer.
+"""
+import shutil
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, Sum
+from django.utils import timezone
+
+from .identities import get_pool
+from .jobs import RUNNING_STATUSES
+from .models import VideoDownload
+from .prefetch import cache_hit_ratios, prefetch_disk_usage
+from .scheduler import LANES
+
+MAX_ACTIVE_JOBS = 50
+
+
+def queue_depth() -> dict:
+    """Queued jobs per lane and how long the oldest has waited"""
+    now = timezone.now()
+    rows = (VideoDownload.objects
+            .filter(status='queued')
+            .values('lane')
+            .annotate(depth=Count('id'), oldest=Min('queued_at')))
+    depth = {lane: {'depth': 0, 'oldest_wait': None} for lane in LANES}
+    for row in rows:
+        depth[row['lane']] = {
+            'depth': row['depth'],
+            'oldest_wait': round((now - row['oldest']).total_seconds()) if row['oldest'] else None,
+        }
+    return depth
+
+
+def active_jobs(limit: int = MAX_ACTIVE_JOBS) -> list:
+    now = timezone.now()
+    jobs = (VideoDownload.objects
+            .filter(status__in=RUNNING_STATUSES)
+            .only('id', 'title', 'url', 'platform', 'status', 'lane', 'progress', 'worker_id',
+                  'started_at', 'attempts', 'lease_expires_at')
+            .order_by('started_at')[:limit])
+    return [{
+        'id': job.id,
+        'title': job.title or job.url,
+        'platform': job.platform,
+        'status': job.status,
+        'lane': job.lane,
+        'progress': job.progress,
+        'worker': job.worker_id,
+        'attempt': job.attempts,
+        'running_for': round((now - job.started_at).total_seconds()) if job.started_at else None,
+        'lease_expired': bool(job.lease_expires_at and job.lease_expires_at < now),
+    } for job in jobs]
+
+
+def platform_stats(window: int) -> list:
+    """Success rate and throughput per platform over jobs created in the last `window` seconds"""
+    since = timezone.now() - timedelta(seconds=window)
+    rows = (VideoDownload.objects
+            .filter(created_at__gte=since)
+            .values('platform', 'status')
+            .annotate(jobs=Count('id'), bytes=Sum('file_size')))
+
+    platforms = {}
+    for row in rows:
+        stats = platforms.setdefault(row['platform'] or 'unknown', {'completed': 0, 'failed': 0, 'total': 0, 'bytes': 0})
+        stats['total'] += row['jobs']
+        if row['status'] in ('completed', 'evicted'):
+            stats['completed'] += row['jobs']
+            stats['bytes'] += row['bytes'] or 0
+        elif row['status'] == 'failed':
+            stats['failed'] += row['jobs']
+
+    result = []
+    for platform, stats in sorted(platforms.items(), key=lambda item: -item[1]['total']):
+        finished = stats['completed'] + stats['failed']
+        result.append({
+            'platform': platform,
+            **stats,
+            'success_rate': round(stats['completed'] / finished, 3) if finished else None,
+            'jobs_per_hour': round(stats['completed'] * 3600 / window, 1),
+            'bytes_per_second': round(stats['bytes'] / window),
+        })
+    return result
+
+
+def disk_usage() -> dict:
+    cache_key = 'ops:stored_bytes'
+    stored = cache.get(cache_key)
+    if stored is None:
+        # Exact duplicates share one stored file: count each (backend, path) once
+        files = (VideoDownload.objects
+                 .filter(status='completed')
+                 .exclude(file_path='')
+                 .values_list('storage_backend', 'file_path')
+                 .annotate(size=Max('file_size'))
+                 .order_by())
+        stored = sum(size or 0 for _, _, size in files.iterator())
+        cache.set(cache_key, stored, getattr(settings, 'OPS_STORAGE_CACHE_SECONDS', 60))
+
+    quota = getattr(settings, 'MEDIA_STORAGE_QUOTA', None)
+    usage = {
+        'stored_bytes': stored,
+        'quota_bytes': quota,
+        'quota_used': round(stored / quota, 3) if quota else None,
+        'prefetch_bytes': prefetch_disk_usage(),
+        'prefetch_quota_bytes': getattr(settings, 'PREFETCH_MAX_DISK_BYTES', None),
+        'volume': None,
+    }
+    try:
+        total, used, free = shutil.disk_usage(settings.MEDIA_ROOT)
+        usage['volume'] = {'total': total, 'used': used, 'free': free}
+    except OSError:
+        # MEDIA_ROOT not created yet
+        pass
+    return usage
+
+
+def ops_snapshot(force: bool = False) -> dict:
+    """Everything the dashboard shows, cached for OPS_CACHE_SECONDS"""
+    cache_key = 'ops:snapshot'
+    snapshot = None if force else cache.get(cache_key)
+    if snapshot is not None:
+        return snapshot
+
+    window = getattr(settings, 'OPS_WINDOW_SECONDS', 3600)
+    started = time.monotonic()
+    snapshot = {
+        'generated_at': timezone.now().isoformat(),
+        'window_seconds': window,
+        'queue': queue_depth(),
+        'active': active_jobs(),
+        'platforms': platform_stats(window),
+        'disk': disk_usage(),
+        'caches': cache_hit_ratios(),
+        # This process's view of the identity pool
+        'identities': get_pool().stats(),
+    }
+    snapshot['query_ms'] = round((time.monotonic() - started) * 1000, 1)
+    cache.set(cache_key, snapshot, getattr(settings, 'OPS_CACHE_SECONDS', 5))
+    return snapshot
@@ -0,0 +1,174 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+
+from django.conf import settings
+
+from .storage import get_storage
+
+# Low-bitrate rung for mobile previews
+LOW_RUNG_HEIGHT = 360
+LOW_RUNG_VIDEO_BITRATE = 600_000
+LOW_RUNG_AUDIO_BITRATE = 64_000
+
+CONTENT_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4',
+}
+
+
+def _ffmpeg_bin(name: str, ffmpeg_location: str = None) -> str:
+    return os.path.join(ffmpeg_location, name) if ffmpeg_location else name
+
+
+def probe_video(source_path: str, ffmpeg_location: str = None) -> dict:
+    """Width, height, duration and bitrate of the first video stream"""
+    result = subprocess.run(
+        [
+            _ffmpeg_bin('ffprobe', ffmpeg_location), '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'stream=width,height,codec_name:format=duration,bit_rate',
+            '-of', 'json', source_path,
+        ],
+        capture_output=True,
+        text=True,
+        timeout=30,
+    )
+    if result.returncode != 0:
+        raise Exception(f'ffprobe failed: {result.stderr.strip()[-300:]}')
+
+    data = json.loads(result.stdout or '{}')
+    streams = data.get('streams') or []
+    if not streams:
+        raise Exception('No video stream to package')
+    fmt = data.get('format') or {}
+    return {
+        'width': streams[0].get('width'),
+        'height': streams[0].get('height'),
+        'codec': streams[0].get('codec_name'),
+        'duration': float(fmt.get('duration') or 0),
+        'bit_rate': int(fmt.get('bit_rate') or 0),
+    }
+
+
+def probe_duration(source_path: str, ffmpeg_location: str = None) -> float:
+    """Container duration in seconds; raises if ffprobe cannot read the file"""
+    result = subprocess.run(
+        [
+            _ffmpeg_bin('ffprobe', ffmpeg_location), '-v', 'error',
+            '-show_entries', 'format=duration',
+            '-of', 'json', source_path,
+        ],
+        capture_output=True,
+        text=True,
+        timeout=30,
+    )
+    if result.returncode != 0:
+        raise Exception(f'ffprobe failed: {result.stderr.strip()[-300:]}')
+    return float((json.loads(result.stdout or '{}').get('format') or {}).get('duration') or 0)
+
+
+def _hls_args(name: str) -> list:
+    # CMAF (fragmented MP4) segments: works for H.264 as well as VP9/AV1 sources
+    return [
+        '-f', 'hls',
+        '-hls_time', str(getattr(settings, 'HLS_SEGMENT_SECONDS', 6)),
+        '-hls_playlist_type', 'vod',
+        '-hls_segment_type', 'fmp4',
+        '-hls_fmp4_init_filename', f'{name}_init.mp4',
+        '-hls_segment_filename', f'{name}_%04d.m4s',
+        f'{name}.m3u8',
+    ]
+
+
+def _run_ffmpeg(args: list, cwd: str, ffmpeg_location: str = None):
+    result = subprocess.run(
+        [_ffmpeg_bin('ffmpeg', ffmpeg_location), '-hide_banner', '-loglevel', 'error', '-y', *args],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        timeout=getattr(settings, 'HLS_PACKAGING_TIMEOUT', 600),
+    )
+    if result.returncode != 0:
+        raise Exception(f'ffmpeg packaging failed: {result.stderr.strip()[-300:]}')
+
+
+def preview_url(pk: int, name: str) -> str:
+    return f'/api/preview/{pk}/{name}'
+
+
+def _rewrite_uris(playlist_path: str, pk: int):
+    """
+    Point a playlist's segment / init-section URIs at HLSPreviewView. The
+    view redirects them to presigned URLs on object storage, where relative
+    URIs would resolve against the bucket without a signature.
+    """
+    with open(playlist_path) as f:
+        lines = f.read().splitlines()
+    for i, line in enumerate(lines):
+        if line and not line.startswith('#'):
+            lines[i] = preview_url(pk, line)
+        elif 'URI="' in line:
+            lines[i] = re.sub(r'URI="([^"/]+)"', lambda m: f'URI="{preview_url(pk, m.group(1))}"', line)
+    with open(playlist_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def package_hls(pk: int, source_path: str, ffmpeg_location: str = None) -> str:
+    """
+    Package a downloaded video as an HLS ladder for in-browser preview.
+
+    The source rung is segmented with stream copy (no re-encode); a low
+    bitrate rung is added when the source is taller than LOW_RUNG_HEIGHT.
+    Returns the storage key of the master playlist.
+    """
+    source_path = os.path.abspath(source_path)
+    key_prefix = f'hls/{pk}'
+    out_dir = os.path.join(settings.MEDIA_ROOT, key_prefix)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+
+    info = probe_video(source_path, ffmpeg_location)
+    source_bandwidth = info['bit_rate'] or LOW_RUNG_VIDEO_BITRATE * 4
+
+    _run_ffmpeg(['-i', source_path, '-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy', *_hls_args('source')],
+                out_dir, ffmpeg_location)
+    rungs = [('source', source_bandwidth, info['width'], info['height'])]
+
+    if getattr(settings, 'HLS_LOW_RUNG', True) and (info['height'] or 0) > LOW_RUNG_HEIGHT:
+        _run_ffmpeg([
+            '-i', source_path, '-map', '0:v:0', '-map', '0:a:0?',
+            '-vf', f'scale=-2:{LOW_RUNG_HEIGHT}',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'main',
+            '-b:v', str(LOW_RUNG_VIDEO_BITRATE), '-maxrate', str(LOW_RUNG_VIDEO_BITRATE * 3 // 2),
+            '-bufsize', str(LOW_RUNG_VIDEO_BITRATE * 2),
+            '-c:a', 'aac', '-b:a', str(LOW_RUNG_AUDIO_BITRATE),
+            *_hls_args('low'),
+        ], out_dir, ffmpeg_location)
+        low_width = round(info['width'] * LOW_RUNG_HEIGHT / info['height'] / 2) * 2 if info['width'] else None
+        rungs.append(('low', LOW_RUNG_VIDEO_BITRATE + LOW_RUNG_AUDIO_BITRATE, low_width, LOW_RUNG_HEIGHT))
+
+    for name, *_ in rungs:
+        _rewrite_uris(os.path.join(out_dir, f'{name}.m3u8'), pk)
+
+    # Lowest rung first so players start cheap and step up
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7', '#EXT-X-INDEPENDENT-SEGMENTS']
+    for name, bandwidth, width, height in sorted(rungs, key=lambda r: r[1]):
+        attrs = f'BANDWIDTH={bandwidth}'
+        if width and height:
+            attrs += f',RESOLUTION={width}x{height}'
+        lines += [f'#EXT-X-STREAM-INF:{attrs}', preview_url(pk, f'{name}.m3u8')]
+    with open(os.path.join(out_dir, 'master.m3u8'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    # Object storage: upload every playlist/segment, then drop the local copy
+    storage = get_storage()
+    if storage.name != 'local':
+        for filename in sorted(os.listdir(out_dir)):
+            storage.save(os.path.join(out_dir, filename), f'{key_prefix}/{filename}')
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    return f'{key_prefix}/master.m3u8'
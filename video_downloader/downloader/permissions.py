@@ -0,0 +1,37 @@
+from django.conf import settings
+from rest_framework import exceptions, status
+from rest_framework.permissions import BasePermission
+
+from .metering import check_quota
+from .models import ApiKey
+
+
+class QuotaExceeded(exceptions.APIException):
+    status_code = status.HTTP_429_TOO_MANY_REQUESTS
+    default_detail = 'Usage quota exceeded for this period.'
+    default_code = 'quota_exceeded'
+
+
+def request_api_key(request):
+    return request.auth if isinstance(request.auth, ApiKey) else None
+
+
+class ApiKeyQuota(BasePermission):
+    """
+    Requires an API key when API_KEY_REQUIRED is set, and refuses work for
+    keys over a hard quota before the view runs. Soft quota overruns are
+    reported in the X-Quota-Warning response header (see UsageMiddleware).
+    """
+
+    def has_permission(self, request, view):
+        api_key = request_api_key(request)
+        if api_key is None:
+            if getattr(settings, 'API_KEY_REQUIRED', False):
+                raise exceptions.NotAuthenticated('An API key is required (X-API-Key header).')
+            return True
+
+        hard, soft = check_quota(api_key)
+        if hard:
+            raise QuotaExceeded(f"Quota exceeded for this period: {', '.join(hard)}")
+        api_key.quota_warning = ', '.join(soft)
+        return True
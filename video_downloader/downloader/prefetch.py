@@ -0,0 +1,318 @@
+"""
+Popularity tracking and predictive prefetch.
+
+Requests to /api/info/ and /api/download/ are counted per canonical video
+key in a sliding window (fixed-size buckets in the cache). When a video
+crosses PREFETCH_THRESHOLD it is pre-extracted (the info response is cached)
+and a download at its most-requested quality is queued in the prefetch lane.
+Finished full downloads are remembered per (video, quality, container) so a
+later request for the same rendition is answered from the media store.
+
+Prefetching is bounded by how many prefetch jobs may be in flight, an hourly
+byte budget, a per-job rate limit and a disk budget. The worker enforces the
+last two when it runs a prefetch job, evicting the oldest prefetched files to
+make room (only prefetched files are ever evicted); requests never wait on it.
+"""
+import hashlib
+import time
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+
+from .fingerprint import file_shared
+from .formats import detect_platform, choose_format
+from .jobs import transition
+from .models import VideoDownload
+from .storage import delete_media, get_storage
+
+# yt-dlp extractor per platform, used to turn any URL form into "<ie_key>:<id>"
+PLATFORM_EXTRACTORS = {
+    'youtube': 'Youtube',
+    'tiktok': 'TikTok',
+    'instagram': 'Instagram',
+    'twitter': 'Twitter',
+    'facebook': 'Facebook',
+}
+
+# Query parameters that never change which video a URL points to
+TRACKING_PARAMS = ('si', 'feature', 'fbclid', 'igshid', 'igsh', 'ref', 'ref_src', 'is_from_webapp', 'sender_device')
+
+ACTIVE_STATUSES = ('queued', 'downloading', 'merging')
+
+
+def canonical_key(url: str) -> str:
+    """Stable key for a video regardless of the URL form it was requested with"""
+    ie_key = PLATFORM_EXTRACTORS.get(detect_platform(url))
+    if ie_key:
+        from yt_dlp.extractor import get_info_extractor
+
+        ie = get_info_extractor(ie_key)
+        if ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            if video_id:
+                return f'{ie_key}:{video_id}'
+
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    query = sorted((k, v) for k, v in parse_qsl(parsed.query)
+                   if not k.startswith('utm_') and k not in TRACKING_PARAMS)
+    normalized = f"{host}{parsed.path.rstrip('/')}?{urlencode(query)}"
+    return 'url:' + hashlib.sha1(normalized.encode()).hexdigest()[:20]
+
+
+class SlidingWindowCounter:
+    """
+    Approximate sliding-window counts kept in the cache.
+
+    Each key has one counter per `bucket` seconds; the count is the sum of
+    the buckets covering the last `window` seconds. Buckets expire on their
+    own, so nothing has to be cleaned up.
+    """
+
+    def __init__(self, prefix: str, window: int, bucket: int):
+        self.prefix = prefix
+        self.window = window
+        self.bucket = bucket
+
+    def _bucket_keys(self, key: str, now: float) -> list:
+        current = int(now // self.bucket)
+        return [f'{self.prefix}:{key}:{b}' for b in range(current - self.window // self.bucket + 1, current + 1)]
+
+    def incr(self, key: str, now: float = None) -> int:
+        now = now or time.time()
+        bucket_key = self._bucket_keys(key, now)[-1]
+        cache.add(bucket_key, 0, self.window + self.bucket)
+        try:
+            cache.incr(bucket_key)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.set(bucket_key, 1, self.window + self.bucket)
+        return self.count(key, now)
+
+    def count(self, key: str, now: float = None) -> int:
+        return sum(cache.get_many(self._bucket_keys(key, now or time.time())).values())
+
+
+def _counter(prefix: str = 'popularity') -> SlidingWindowCounter:
+    return SlidingWindowCounter(
+        prefix,
+        getattr(settings, 'PREFETCH_WINDOW_SECONDS', 3600),
+        getattr(settings, 'PREFETCH_BUCKET_SECONDS', 300),
+    )
+
+
+# Caches whose hit ratio is reported on the ops dashboard
+LOOKUP_CACHES = ('media', 'info', 'audio', 'subtitles')
+
+
+def count_lookup(name: str, hit: bool):
+    _counter('lookups').incr(f"{name}:{'hit' if hit else 'miss'}")
+
+
+def cache_hit_ratios() -> dict:
+    """{cache: {'hits', 'misses', 'ratio'}} over the popularity window"""
+    counter = _counter('lookups')
+    ratios = {}
+    for name in LOOKUP_CACHES:
+        hits = counter.count(f'{name}:hit')
+        misses = counter.count(f'{name}:miss')
+        ratios[name] = {
+            'hits': hits,
+            'misses': misses,
+            'ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+        }
+    return ratios
+
+
+def record_request(url: str, quality: str = None):
+    """Count a request for the video behind `url`. Returns (key, requests in the window)."""
+    key = canonical_key(url)
+    count = _counter().incr(key)
+    if quality:
+        # Approximate per-quality tally for picking what to prefetch
+        qualities = cache.get(f'popularity:q:{key}') or {}
+        qualities[quality] = qualities.get(quality, 0) + 1
+        cache.set(f'popularity:q:{key}', qualities, getattr(settings, 'PREFETCH_WINDOW_SECONDS', 3600))
+    return key, count
+
+
+def is_trending(count: int) -> bool:
+    return getattr(settings, 'PREFETCH_ENABLED', False) and count >= getattr(settings, 'PREFETCH_THRESHOLD', 5)
+
+
+def top_quality(key: str) -> str:
+    qualities = cache.get(f'popularity:q:{key}') or {}
+    if not qualities:
+        return getattr(settings, 'PREFETCH_DEFAULT_QUALITY', 'best')
+    return max(qualities.items(), key=lambda item: item[1])[0]
+
+
+def _media_cache_key(key: str, quality: str, container: str) -> str:
+    return f'media:{key}:{quality}:{container}'
+
+
+def is_cacheable(options: dict) -> bool:
+    """Only full downloads with default trade-offs are shared between requests"""
+    return (options.get('start_time') is None and options.get('end_time') is None
+            and not options.get('chapters')
+            and options.get('preference', 'quality') == 'quality'
+            and not options.get('max_filesize_mb'))
+
+
+def remember_download(video_download, options: dict):
+    """Register a completed download so later requests for the same rendition reuse it"""
+    if not is_cacheable(options):
+        return
+    cache.set(
+        _media_cache_key(canonical_key(video_download.url), options.get('quality', 'best'),
+                         options.get('format', 'mp4')),
+        video_download.pk,
+        getattr(settings, 'MEDIA_CACHE_TTL', 60 * 60 * 24),
+    )
+
+
+def cached_download(url: str, options: dict):
+    """A completed download of the requested rendition whose file is still in the media store"""
+    if not is_cacheable(options):
+        return None
+    pk = cache.get(_media_cache_key(canonical_key(url), options.get('quality', 'best'),
+                                    options.get('format', 'mp4')))
+    if not pk:
+        return None
+    video_download = VideoDownload.objects.filter(pk=pk, status='completed').first()
+    if not video_download or not video_download.file_path:
+        return None
+    if options.get('preview') and not video_download.hls_path and video_download.preview_status not in ('pending', 'packaging'):
+        return None
+    if not get_storage(video_download.storage_backend).exists(video_download.file_path):
+        return None
+    return video_download
+
+
+def cached_info(key: str):
+    return cache.get(f'info:{key}')
+
+
+def cache_info(key: str, payload: dict):
+    # No media URLs in the payload, so it does not go stale as fast as they do
+    cache.set(f'info:{key}', payload, getattr(settings, 'PREFETCH_INFO_TTL', 60 * 30))
+
+
+def estimated_bytes(info: dict, quality: str) -> int:
+    from .scheduler import QUALITY_BITRATES
+    from .tasks import check_ffmpeg
+
+    choice = choose_format(info, quality=quality, can_merge=check_ffmpeg())
+    if choice and choice.estimated_size:
+        return int(choice.estimated_size)
+    duration = info.get('duration') or 0
+    return int(QUALITY_BITRATES.get(quality, QUALITY_BITRATES['best']) * 1000 / 8 * duration)
+
+
+def prefetch_disk_usage() -> int:
+    return (VideoDownload.objects
+            .filter(lane='prefetch', status='completed')
+            .aggregate(total=Sum('file_size'))['total'] or 0)
+
+
+def evict(video_download) -> bool:
+    """
+    Mark a completed download evicted and delete its file, HLS preview and
+    kept local copy (unless a duplicate still uses them)
+    """
+    hls_path = video_download.hls_path
+    if not transition(video_download, 'evicted', hls_path='', preview_status=''):
+        return False
+    # Exact duplicates share one stored file and preview
+    if not file_shared(video_download):
+        delete_media(video_download.storage_backend, video_download.file_path, hls_path)
+    return True
+
+
+def free_prefetch_space(needed: int, budget: int) -> bool:
+    """Evict the oldest prefetched files until `needed` more bytes fit in `budget`"""
+    used = prefetch_disk_usage()
+    if used + needed <= budget:
+        return True
+    oldest = (VideoDownload.objects
+              .filter(lane='prefetch', status='completed')
+              .order_by('created_at'))
+    for video_download in oldest.iterator():
+        if used + needed <= budget:
+            break
+        if evict(video_download):
+            used -= video_download.file_size or 0
+    return used + needed <= budget
+
+
+def prefetch_disk_budget() -> int:
+    return getattr(settings, 'PREFETCH_MAX_DISK_BYTES', 10 * 1024 ** 3)
+
+
+def make_prefetch_room(video_download) -> bool:
+    """Worker side of the disk budget: evict older prefetched files so this prefetch job fits"""
+    needed = (video_download.options or {}).get('estimated_bytes') or 0
+    return free_prefetch_space(needed, prefetch_disk_budget())
+
+
+def maybe_prefetch(key: str, url: str, info: dict, skip_quality: str = None):
+    """
+    Queue a background download of a trending video at its most-requested
+    quality, within the prefetch budgets. Returns the queued job or None.
+    Never raises: prefetching must not fail the request that triggered it.
+    """
+    try:
+        return _schedule_prefetch(key, url, info, skip_quality)
+    except Exception as e:
+        print(f"Prefetch of {key} not scheduled: {e}")
+        return None
+
+
+def _schedule_prefetch(key: str, url: str, info: dict, skip_quality: str = None):
+    from .scheduler import enqueue, estimate_cost
+    from .tasks import run_queue_in_process
+
+    quality = top_quality(key)
+    options = {'quality': quality, 'format': 'mp4', 'preference': 'quality', 'preview': False}
+    # The current request is already producing this rendition
+    if quality == skip_quality or cached_download(url, options):
+        return None
+    # One attempt per video and quality per window
+    if not cache.add(f'prefetch:{key}:{quality}', 1, getattr(settings, 'PREFETCH_WINDOW_SECONDS', 3600)):
+        return None
+
+    in_flight = VideoDownload.objects.filter(lane='prefetch', status__in=ACTIVE_STATUSES).count()
+    if in_flight >= getattr(settings, 'PREFETCH_MAX_IN_FLIGHT', 2):
+        cache.delete(f'prefetch:{key}:{quality}')
+        return None
+
+    size = estimated_bytes(info, quality)
+    hour_key = f'prefetch:bytes:{int(time.time() // 3600)}'
+    spent = cache.get(hour_key) or 0
+    if spent + size > getattr(settings, 'PREFETCH_MAX_BYTES_PER_HOUR', 2 * 1024 ** 3):
+        return None
+    # Room is made by the worker before it runs the job (make_prefetch_room)
+    if size > prefetch_disk_budget():
+        return None
+    cache.set(hour_key, spent + size, 3600)
+    options['estimated_bytes'] = size
+
+    job = VideoDownload(
+        url=info.get('webpage_url') or url,
+        title=info.get('title', ''),
+        platform=info.get('extractor_key', ''),
+        thumbnail=info.get('thumbnail', ''),
+        duration=info.get('duration'),
+        quality=quality,
+        owner='prefetch',
+        options=options,
+        estimated_cost=estimate_cost(info, options=options),
+    )
+    job = enqueue([job], lane='prefetch')[0]
+    run_queue_in_process()
+    return job
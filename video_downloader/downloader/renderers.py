@@ -0,0 +1,46 @@
+import json
+
+import orjson
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ORJSONRenderer(BaseRenderer):
+    """Compact JSON rendered with orjson (several times faster than the stdlib encoder)"""
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    # Types orjson does not handle natively (Decimal, lazy strings, querysets, ...)
+    _fallback_encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return orjson.dumps(
+            data,
+            default=self._fallback_encoder.default,
+            option=orjson.OPT_NON_STR_KEYS,
+        )
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets EventSource clients (Accept: text/event-stream) pass content negotiation"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, (str, bytes)):
+            return data
+        # Error responses (e.g. 404) are sent as a single event
+        return f"event: error\ndata: {json.dumps(data)}\n\n"
+
+
+class DownloadRenderer(ORJSONRenderer):
+    """
+    Lets download clients that ask for the file type (e.g. Accept:
+    application/zip) pass content negotiation; error bodies are still JSON.
+    """
+    media_type = '*/*'
+    format = 'download'
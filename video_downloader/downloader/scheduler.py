@@ -0,0 +1,324 @@
+"""
+Priority lanes and fair scheduling for queued downloads.
+
+Lanes
+    interactive  single downloads a user is waiting for
+    bulk         batch / playlist submissions
+    prefetch     background work nobody is waiting for yet
+
+Workers pick a lane by stride scheduling on DOWNLOAD_LANE_WEIGHTS, so lower
+lanes keep moving but interactive jobs get most of the slots.
+
+Within a lane, jobs are ordered by a weighted-fair-queuing finish tag
+(self-clocked: the lane's virtual time is the tag of the job started last).
+A job's tag is its owner's previous tag in the lane, or the virtual time if
+the owner has nothing queued, plus the job's estimated cost divided by the
+owner's weight. One client queueing 200 items therefore only delays its own
+jobs, and a short clip overtakes a two-hour merge. The estimated cost
+(seconds of work, from duration and size) is also the shortest-job-first
+order among one owner's own submissions.
+"""
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .formats import MERGE_PENALTY
+from .jobs import (
+    RUNNING_STATUSES,
+    transition,
+    fail_download,
+    is_queue_runnable,
+    lease_fields,
+    lease_seconds,
+    worker_name,
+)
+from .models import ApiKey, VideoDownload
+from .notifications import cache_is_shared, publish_status
+
+LANES = ('interactive', 'bulk', 'prefetch')
+
+DEFAULT_LANE_WEIGHTS = {
+    'interactive': 8,
+    'bulk': 2,
+    'prefetch': 1,
+}
+
+# Nominal bitrate (kbit/s) per requested quality when no format list is known
+QUALITY_BITRATES = {
+    'best': 5000,
+    '1080p': 4500,
+    '720p': 2500,
+    '480p': 1200,
+    '360p': 700,
+}
+
+
+# Refreshed by every running run_download_worker (see worker_heartbeat)
+WORKER_HEARTBEAT_KEY = 'download_worker:heartbeat'
+
+
+def worker_heartbeat_seconds() -> int:
+    return getattr(settings, 'DOWNLOAD_WORKER_HEARTBEAT_SECONDS', 30)
+
+
+class WorkerHeartbeat:
+    """
+    Announces a running download worker from a background thread, so web
+    processes know not to drain the queue themselves (see worker_alive).
+    Beats keep going while a long download blocks the worker loop.
+    """
+
+    def __init__(self, worker_id: str, interval: float = None):
+        self.worker_id = worker_id
+        self.interval = interval or worker_heartbeat_seconds()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def beat(self):
+        cache.set(WORKER_HEARTBEAT_KEY, self.worker_id, self.interval * 2)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.beat()
+            except Exception as e:
+                print(f"Worker heartbeat failed: {e}")
+
+    def start(self):
+        self.beat()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+
+def worker_alive() -> bool:
+    """Whether some download worker has checked in recently (never true without a shared cache)"""
+    return cache_is_shared() and cache.get(WORKER_HEARTBEAT_KEY) is not None
+
+
+def lane_weight(lane: str) -> float:
+    weights = getattr(settings, 'DOWNLOAD_LANE_WEIGHTS', None) or DEFAULT_LANE_WEIGHTS
+    return max(weights.get(lane, 1), 0.001)
+
+
+def owner_weight(owner: str) -> float:
+    weights = getattr(settings, 'DOWNLOAD_OWNER_WEIGHTS', None) or {}
+    if owner in weights:
+        return max(weights[owner], 0.001)
+    if owner.startswith('key:'):
+        # API keys carry their own share
+        cache_key = f'owner_weight:{owner}'
+        weight = cache.get(cache_key)
+        if weight is None:
+            weight = ApiKey.objects.filter(pk=owner[4:]).values_list('weight', flat=True).first() or 1
+            cache.set(cache_key, weight, 60)
+        return max(weight, 0.001)
+    return 1
+
+
+def _fetched_bytes(f: dict, length, duration) -> float:
+    size = f.get('filesize') or f.get('filesize_approx')
+    if size:
+        # Sizes are for the whole file; a clip only fetches its fragments
+        return size * min(length / duration, 1.0) if length and duration else size
+    if f.get('tbr') and length:
+        return f['tbr'] * 1000 / 8 * length
+    return 0
+
+
+def estimate_cost(info: dict, choice=None, clip_range=None, options: dict = None) -> float:
+    """
+    Rough seconds of work for a job: bytes to fetch at
+    DOWNLOAD_ASSUMED_BANDWIDTH, plus merge and re-encode overhead.
+    `info` may be a full extraction or just a flat playlist entry.
+    """
+    options = options or {}
+    duration = info.get('duration') or 0
+    length = duration
+    if clip_range and clip_range[1] != float('inf'):
+        length = clip_range[1] - clip_range[0]
+
+    size = 0
+    if choice is not None:
+        size = _fetched_bytes(choice.video, length, duration)
+        if choice.audio is not None:
+            size += _fetched_bytes(choice.audio, length, duration)
+    if not size and length:
+        size = QUALITY_BITRATES.get(options.get('quality'), QUALITY_BITRATES['best']) * 1000 / 8 * length
+    if not size:
+        return float(getattr(settings, 'DOWNLOAD_DEFAULT_COST', 60))
+
+    cost = size / getattr(settings, 'DOWNLOAD_ASSUMED_BANDWIDTH', 4 * 1024 * 1024)
+    if choice is None or choice.needs_merge:
+        cost *= MERGE_PENALTY
+    # Precise cuts and the preview's low rung re-encode (roughly 2x realtime)
+    if options.get('precise_cuts') and clip_range:
+        cost += length / 2
+    if options.get('preview') or getattr(settings, 'HLS_PACKAGING_ENABLED', False):
+        cost += length / 2
+    return round(cost, 2)
+
+
+def lane_virtual_time(lane: str) -> float:
+    """Finish tag of the job started most recently in the lane"""
+    tag = (VideoDownload.objects
+           .filter(lane=lane, started_at__isnull=False, fair_tag__isnull=False)
+           .order_by('-started_at')
+           .values_list('fair_tag', flat=True)
+           .first())
+    return tag or 0.0
+
+
+def enqueue(downloads: list, lane: str = 'interactive') -> list:
+    """
+    Tag unsaved VideoDownload rows, save them as 'queued' in `lane` and
+    publish the status. Returns the saved rows.
+    """
+    now = timezone.now()
+    default_cost = float(getattr(settings, 'DOWNLOAD_DEFAULT_COST', 60))
+    virtual_time = lane_virtual_time(lane)
+    last_tags = {}
+
+    # Shortest first within one submission
+    downloads = sorted(downloads, key=lambda d: d.estimated_cost or default_cost)
+    for video_download in downloads:
+        owner = video_download.owner
+        if owner not in last_tags:
+            backlog = (VideoDownload.objects
+                       .filter(status='queued', lane=lane, owner=owner)
+                       .aggregate(tag=Max('fair_tag'))['tag'])
+            last_tags[owner] = max(virtual_time, backlog or 0.0)
+        last_tags[owner] += (video_download.estimated_cost or default_cost) / owner_weight(owner)
+
+        video_download.lane = lane
+        video_download.fair_tag = last_tags[owner]
+        video_download.status = 'queued'
+        video_download.queued_at = now
+
+    if len(downloads) == 1:
+        downloads[0].save()
+    else:
+        downloads = VideoDownload.objects.bulk_create(downloads)
+
+    for video_download in downloads:
+        publish_status(video_download, lane=lane)
+    return downloads
+
+
+class Scheduler:
+    """
+    Picks and claims the next queued job for one worker process.
+
+    Lane shares are tracked per worker with stride scheduling: every claim
+    advances the lane's pass by 1 / weight and the lane with the lowest
+    pass (among lanes with queued jobs) goes next.
+    """
+
+    def __init__(self, lanes=None, worker_id: str = None):
+        self.lanes = tuple(lanes or LANES)
+        self.worker_id = worker_id or worker_name()
+        self.passes = {lane: 0.0 for lane in self.lanes}
+
+    def lane_order(self, active) -> list:
+        active = [lane for lane in self.lanes if lane in active]
+        if not active:
+            return []
+        # An idle lane must not bank credit and then monopolise the workers
+        floor = min(self.passes[lane] for lane in active)
+        for lane in self.lanes:
+            if lane not in active:
+                self.passes[lane] = max(self.passes[lane], floor)
+        return sorted(active, key=lambda lane: (self.passes[lane], self.lanes.index(lane)))
+
+    def claim_next(self):
+        """Claim the next job (now 'downloading'), or None when the queue is empty"""
+        active = set(VideoDownload.objects
+                     .filter(status='queued', lane__in=self.lanes)
+                     .values_list('lane', flat=True)
+                     .distinct())
+
+        for lane in self.lane_order(active):
+            candidates = (VideoDownload.objects
+                          .filter(status='queued', lane=lane)
+                          .order_by('fair_tag', 'queued_at', 'pk')[:5])
+            for video_download in candidates:
+                # Conditional update: another worker may claim the same row first
+                if transition(video_download, 'downloading', started_at=timezone.now(),
+                              attempts=video_download.attempts + 1, **lease_fields(self.worker_id)):
+                    self.passes[lane] += 1 / lane_weight(lane)
+                    return video_download
+        return None
+
+
+def requeue_stale_jobs() -> tuple:
+    """
+    Requeue running jobs whose lease expired (their process died), keeping
+    their place in the lane. Jobs out of attempts, and jobs the worker
+    cannot run (audio extractions), are failed instead.
+    Returns (requeued, failed) counts.
+    """
+    from .tasks import remove_partial_files
+
+    now = timezone.now()
+    stale = (VideoDownload.objects
+             .filter(status__in=RUNNING_STATUSES)
+             # Rows started before leases existed have none: judge them by age
+             .filter(Q(lease_expires_at__lt=now) |
+                     Q(lease_expires_at__isnull=True, created_at__lt=now - timedelta(seconds=lease_seconds()))))
+
+    requeued = failed = 0
+    max_attempts = getattr(settings, 'JOB_MAX_ATTEMPTS', 3)
+    for video_download in stale:
+        if not is_queue_runnable(video_download):
+            if fail_download(video_download, 'The request running this job was interrupted'):
+                failed += 1
+            continue
+        if video_download.attempts >= max_attempts:
+            if fail_download(video_download, f'Worker lost the job {video_download.attempts} times'):
+                remove_partial_files(video_download)
+                failed += 1
+            continue
+
+        # Jobs started by a web request were never tagged: resume them next
+        fair_tag = video_download.fair_tag
+        if fair_tag is None:
+            fair_tag = lane_virtual_time(video_download.lane)
+        if transition(video_download, 'queued', event={'requeued': True, 'attempts': video_download.attempts},
+                      worker_id='', lease_expires_at=None, fair_tag=fair_tag,
+                      queued_at=video_download.queued_at or now):
+            requeued += 1
+    return requeued, failed
+
+
+def retry_download(video_download) -> bool:
+    """
+    Queue a failed or evicted download again, at the front of its lane
+    (admin action). Jobs the worker cannot run (audio) are refused.
+    """
+    if not is_queue_runnable(video_download):
+        return False
+    # Rows from before job options were recorded still carry their quality
+    options = video_download.options or {'quality': video_download.quality or 'best'}
+    return transition(
+        video_download, 'queued', expected=('failed', 'evicted'),
+        event={'retried': True},
+        fair_tag=lane_virtual_time(video_download.lane), queued_at=timezone.now(),
+        attempts=0, progress=0, worker_id='', lease_expires_at=None, options=options,
+    )
+
+
+def reprioritize(video_download, lane: str) -> bool:
+    """Move a queued download to the front of `lane`"""
+    updated = (VideoDownload.objects
+               .filter(pk=video_download.pk, status='queued')
+               .update(lane=lane, fair_tag=lane_virtual_time(lane)))
+    if updated:
+        video_download.lane = lane
+        publish_status(video_download, lane=lane)
+    return bool(updated)
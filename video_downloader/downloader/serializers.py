@@ -1,6 +1,28 @@
 from rest_framework import serializers
 from .models import VideoDownload
 
+def parse_fields_param(request):
+    """Field names from a `?fields=a,b,c` query param (None when absent)"""
+    raw = request.query_params.get('fields') if request is not None else None
+    if not raw:
+        return None
+    return [f.strip() for f in raw.split(',') if f.strip()]
+
+
+class DynamicFieldsMixin:
+    """
+    Restrict output to the fields listed in `?fields=` (or a `fields`
+    kwarg). It only narrows Meta.fields: names outside it are never added.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
 class VideoDownloadSerializer(serializers.ModelSerializer):
     class Meta:
         model = VideoDownload
@@ -8,12 +30,59 @@ class VideoDownloadSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'status', 'file_path', 'file_size']
 
 
+# History columns anyone may read; job internals (owner, callback URL,
+# options, worker, API key, storage paths) are never exposed
+HISTORY_DEFAULT_FIELDS = [
+    'id', 'title', 'platform', 'thumbnail', 'duration', 'quality',
+    'status', 'progress', 'file_size', 'created_at',
+]
+HISTORY_PUBLIC_FIELDS = HISTORY_DEFAULT_FIELDS + [
+    'url', 'clip_start', 'clip_end', 'clip_chapters', 'sha256',
+    'preview_status', 'lane', 'queued_at', 'started_at',
+]
+
+
+class VideoDownloadListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Slim history row; other public fields can be requested with `?fields=`"""
+    DEFAULT_FIELDS = HISTORY_DEFAULT_FIELDS
+
+    class Meta:
+        model = VideoDownload
+        fields = HISTORY_PUBLIC_FIELDS
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.DEFAULT_FIELDS)
+        super().__init__(*args, **kwargs)
+
+
+class TimestampField(serializers.FloatField):
+    """Seconds from the start of a video: a number or [hh:]mm:ss[.fff]"""
+    default_error_messages = {
+        'invalid': 'Use seconds or a [hh:]mm:ss timestamp.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) and ':' in data:
+            parts = data.strip().split(':')
+            if len(parts) > 3 or not all(parts):
+                self.fail('invalid')
+            try:
+                *whole, seconds = parts
+                values = [int(p) for p in whole] + [float(seconds)]
+            except ValueError:
+                self.fail('invalid')
+            if any(v < 0 for v in values) or any(v >= 60 for v in values[1:]):
+                self.fail('invalid')
+            data = sum(v * 60 ** i for i, v in enumerate(reversed(values)))
+        return super().to_internal_value(data)
+
+
 class VideoInfoSerializer(serializers.Serializer):
     url = serializers.URLField(required=True)
 
 
-class DownloadRequestSerializer(serializers.Serializer):
-    url = serializers.URLField(required=True)
+class DownloadOptionsSerializer(serializers.Serializer):
+    """Options shared by single and batch video downloads"""
     quality = serializers.ChoiceField(
         choices=['best', '1080p', '720p', '480p', '360p'],
         default='best'
@@ -22,6 +91,101 @@ class DownloadRequestSerializer(serializers.Serializer):
         choices=['mp4', 'webm', 'mkv'],
         default='mp4'
     )
+    # Package an HLS ladder after download for in-browser preview
+    preview = serializers.BooleanField(default=False)
+    # Trade quality for delivery time/size
+    preference = serializers.ChoiceField(
+        choices=['quality', 'max_size', 'fastest'],
+        default='quality'
+    )
+    max_filesize_mb = serializers.IntegerField(required=False, min_value=1)
+    # Completion notifications (webhook and /api/events/client/<client_id>/)
+    callback_url = serializers.URLField(required=False, max_length=1000)
+    client_id = serializers.CharField(required=False, max_length=100)
+
+    # Fields describing where/who, not how to download (not stored in job options)
+    NON_OPTION_FIELDS = ('url', 'urls', 'playlist_url', 'callback_url', 'client_id', 'queue')
+
+    def job_options(self) -> dict:
+        """Validated download options to store on a queued job"""
+        return {k: v for k, v in self.validated_data.items() if k not in self.NON_OPTION_FIELDS}
+
+    def validate(self, data):
+        if data.get('preference') == 'max_size' and not data.get('max_filesize_mb'):
+            raise serializers.ValidationError({'max_filesize_mb': 'Required when preference is max_size.'})
+        return data
+
+
+class DownloadRequestSerializer(DownloadOptionsSerializer):
+    url = serializers.URLField(required=True)
+    # Optional clip selection (seconds or [hh:]mm:ss from the start of the video)
+    start_time = TimestampField(required=False, min_value=0)
+    end_time = TimestampField(required=False, min_value=0)
+    chapters = serializers.ListField(
+        child=serializers.CharField(max_length=200),
+        required=False,
+        allow_empty=False
+    )
+    # Re-encode around the cut points instead of cutting on keyframes
+    precise_cuts = serializers.BooleanField(default=False)
+    # Queue the job (202 + events) instead of downloading within the request
+    queue = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        start_time = data.get('start_time')
+        end_time = data.get('end_time')
+        if start_time is not None and end_time is not None and end_time <= start_time:
+            raise serializers.ValidationError({'end_time': 'Must be greater than start_time.'})
+        if data.get('chapters') and (start_time is not None or end_time is not None):
+            raise serializers.ValidationError({'chapters': 'Use either chapters or start_time/end_time, not both.'})
+        return super().validate(data)
+
+
+class BatchDownloadSerializer(DownloadOptionsSerializer):
+    """Many videos at once, queued in the bulk lane"""
+    MAX_ITEMS = 200
+
+    urls = serializers.ListField(
+        child=serializers.URLField(),
+        required=False,
+        allow_empty=False,
+        max_length=MAX_ITEMS
+    )
+    # Or every entry of a playlist/channel
+    playlist_url = serializers.URLField(required=False)
+
+    def validate(self, data):
+        if bool(data.get('urls')) == bool(data.get('playlist_url')):
+            raise serializers.ValidationError('Provide either urls or playlist_url.')
+        return super().validate(data)
+
+
+class SubtitlesRequestSerializer(serializers.Serializer):
+    """One video (url) or several (urls); text tracks only, no media is downloaded"""
+    MAX_ITEMS = 50
+
+    url = serializers.URLField(required=False)
+    urls = serializers.ListField(
+        child=serializers.URLField(),
+        required=False,
+        allow_empty=False,
+        max_length=MAX_ITEMS
+    )
+    # Language codes ('en' also matches 'en-US'); '*' for every uploaded track
+    languages = serializers.ListField(
+        child=serializers.CharField(max_length=20),
+        required=False,
+        allow_empty=False
+    )
+    include_auto = serializers.BooleanField(default=True)
+    format = serializers.ChoiceField(choices=['vtt', 'srt', 'txt'], default='vtt')
+    # Plain text only: prefix each line with its start time
+    timestamps = serializers.BooleanField(default=True)
+
+    def validate(self, data):
+        if bool(data.get('url')) == bool(data.get('urls')):
+            raise serializers.ValidationError('Provide either url or urls.')
+        return super().validate(data)
 
 
 class AudioDownloadSerializer(serializers.Serializer):
@@ -30,3 +194,9 @@ class AudioDownloadSerializer(serializers.Serializer):
         choices=['mp3', 'm4a', 'wav', 'flac'],
         default='mp3'
     )
+    bitrate = serializers.ChoiceField(
+        choices=['64', '96', '128', '192', '256', '320'],
+        default='192'
+    )
+    callback_url = serializers.URLField(required=False, max_length=1000)
+    client_id = serializers.CharField(required=False, max_length=100)
@@ -0,0 +1,229 @@
+import mimetypes
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+class LocalStorage:
+    """Files stay under MEDIA_ROOT and are served by DownloadFileView"""
+    name = 'local'
+
+    def path(self, key: str) -> str:
+        return os.path.join(settings.MEDIA_ROOT, key)
+
+    def save(self, local_path: str, key: str):
+        target = self.path(key)
+        if os.path.abspath(local_path) != os.path.abspath(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(local_path, target)
+
+    def exists(self, key: str) -> bool:
+        return bool(key) and os.path.exists(self.path(key))
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self.path(key))
+
+    def open(self, key: str):
+        return open(self.path(key), 'rb')
+
+    def open_range(self, key: str, start: int, length: int):
+        f = open(self.path(key), 'rb')
+        f.seek(start)
+        return f
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_prefix(self, prefix: str):
+        shutil.rmtree(self.path(prefix), ignore_errors=True)
+
+    def url(self, key: str, filename: str = None):
+        # No external URL: bytes are streamed by Django
+        return None
+
+
+class S3Storage:
+    """
+    S3-compatible object storage (AWS S3, MinIO, R2, ...).
+
+    Uploads use boto3's multipart transfer with parallel parts, and
+    downloads are handed out as presigned URLs so bytes never pass
+    through the Django workers.
+    """
+    name = 's3'
+
+    def __init__(self, bucket, endpoint_url=None, region=None, access_key=None,
+                 secret_key=None, prefix='', url_expiry=3600, path_style=False):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.prefix = prefix.strip('/')
+        self.url_expiry = url_expiry
+        self.path_style = path_style
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            from botocore.config import Config
+
+            self._client = boto3.client(
+                's3',
+                endpoint_url=self.endpoint_url,
+                region_name=self.region,
+                aws_access_key_id=self.access_key,
+                aws_secret_access_key=self.secret_key,
+                config=Config(
+                    signature_version='s3v4',
+                    s3={'addressing_style': 'path' if self.path_style else 'auto'},
+                    max_pool_connections=getattr(settings, 'MEDIA_S3_MAX_CONCURRENCY', 8) * 2,
+                ),
+            )
+        return self._client
+
+    def object_key(self, key: str) -> str:
+        return f'{self.prefix}/{key}' if self.prefix else key
+
+    def save(self, local_path: str, key: str):
+        from boto3.s3.transfer import TransferConfig
+
+        transfer_config = TransferConfig(
+            multipart_threshold=getattr(settings, 'MEDIA_S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024),
+            multipart_chunksize=getattr(settings, 'MEDIA_S3_MULTIPART_CHUNKSIZE', 16 * 1024 * 1024),
+            max_concurrency=getattr(settings, 'MEDIA_S3_MAX_CONCURRENCY', 8),
+            use_threads=True,
+        )
+        content_type = mimetypes.guess_type(local_path)[0] or 'application/octet-stream'
+        self.client.upload_file(
+            local_path,
+            self.bucket,
+            self.object_key(key),
+            ExtraArgs={'ContentType': content_type},
+            Config=transfer_config,
+        )
+
+    def exists(self, key: str) -> bool:
+        if not key:
+            return False
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except ClientError:
+            return False
+
+    def size(self, key: str) -> int:
+        return self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))['ContentLength']
+
+    def open(self, key: str):
+        return self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))['Body']
+
+    def open_range(self, key: str, start: int, length: int):
+        # Only the requested bytes leave the bucket
+        return self.client.get_object(
+            Bucket=self.bucket,
+            Key=self.object_key(key),
+            Range=f'bytes={start}-{start + length - 1}',
+        )['Body']
+
+    def download(self, key: str, local_path: str):
+        self.client.download_file(self.bucket, self.object_key(key), local_path)
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+    def delete_prefix(self, prefix: str):
+        """Delete every object under `prefix`/ (e.g. an HLS ladder)"""
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.object_key(prefix.rstrip('/') + '/')):
+            objects = [{'Key': item['Key']} for item in page.get('Contents', [])]
+            if objects:
+                # At most 1000 keys per page, the DeleteObjects limit
+                self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': objects, 'Quiet': True})
+
+    def url(self, key: str, filename: str = None):
+        params = {'Bucket': self.bucket, 'Key': self.object_key(key)}
+        if filename:
+            params['ResponseContentDisposition'] = f'attachment; filename="{filename}"'
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=self.url_expiry)
+
+
+_backends = {}
+
+
+def get_storage(name: str = None):
+    """Storage backend by name (defaults to MEDIA_STORAGE_BACKEND)"""
+    name = name or getattr(settings, 'MEDIA_STORAGE_BACKEND', 'local')
+    if name not in _backends:
+        if name == 's3':
+            _backends[name] = S3Storage(
+                bucket=settings.MEDIA_S3_BUCKET,
+                endpoint_url=getattr(settings, 'MEDIA_S3_ENDPOINT_URL', None),
+                region=getattr(settings, 'MEDIA_S3_REGION', None),
+                access_key=getattr(settings, 'MEDIA_S3_ACCESS_KEY_ID', None),
+                secret_key=getattr(settings, 'MEDIA_S3_SECRET_ACCESS_KEY', None),
+                prefix=getattr(settings, 'MEDIA_S3_PREFIX', ''),
+                url_expiry=getattr(settings, 'MEDIA_S3_URL_EXPIRY', 3600),
+                path_style=getattr(settings, 'MEDIA_S3_PATH_STYLE', False),
+            )
+        elif name == 'local':
+            _backends[name] = LocalStorage()
+        else:
+            raise ValueError(f'Unknown media storage backend: {name}')
+    return _backends[name]
+
+
+def store_file(local_path: str, key: str):
+    """
+    Move a finished download from local disk into the configured backend.
+    Returns the backend name to record on the VideoDownload.
+    """
+    storage = get_storage()
+    storage.save(local_path, key)
+    if storage.name != 'local' and not getattr(settings, 'MEDIA_STORAGE_KEEP_LOCAL', False):
+        os.remove(local_path)
+    return storage.name
+
+
+def delete_media(backend: str, file_path: str, hls_path: str = ''):
+    """
+    Delete a stored download: the file, its HLS ladder (hls/<pk>/) and, on
+    object storage, the local copy kept by MEDIA_STORAGE_KEEP_LOCAL.
+    """
+    storages = [get_storage(backend)]
+    if storages[0].name != 'local':
+        storages.append(LocalStorage())
+    for storage in storages:
+        if file_path:
+            storage.delete(file_path)
+        if hls_path:
+            storage.delete_prefix(os.path.dirname(hls_path))
+
+
+@contextmanager
+def local_copy(storage, key: str):
+    """
+    Local path of a stored file for ffmpeg: the file itself on local
+    storage (or a kept local copy), else a temporary download.
+    """
+    kept = LocalStorage().path(key)
+    if storage.name == 'local' or os.path.exists(kept):
+        yield kept
+        return
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+    os.close(fd)
+    try:
+        storage.download(key, path)
+        yield path
+    finally:
+        os.remove(path)
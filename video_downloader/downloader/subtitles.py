@@ -0,0 +1,307 @@
+"""
+Subtitle and automatic-caption extraction without downloading media.
+
+Tracks are listed from the same yt-dlp extraction /api/info/ uses, fetched
+with the extractor's own session (cookies, identity headers), parsed into
+cues and rendered as WebVTT, SRT or plain text. Parsed cues are cached per
+(video, language, manual/automatic), and the list of a video's tracks is
+cached as well, so repeated requests do not extract the video again.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import yt_dlp
+from yt_dlp.networking import Request
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .identities import identity_for
+from .metering import measure
+from .prefetch import canonical_key, count_lookup
+
+OUTPUT_FORMATS = ('vtt', 'srt', 'txt')
+
+# Source formats we can parse, most faithful first
+SOURCE_FORMATS = ('vtt', 'srt')
+
+TIMESTAMP_RE = re.compile(r'(?:(\d+):)?(\d{1,2}):(\d{2})[.,](\d{1,3})')
+CUE_TIMING_RE = re.compile(rf'({TIMESTAMP_RE.pattern})\s*-->\s*({TIMESTAMP_RE.pattern})')
+TAG_RE = re.compile(r'<[^>]*>')
+
+# YouTube's rolling auto-captions show each line twice; its "hold" cues last 10ms
+MIN_CUE_SECONDS = 0.05
+
+
+def parse_timestamp(value: str) -> float:
+    hours, minutes, seconds, millis = TIMESTAMP_RE.match(value.strip()).groups()
+    return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds) + int(millis.ljust(3, '0')) / 1000
+
+
+def clean_text(text: str) -> str:
+    text = TAG_RE.sub('', text)
+    for entity, char in (('&amp;', '&'), ('&lt;', '<'), ('&gt;', '>'), ('&nbsp;', ' ')):
+        text = text.replace(entity, char)
+    return text.strip()
+
+
+def parse_cues(content: str, rolling: bool = False) -> list:
+    """
+    [{'start', 'end', 'text'}] from WebVTT or SRT without styling. With
+    `rolling` (automatic captions), lines repeated from the previous cue
+    are dropped.
+    """
+    cues = []
+    previous_lines = []
+    # Only truly empty lines end a block: a whitespace-only line is cue text
+    # (YouTube's rolling captions start with one)
+    for block in re.split(r'\r?\n\r?\n', content.replace('\ufeff', '')):
+        lines = block.strip('\r\n').splitlines()
+        timing = next((i for i, line in enumerate(lines) if '-->' in line), None)
+        if timing is None:
+            # WEBVTT header, NOTE / STYLE / REGION blocks
+            continue
+        match = CUE_TIMING_RE.search(lines[timing])
+        if not match:
+            continue
+        start = parse_timestamp(match.group(1))
+        end = parse_timestamp(match.group(6))
+        text_lines = [clean_text(line) for line in lines[timing + 1:]]
+        text_lines = [line for line in text_lines if line]
+        if not text_lines or end - start < MIN_CUE_SECONDS:
+            continue
+
+        # Rolling captions repeat the previous cue's last line(s) first
+        overlap = 0
+        for n in range(min(len(text_lines), len(previous_lines)) if rolling else 0, 0, -1):
+            if text_lines[:n] == previous_lines[-n:]:
+                overlap = n
+                break
+        previous_lines = text_lines
+        new_lines = text_lines[overlap:]
+        if not new_lines:
+            if cues:
+                cues[-1]['end'] = max(cues[-1]['end'], end)
+            continue
+        cues.append({'start': round(start, 3), 'end': round(end, 3), 'text': '\n'.join(new_lines)})
+    return cues
+
+
+def format_timestamp(seconds: float, separator: str = '.', always_hours: bool = True) -> str:
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3_600_000)
+    minutes, millis = divmod(millis, 60_000)
+    secs, millis = divmod(millis, 1000)
+    if hours or always_hours:
+        return f'{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}'
+    return f'{minutes:02d}:{secs:02d}{separator}{millis:03d}'
+
+
+def to_vtt(cues: list) -> str:
+    blocks = ['WEBVTT']
+    for cue in cues:
+        blocks.append(f"{format_timestamp(cue['start'])} --> {format_timestamp(cue['end'])}\n{cue['text']}")
+    return '\n\n'.join(blocks) + '\n'
+
+
+def to_srt(cues: list) -> str:
+    blocks = []
+    for i, cue in enumerate(cues, 1):
+        blocks.append(f"{i}\n{format_timestamp(cue['start'], ',')} --> "
+                      f"{format_timestamp(cue['end'], ',')}\n{cue['text']}")
+    return '\n\n'.join(blocks) + '\n'
+
+
+def to_text(cues: list, timestamps: bool = True) -> str:
+    if not timestamps:
+        return '\n'.join(cue['text'].replace('\n', ' ') for cue in cues) + '\n'
+    return '\n'.join(
+        f"[{format_timestamp(cue['start'], always_hours=False).split('.')[0]}] {cue['text'].replace(chr(10), ' ')}"
+        for cue in cues
+    ) + '\n'
+
+
+def render(cues: list, output_format: str, timestamps: bool = True) -> str:
+    if output_format == 'srt':
+        return to_srt(cues)
+    if output_format == 'txt':
+        return to_text(cues, timestamps)
+    return to_vtt(cues)
+
+
+def list_tracks(info: dict, include_auto: bool = True) -> dict:
+    """{language: {'auto', 'name', 'formats': [...]}}; uploaded subtitles win over automatic captions"""
+    tracks = {}
+    sources = [(info.get('subtitles') or {}, False)]
+    if include_auto:
+        sources.append((info.get('automatic_captions') or {}, True))
+    for source, auto in sources:
+        for language, formats in source.items():
+            if language in tracks or language == 'live_chat':
+                continue
+            usable = [f for f in formats or [] if f.get('url') and f.get('ext') in SOURCE_FORMATS]
+            if usable:
+                tracks[language] = {
+                    'auto': auto,
+                    'name': usable[0].get('name') or language,
+                    'formats': usable,
+                }
+    return tracks
+
+
+def pick_source(formats: list) -> dict:
+    return min(formats, key=lambda f: SOURCE_FORMATS.index(f['ext']))
+
+
+def match_languages(tracks: dict, requested: list, default_language: str = None) -> list:
+    """
+    Track languages for the requested codes. 'en' also matches 'en-US' or
+    'en-orig'; '*' means every uploaded (not automatic) track. Without a
+    request the video's own language (or English) is used.
+    """
+    available = list(tracks)
+    if not requested:
+        requested = [default_language or 'en']
+    matched = []
+    for code in requested:
+        if code == '*':
+            candidates = [lang for lang in available if not tracks[lang]['auto']]
+        elif code in available:
+            candidates = [code]
+        else:
+            base = code.split('-')[0].lower()
+            candidates = sorted((lang for lang in available if lang.lower().split('-')[0] == base), key=len)[:1]
+        matched += [lang for lang in candidates if lang not in matched]
+    return matched
+
+
+# Bumped when parsing changes, so cues cached by an older parser are not served
+CUES_VERSION = 2
+
+
+def _cues_key(video_key: str, language: str, auto: bool) -> str:
+    return f"subtitles:v{CUES_VERSION}:{video_key}:{language}:{'auto' if auto else 'manual'}"
+
+
+def _tracks_key(video_key: str, include_auto: bool) -> str:
+    return f"subtitles:{video_key}:tracks:{int(include_auto)}"
+
+
+def _ttl() -> int:
+    return getattr(settings, 'SUBTITLES_CACHE_TTL', 60 * 60 * 24)
+
+
+def _from_cache(video_key: str, languages: list, include_auto: bool):
+    """(listing, {language: cues}) when everything requested is cached, else None"""
+    listing = cache.get(_tracks_key(video_key, include_auto))
+    if listing is None:
+        return None
+    wanted = match_languages(listing['tracks'], languages, listing.get('language'))
+    keys = {lang: _cues_key(video_key, lang, listing['tracks'][lang]['auto']) for lang in wanted}
+    cached = cache.get_many(list(keys.values()))
+    if len(cached) < len(keys):
+        return None
+    return listing, {lang: cached[key] for lang, key in keys.items()}
+
+
+def fetch_subtitles(url: str, languages: list = None, include_auto: bool = True, api_key_id=None) -> dict:
+    """
+    Cues of the requested languages for one video:
+    {'video_id', 'title', 'language', 'available', 'tracks': {language: {'auto', 'name', 'cues'}}}
+    """
+    video_key = canonical_key(url)
+    hit = _from_cache(video_key, languages, include_auto)
+    count_lookup('subtitles', hit is not None)
+    if hit is not None:
+        listing, cues = hit
+        return {
+            'video_id': listing['video_id'],
+            'title': listing['title'],
+            'language': listing.get('language'),
+            'available': listing['tracks'],
+            'tracks': {lang: {**listing['tracks'][lang], 'cues': cues[lang]} for lang in cues},
+            'cached': True,
+        }
+
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'skip_download': True,
+        'nocheckcertificate': True,
+    }
+    with identity_for(url, ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with measure(api_key_id):
+            # Unprocessed: no format selection needed, subtitles are listed as extracted
+            info = ydl.extract_info(url, download=False, process=False)
+            if info.get('_type') == 'url':
+                info = ydl.extract_info(info['url'], ie_key=info.get('ie_key'), download=False, process=False)
+        if info.get('_type') in ('playlist', 'multi_video'):
+            raise Exception('Subtitles are fetched per video, not for playlists')
+
+        tracks = list_tracks(info, include_auto)
+        listing = {
+            'video_id': info.get('id'),
+            'title': info.get('title'),
+            'language': info.get('language'),
+            # Only the track list: media/subtitle URLs expire
+            'tracks': {lang: {'auto': t['auto'], 'name': t['name']} for lang, t in tracks.items()},
+        }
+        cache.set(_tracks_key(video_key, include_auto), listing, _ttl())
+
+        result = {**listing, 'available': listing.pop('tracks'), 'tracks': {}, 'cached': False}
+        for language in match_languages(tracks, languages, info.get('language')):
+            track = tracks[language]
+            cues_key = _cues_key(video_key, language, track['auto'])
+            cues = cache.get(cues_key)
+            if cues is None:
+                source = pick_source(track['formats'])
+                request = Request(source['url'], headers=source.get('http_headers') or {})
+                content = ydl.urlopen(request).read().decode('utf-8', 'replace')
+                cues = parse_cues(content, rolling=track['auto'])
+                cache.set(cues_key, cues, _ttl())
+            result['tracks'][language] = {'auto': track['auto'], 'name': track['name'], 'cues': cues}
+    return result
+
+
+def subtitles_payload(url: str, languages: list = None, include_auto: bool = True, output_format: str = 'vtt',
+                      timestamps: bool = True, api_key_id=None) -> dict:
+    """One URL's entry of a /api/subtitles/ response; failures are reported, not raised"""
+    try:
+        result = fetch_subtitles(url, languages, include_auto, api_key_id)
+    except Exception as e:
+        return {'url': url, 'success': False, 'error': str(e)}
+    return {
+        'url': url,
+        'success': True,
+        'id': result['video_id'],
+        'title': result['title'],
+        'cached': result['cached'],
+        'available_languages': sorted(result['available']),
+        'tracks': [
+            {
+                'language': language,
+                'name': track['name'],
+                'automatic': track['auto'],
+                'format': output_format,
+                'cue_count': len(track['cues']),
+                'content': render(track['cues'], output_format, timestamps),
+            }
+            for language, track in result['tracks'].items()
+        ],
+    }
+
+
+def batch_subtitles(urls: list, workers: int = None, **options) -> list:
+    """subtitles_payload for many URLs, a few extractions at a time, in request order"""
+    def run(url):
+        try:
+            return subtitles_payload(url, **options)
+        finally:
+            # Pool threads must not keep their own DB connections open
+            connection.close()
+
+    workers = workers or getattr(settings, 'SUBTITLES_BATCH_WORKERS', 4)
+    if len(urls) == 1:
+        return [subtitles_payload(urls[0], **options)]
+    with ThreadPoolExecutor(max_workers=min(workers, len(urls))) as pool:
+        return list(pool.map(run, urls))
@@ -0,0 +1,614 @@
+"""
+Download pipeline shared by DownloadVideoView (synchronous requests) and the
+queue worker (`manage.py run_download_worker`).
+"""
+import glob
+import os
+import shutil
+import subprocess
+import threading
+from datetime import timedelta
+from functools import lru_cache
+from itertools import islice
+
+import yt_dlp
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import VideoDownload
+from .jobs import transition, fail_download, track_progress, is_queue_runnable, progress_buffer, LeaseHeartbeat
+from .storage import get_storage, local_copy, store_file
+from .packaging import package_hls, probe_duration
+from .formats import (
+    MAX_INFO_FORMATS,
+    FormatChoice,
+    detect_platform,
+    choose_format,
+    apply_format,
+    summarize_format,
+)
+from .identities import identity_for
+from .archive import file_checksums
+from .fingerprint import fingerprint_file, save_fingerprint, stored_original
+from .metering import measure, record_usage
+from .prefetch import make_prefetch_room, remember_download
+from .scheduler import Scheduler, requeue_stale_jobs, worker_alive
+
+
+@lru_cache(maxsize=None)
+def check_ffmpeg():
+    """Check if FFmpeg is installed (probed once per process)"""
+    return shutil.which('ffmpeg') is not None
+
+
+@lru_cache(maxsize=None)
+def get_ffmpeg_location():
+    """Get FFmpeg location or return None"""
+    # Check common Windows locations first
+    common_windows_paths = [
+        r"C:\ffmpeg\bin",
+        r"C:\Program Files\ffmpeg\bin",
+        r"C:\Program Files (x86)\ffmpeg\bin",
+    ]
+    
+    for path in common_windows_paths:
+        if os.path.exists(os.path.join(path, 'ffmpeg.exe')):
+            return path
+    
+    # Check system PATH
+    ffmpeg_path = shutil.which('ffmpeg')
+    if ffmpeg_path:
+        return os.path.dirname(ffmpeg_path)
+    
+    return None
+
+
+@lru_cache(maxsize=None)
+def check_ffprobe():
+    """ffprobe ships with FFmpeg but is packaged separately on some systems"""
+    location = get_ffmpeg_location()
+    if location and any(os.path.exists(os.path.join(location, name)) for name in ('ffprobe', 'ffprobe.exe')):
+        return True
+    return shutil.which('ffprobe') is not None
+
+
+@lru_cache(maxsize=None)
+def get_ffmpeg_version():
+    """First line of `ffmpeg -version` (probed once per process)"""
+    if not check_ffmpeg():
+        return None
+    try:
+        result = subprocess.run(
+            ['ffmpeg', '-version'],
+            capture_output=True,
+            text=True,
+            timeout=5
+        )
+        if result.returncode == 0:
+            return result.stdout.split('\n')[0]
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return 'Installed (version check failed)'
+
+
+def get_platform_specific_format(url, quality, has_ffmpeg):
+    """Get platform-specific format string"""
+    platform = detect_platform(url)
+    
+    # Facebook-specific formats
+    if platform == 'facebook':
+        if has_ffmpeg:
+            return 'best[ext=mp4]/best'
+        else:
+            return 'best'
+    
+    # Instagram-specific formats
+    elif platform == 'instagram':
+        return 'best[ext=mp4]/best'
+    
+    # Twitter/X-specific formats
+    elif platform == 'twitter':
+        if has_ffmpeg:
+            quality_map = {
+                'best': 'best[ext=mp4]/best',
+                '1080p': 'best[height<=1080][ext=mp4]/best[height<=1080]',
+                '720p': 'best[height<=720][ext=mp4]/best[height<=720]',
+                '480p': 'best[height<=480][ext=mp4]/best[height<=480]',
+                '360p': 'best[height<=360][ext=mp4]/best[height<=360]'
+            }
+        else:
+            quality_map = {
+                'best': 'best',
+                '1080p': 'best[height<=1080]',
+                '720p': 'best[height<=720]',
+                '480p': 'best[height<=480]',
+                '360p': 'best[height<=360]'
+            }
+        return quality_map.get(quality, quality_map['best'])
+    
+    # YouTube and other sites that support separate video+audio streams
+    else:
+        if has_ffmpeg:
+            quality_map = {
+                'best': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best[ext=mp4]/best',
+                '1080p': 'bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=1080]+bestaudio/best[height<=1080][ext=mp4]/best[height<=1080]',
+                '720p': 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=720]+bestaudio/best[height<=720][ext=mp4]/best[height<=720]',
+                '480p': 'bestvideo[height<=480][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=480]+bestaudio/best[height<=480][ext=mp4]/best[height<=480]',
+                '360p': 'bestvideo[height<=360][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=360]+bestaudio/best[height<=360][ext=mp4]/best[height<=360]'
+            }
+        else:
+            quality_map = {
+                'best': 'best[ext=mp4]/best',
+                '1080p': 'best[height<=1080][ext=mp4]/best[height<=1080]',
+                '720p': 'best[height<=720][ext=mp4]/best[height<=720]',
+                '480p': 'best[height<=480][ext=mp4]/best[height<=480]',
+                '360p': 'best[height<=360][ext=mp4]/best[height<=360]'
+            }
+        return quality_map.get(quality, quality_map['best'])
+
+
+def resolve_clip_range(info, start_time=None, end_time=None, chapters=None):
+    """Resolve requested times/chapters into a single (start, end) range in seconds"""
+    if chapters:
+        available = info.get('chapters') or []
+        if not available:
+            raise ValueError('Chapter information is not available for this video')
+        wanted = [c.lower() for c in chapters]
+        matched = [c for c in available if (c.get('title') or '').lower() in wanted]
+        if not matched:
+            raise ValueError('None of the requested chapters were found')
+        return min(c['start_time'] for c in matched), max(c['end_time'] for c in matched)
+
+    if start_time is None and end_time is None:
+        return None
+
+    duration = info.get('duration')
+    start = start_time or 0
+    end = end_time if end_time is not None else (duration or float('inf'))
+    if duration and start >= duration:
+        raise ValueError('start_time is beyond the end of the video')
+    if duration:
+        end = min(end, duration)
+    if end <= start:
+        raise ValueError('end_time must be greater than start_time')
+    return start, end
+
+
+def download_dir() -> str:
+    media_path = os.path.join(settings.MEDIA_ROOT, 'downloads')
+    os.makedirs(media_path, exist_ok=True)
+    return media_path
+
+
+def output_prefix(video_download) -> str:
+    # Stable per job, so a retried job finds (and continues) its .part files
+    return f'video_{video_download.pk}'
+
+
+def set_output_template(ydl, video_download):
+    """Point an open YoutubeDL at the job's file (outtmpl is parsed into a dict in __init__)"""
+    ydl.params['outtmpl']['default'] = os.path.join(download_dir(), f'{output_prefix(video_download)}.%(ext)s')
+
+
+def remove_partial_files(video_download):
+    """Delete whatever a failed job left in the download directory"""
+    for path in glob.glob(os.path.join(download_dir(), glob.escape(output_prefix(video_download)) + '.*')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def is_clip_request(options: dict) -> bool:
+    return (options.get('start_time') is not None or options.get('end_time') is not None
+            or bool(options.get('chapters')))
+
+
+def build_ydl_options(url: str, options: dict, has_ffmpeg: bool, ffmpeg_location: str = None,
+                      output_template: str = None) -> dict:
+    ydl_opts = {
+        'format': get_platform_specific_format(url, options.get('quality', 'best'), has_ffmpeg),
+        'quiet': True,
+        'no_warnings': True,
+        'nocheckcertificate': True,
+        'ignoreerrors': False,
+        # Resume .part files left by an interrupted attempt
+        'continuedl': True,
+    }
+    if output_template:
+        ydl_opts['outtmpl'] = output_template
+
+    # Add FFmpeg location and merge format if available
+    if has_ffmpeg:
+        ydl_opts['merge_output_format'] = options.get('format', 'mp4')
+        if ffmpeg_location:
+            ydl_opts['ffmpeg_location'] = ffmpeg_location
+    return ydl_opts
+
+
+def expand_playlist(url: str, limit: int) -> list:
+    """Entries (url, title, duration) of a playlist without extracting every video"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+        'playlistend': limit,
+    }
+    with identity_for(url, ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    # A single video URL is a playlist of one
+    entries = info.get('entries') if info.get('_type') == 'playlist' else [info]
+    result = []
+    for entry in islice(entries or [], limit):
+        entry_url = entry.get('webpage_url') or entry.get('url') or ''
+        if not entry_url.startswith(('http://', 'https://')):
+            continue
+        result.append({
+            'url': entry_url,
+            'title': entry.get('title') or '',
+            'platform': entry.get('ie_key') or entry.get('extractor_key') or '',
+            'duration': entry.get('duration'),
+        })
+    return result
+
+
+def pinned_format(info: dict, format_spec: str):
+    """FormatChoice for a previously chosen format spec, if every part is still offered"""
+    if not format_spec:
+        return None
+    by_id = {f.get('format_id'): f for f in info.get('formats') or []}
+    parts = format_spec.split('+')
+    if len(parts) > 2 or not all(part in by_id for part in parts):
+        return None
+    return FormatChoice(by_id[parts[0]], by_id[parts[1]] if len(parts) == 2 else None)
+
+
+def plan_download(ydl, info: dict, options: dict, has_ffmpeg: bool):
+    """
+    Resolve the clip range and pick a format on an open YoutubeDL.
+
+    Returns (clip_range, choice); raises ValueError for an invalid clip.
+    """
+    clip_range = None
+    if is_clip_request(options):
+        clip_range = resolve_clip_range(
+            info, options.get('start_time'), options.get('end_time'), options.get('chapters'))
+
+        # Only fetch the fragments covering the clip; cut on keyframes
+        # (stream copy) unless precise cuts were requested
+        ydl.params['download_ranges'] = yt_dlp.utils.download_range_func(None, [clip_range])
+        ydl.params['force_keyframes_at_cuts'] = options.get('precise_cuts', False)
+
+    # A retried job keeps the format its partial files were started with
+    pinned = pinned_format(info, options.get('format_spec'))
+    if pinned:
+        apply_format(ydl, pinned.format_spec)
+        return clip_range, pinned
+
+    # Rank the extracted formats; the static selector is the fallback
+    max_filesize_mb = options.get('max_filesize_mb')
+    choice = choose_format(
+        info,
+        quality=options.get('quality', 'best'),
+        container=options.get('format', 'mp4'),
+        preference=options.get('preference', 'quality'),
+        max_filesize=max_filesize_mb * 1024 * 1024 if max_filesize_mb else None,
+        can_merge=has_ffmpeg,
+        duration=(clip_range[1] - clip_range[0]) if clip_range and clip_range[1] != float('inf') else None,
+    )
+    if choice:
+        apply_format(ydl, choice.format_spec)
+    return clip_range, choice
+
+
+def info_fields(info: dict, clip_range=None) -> dict:
+    """VideoDownload columns filled from extracted info"""
+    return {
+        'title': info.get('title', ''),
+        'platform': info.get('extractor_key', ''),
+        'thumbnail': info.get('thumbnail', ''),
+        'duration': info.get('duration'),
+        'clip_start': clip_range[0] if clip_range else None,
+        'clip_end': clip_range[1] if clip_range and clip_range[1] != float('inf') else None,
+    }
+
+
+def video_info_payload(info: dict, include_formats: bool = True) -> dict:
+    """Body of a /api/info/ response for extracted info"""
+    formats = []
+    if include_formats:
+        formats = list(islice(
+            (summarize_format(f) for f in info.get('formats') or []
+             # Include both combined formats and separate video/audio
+             if f.get('vcodec') != 'none' or f.get('acodec') != 'none'),
+            MAX_INFO_FORMATS,
+        ))
+    return {
+        'success': True,
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'thumbnail': info.get('thumbnail'),
+        'duration': info.get('duration'),
+        'uploader': info.get('uploader') or info.get('channel'),
+        'upload_date': info.get('upload_date'),
+        'view_count': info.get('view_count'),
+        'description': (info.get('description') or '')[:500],
+        'platform': info.get('extractor_key'),
+        'webpage_url': info.get('webpage_url'),
+        'formats': formats,
+        # Languages with text tracks; the text itself comes from /api/subtitles/
+        'subtitle_languages': sorted(info.get('subtitles') or {}),
+        'automatic_caption_languages': sorted(info.get('automatic_captions') or {}),
+        'ffmpeg_available': check_ffmpeg(),
+    }
+
+
+def verify_download(file_path: str, expected_size: int = None, expected_duration: float = None,
+                    ffmpeg_location: str = None):
+    """
+    Reject empty or truncated files before a job is marked completed.
+
+    The size is compared with the format's exact size when one download
+    produced the file as-is; ffprobe (when installed) must be able to read
+    the container and find roughly the expected duration.
+    """
+    size = os.path.getsize(file_path)
+    if size == 0:
+        raise Exception('Downloaded file is empty')
+    if expected_size and size < expected_size * 0.9:
+        raise Exception(f'Downloaded file is truncated ({size} of {expected_size} bytes)')
+
+    if check_ffprobe():
+        duration = probe_duration(file_path, ffmpeg_location)
+        if expected_duration and duration < expected_duration * 0.9 - 2:
+            raise Exception(f'Downloaded file is truncated ({duration:.0f}s of {expected_duration:.0f}s)')
+    return size
+
+
+def run_download(ydl, info: dict, video_download, options: dict, has_ffmpeg: bool, ffmpeg_location: str = None,
+                 choice=None, clip_range=None, lease=None, defer_packaging: bool = False) -> dict:
+    """
+    Download (re-using the extracted info), verify, package and store a
+    job, then mark it completed. Returns the stored filename, size, HLS
+    path and preview status.
+
+    With `defer_packaging` (web requests) the HLS preview is left 'pending'
+    for the queue worker: re-encoding can outlast the request's timeout.
+    """
+    media_path = download_dir()
+    set_output_template(ydl, video_download)
+
+    # Report the merge step (separate video+audio streams) as its own status
+    def on_postprocess(d):
+        if d.get('status') == 'started' and d.get('postprocessor') == 'Merger':
+            transition(video_download, 'merging')
+
+    ydl.add_progress_hook(lambda d: track_progress(video_download, d))
+    ydl.add_postprocessor_hook(on_postprocess)
+    if lease is not None:
+        ydl.add_progress_hook(lambda d: lease.check())
+
+    result = ydl.process_ie_result(info, download=True)
+
+    # Find downloaded file (yt-dlp reports it; otherwise look for video_<pk>.<ext>)
+    file_path = None
+    requested = (result or {}).get('requested_downloads') or []
+    if requested and requested[0].get('filepath') and os.path.exists(requested[0]['filepath']):
+        file_path = requested[0]['filepath']
+    else:
+        prefix = output_prefix(video_download)
+        downloaded_files = [f for f in os.listdir(media_path) if os.path.splitext(f)[0] == prefix]
+        if downloaded_files:
+            file_path = os.path.join(media_path, downloaded_files[0])
+    if not file_path:
+        raise Exception('Downloaded file not found')
+    filename = os.path.basename(file_path)
+
+    expected_size = None
+    if choice is not None and not choice.needs_merge and not clip_range:
+        expected_size = choice.video.get('filesize')
+    if clip_range and clip_range[1] != float('inf'):
+        expected_duration = clip_range[1] - clip_range[0]
+    else:
+        expected_duration = info.get('duration')
+    try:
+        file_size = verify_download(file_path, expected_size, expected_duration, ffmpeg_location)
+    except Exception:
+        # A broken file must not be resumed or served
+        os.remove(file_path)
+        raise
+
+    crc32, sha256 = file_checksums(file_path)
+    fingerprint = None
+    if getattr(settings, 'FINGERPRINT_ENABLED', False):
+        try:
+            fingerprint = fingerprint_file(file_path, expected_duration, has_ffmpeg, ffmpeg_location)
+        except Exception as e:
+            print(f"Fingerprinting download {video_download.id} failed: {e}")
+
+    wants_preview = has_ffmpeg and (options.get('preview') or settings.HLS_PACKAGING_ENABLED)
+    original = stored_original(sha256, exclude_pk=video_download.pk)
+    if original is not None and (original.hls_path or not wants_preview):
+        # Same file as an earlier download (e.g. a re-post under another URL): share it
+        os.remove(file_path)
+        filename = os.path.basename(original.file_path)
+        stored = {'file_path': original.file_path, 'storage_backend': original.storage_backend,
+                  'hls_path': original.hls_path, 'preview_status': 'ready' if original.hls_path else ''}
+    else:
+        # Optional HLS ladder for in-browser preview (needs the local file)
+        hls_path = ''
+        preview_status = ''
+        if wants_preview and defer_packaging:
+            preview_status = 'pending'
+        elif wants_preview:
+            try:
+                hls_path = package_hls(video_download.id, file_path, ffmpeg_location)
+                preview_status = 'ready'
+            except Exception as e:
+                print(f"HLS packaging failed for download {video_download.id}: {e}")
+                preview_status = 'failed'
+
+        # Hand the file to the media store
+        storage_backend = store_file(file_path, f'downloads/{filename}')
+        stored = {'file_path': f'downloads/{filename}', 'storage_backend': storage_backend,
+                  'hls_path': hls_path, 'preview_status': preview_status}
+
+    transition(
+        video_download, 'completed',
+        file_size=file_size, crc32=crc32, sha256=sha256, progress=100.0,
+        worker_id='', lease_expires_at=None, **stored
+    )
+    if fingerprint is not None:
+        save_fingerprint(video_download, fingerprint)
+    record_usage(video_download.api_key_id, bytes_downloaded=file_size)
+    remember_download(video_download, options)
+    return {'filename': filename, 'file_size': file_size, 'hls_path': stored['hls_path'],
+            'preview_status': stored['preview_status']}
+
+
+def packaging_lease() -> timedelta:
+    # Source and low rung are each bounded by HLS_PACKAGING_TIMEOUT
+    return timedelta(seconds=getattr(settings, 'HLS_PACKAGING_TIMEOUT', 600) * 2 + 60)
+
+
+def claim_preview():
+    """Claim the oldest download whose HLS preview is pending, or None"""
+    candidates = (VideoDownload.objects
+                  .filter(preview_status='pending', status='completed')
+                  .order_by('pk')[:5])
+    for video_download in candidates:
+        # Conditional update: another worker may claim the same row first
+        if (VideoDownload.objects
+                .filter(pk=video_download.pk, preview_status='pending')
+                .update(preview_status='packaging', lease_expires_at=timezone.now() + packaging_lease())):
+            video_download.preview_status = 'packaging'
+            return video_download
+    return None
+
+
+def run_preview_packaging(video_download) -> bool:
+    """Worker entry point for a claimed preview: package the stored file as HLS"""
+    try:
+        storage = get_storage(video_download.storage_backend)
+        with local_copy(storage, video_download.file_path) as source_path:
+            hls_path = package_hls(video_download.pk, source_path, get_ffmpeg_location())
+    except Exception as e:
+        print(f"HLS packaging failed for download {video_download.pk}: {e}")
+        fields = {'preview_status': 'failed'}
+    else:
+        fields = {'preview_status': 'ready', 'hls_path': hls_path}
+    VideoDownload.objects.filter(pk=video_download.pk, preview_status='packaging').update(
+        lease_expires_at=None, **fields)
+    return fields['preview_status'] == 'ready'
+
+
+def requeue_stale_previews() -> int:
+    """Hand previews whose packaging worker died back to the queue"""
+    return (VideoDownload.objects
+            .filter(preview_status='packaging', lease_expires_at__lt=timezone.now())
+            .update(preview_status='pending', lease_expires_at=None))
+
+
+def run_queued_download(video_download) -> bool:
+    """
+    Worker entry point for a job claimed by the scheduler (status
+    'downloading'). Info is extracted again because media URLs expire
+    while a job waits in the queue.
+    """
+    options = video_download.options or {}
+    has_ffmpeg = check_ffmpeg()
+    ffmpeg_location = get_ffmpeg_location()
+
+    if not is_queue_runnable(video_download):
+        fail_download(video_download, 'Audio downloads cannot be run by the queue worker')
+        return False
+
+    if is_clip_request(options) and not has_ffmpeg:
+        fail_download(video_download, 'FFmpeg is required for clip downloads')
+        return False
+
+    # Evictions happen here, off the request that queued the prefetch
+    if video_download.lane == 'prefetch' and not make_prefetch_room(video_download):
+        fail_download(video_download, 'Prefetch disk budget is full')
+        return False
+
+    ydl_opts = build_ydl_options(video_download.url, options, has_ffmpeg, ffmpeg_location)
+    if video_download.lane == 'prefetch' and getattr(settings, 'PREFETCH_RATE_LIMIT', None):
+        # Background fetches must leave bandwidth for user jobs
+        ydl_opts['ratelimit'] = settings.PREFETCH_RATE_LIMIT
+
+    lease = LeaseHeartbeat(video_download)
+    try:
+        with lease, identity_for(video_download.url, ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with measure(video_download.api_key_id):
+                info = ydl.extract_info(video_download.url, download=False)
+            clip_range, choice = plan_download(ydl, info, options, has_ffmpeg)
+
+            fields = info_fields(info, clip_range)
+            if choice and options.get('format_spec') != choice.format_spec:
+                fields['options'] = options = {**options, 'format_spec': choice.format_spec}
+            VideoDownload.objects.filter(pk=video_download.pk).update(**fields)
+            for name, value in fields.items():
+                setattr(video_download, name, value)
+
+            run_download(ydl, info, video_download, options, has_ffmpeg, ffmpeg_location,
+                         choice=choice, clip_range=clip_range, lease=lease)
+        return True
+    except Exception as e:
+        if lease.lost:
+            # Requeued while we were stalled: the new owner continues from the .part files
+            print(f"Queued download {video_download.pk} abandoned: {e}")
+            return False
+        print(f"Queued download {video_download.pk} failed: {e}")
+        fail_download(video_download, str(e))
+        remove_partial_files(video_download)
+        return False
+
+
+_queue_runner = None
+_queue_runner_lock = threading.Lock()
+
+
+def run_queue_in_process() -> bool:
+    """
+    Fallback for deployments where no download worker is running (no
+    heartbeat): drain the queue on a background thread of this process so
+    queued jobs are not stranded. Returns True when a runner was started.
+    """
+    global _queue_runner
+    if not getattr(settings, 'DOWNLOAD_INPROCESS_FALLBACK', True) or worker_alive():
+        return False
+    with _queue_runner_lock:
+        if _queue_runner is not None:
+            return False
+        _queue_runner = threading.Thread(target=_drain_queue, name='queue-runner', daemon=True)
+        _queue_runner.start()
+    return True
+
+
+def _drain_queue():
+    global _queue_runner
+    scheduler = Scheduler()
+    try:
+        # Nobody else recovers jobs when there is no worker
+        requeue_stale_jobs()
+        while True:
+            video_download = scheduler.claim_next()
+            if video_download is None:
+                # Checked again under the lock: a job queued after the first
+                # check must see either this runner or none
+                with _queue_runner_lock:
+                    video_download = scheduler.claim_next()
+                    if video_download is None:
+                        _queue_runner = None
+                        return
+            run_queued_download(video_download)
+    except Exception as e:
+        print(f"In-process queue runner stopped: {e}")
+        with _queue_runner_lock:
+            _queue_runner = None
+    finally:
+        progress_buffer.flush()
+        connection.close()
@@ -1,4 +1,1214 @@
-from django.test import TestCase
+import gzip
+import io
+import os
+import socket
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
 
-# Create your tests here.
+import yt_dlp
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
 
+from .archive import ensure_checksums
+from .audio import pick_audio_source
+from .fingerprint import bands, find_duplicates, frame_hashes, stored_original
+from .formats import apply_format, choose_format
+from .identities import Identity, IdentityPool, identity_for
+from .jobs import progress_buffer, renew_lease, transition
+from .metering import UsageMeter, current_period, usage_meter
+from .middleware import negotiate_encoding, parse_accept_encoding
+from .notifications import callback_url_allowed, deliver_webhook, job_channel, pinned_request, publish_status, read_events
+from .packaging import _rewrite_uris
+from .prefetch import (
+    SlidingWindowCounter, canonical_key, evict, free_prefetch_space, is_trending, make_prefetch_room, maybe_prefetch,
+    record_request, top_quality,
+)
+from .renderers import ORJSONRenderer
+from . import warmup
+from .storage import S3Storage, store_file
+from .subtitles import parse_cues
+from .serializers import DownloadRequestSerializer
+from .tasks import (
+    claim_preview, plan_download, requeue_stale_previews, resolve_clip_range, run_preview_packaging,
+    run_queue_in_process,
+)
+from .models import ApiKey, ApiKeyUsage, MediaFingerprint, VideoDownload
+from .ops import disk_usage
+from .scheduler import Scheduler, WorkerHeartbeat, enqueue, reprioritize, requeue_stale_jobs, retry_download, worker_alive
+from . import tasks
+
+
+def make_download(**fields):
+    fields.setdefault('url', 'https://example.com/watch?v=1')
+    return VideoDownload.objects.create(**fields)
+
+
+class LeaseRecoveryTests(TestCase):
+    def running(self, lease_offset: int, **fields):
+        fields.setdefault('attempts', 1)
+        return make_download(
+            status='downloading', worker_id='web:1',
+            lease_expires_at=timezone.now() + timedelta(seconds=lease_offset), **fields
+        )
+
+    def test_expired_lease_is_requeued(self):
+        video_download = self.running(-10)
+        self.assertEqual(requeue_stale_jobs(), (1, 0))
+        video_download.refresh_from_db()
+        self.assertEqual(video_download.status, 'queued')
+        self.assertEqual(video_download.worker_id, '')
+        self.assertIsNone(video_download.lease_expires_at)
+        self.assertIsNotNone(video_download.fair_tag)
+
+    def test_live_lease_is_kept(self):
+        video_download = self.running(60)
+        self.assertEqual(requeue_stale_jobs(), (0, 0))
+        video_download.refresh_from_db()
+        self.assertEqual(video_download.status, 'downloading')
+
+    def test_out_of_attempts_fails(self):
+        video_download = self.running(-10, attempts=3)
+        self.assertEqual(requeue_stale_jobs(), (0, 1))
+        video_download.refresh_from_db()
+        self.assertEqual(video_download.status, 'failed')
+
+    def test_audio_job_is_failed_not_requeued(self):
+        audio = self.running(-10, quality='audio', options={'kind': 'audio', 'format': 'mp3', 'bitrate': '192'})
+        # Rows from before the kind was recorded are recognised by their quality
+        legacy = self.running(-10, quality='audio')
+        self.assertEqual(requeue_stale_jobs(), (0, 2))
+        for video_download in (audio, legacy):
+            video_download.refresh_from_db()
+            self.assertEqual(video_download.status, 'failed')
+
+    def test_renewal_fails_once_requeued(self):
+        video_download = self.running(-10)
+        requeue_stale_jobs()
+        self.assertFalse(renew_lease(video_download))
+
+
+class AudioSourceTests(TestCase):
+    def info(self):
+        return {
+            'id': 'abc', 'title': 'Clip', 'extractor': 'generic', 'extractor_key': 'Generic',
+            'webpage_url': 'https://example.com/abc',
+            'formats': [
+                {'format_id': 'audio', 'url': 'https://example.com/a.webm', 'ext': 'webm',
+                 'vcodec': 'none', 'acodec': 'opus', 'abr': 128},
+                {'format_id': 'muxed', 'url': 'https://example.com/m.mp4', 'ext': 'mp4',
+                 'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 720, 'tbr': 2000},
+            ],
+        }
+
+    def test_audio_only_format_wins(self):
+        source, audio_only = pick_audio_source(self.info())
+        self.assertTrue(audio_only)
+        self.assertEqual(source['format_id'], 'audio')
+
+    def test_open_downloader_switches_to_audio_format(self):
+        # The selector is compiled in YoutubeDL.__init__: setting params['format'] alone picks the muxed file
+        with yt_dlp.YoutubeDL({'quiet': True, 'simulate': True}) as ydl:
+            source, _ = pick_audio_source(self.info())
+            apply_format(ydl, source['format_id'])
+            result = ydl.process_ie_result(self.info(), download=False)
+        self.assertEqual(result['format_id'], 'audio')
+
+    def test_audio_view_downloads_only_the_audio_format(self):
+        downloaded = []
+
+        def process_info(ydl, info_dict):
+            # Stands in for the actual transfer: record what was selected, write the file
+            downloaded.append(info_dict['format_id'])
+            with open(ydl.prepare_filename(info_dict), 'wb') as f:
+                f.write(b'opus')
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), \
+                mock.patch('downloader.views.check_ffmpeg', return_value=False), \
+                mock.patch.object(yt_dlp.YoutubeDL, 'extract_info', return_value=self.info()), \
+                mock.patch.object(yt_dlp.YoutubeDL, 'process_info', autospec=True, side_effect=process_info):
+            response = self.client.post('/api/download-audio/', {'url': 'https://example.com/abc'},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['source'], 'audio_only')
+        self.assertEqual(downloaded, ['audio'])
+        self.assertEqual(VideoDownload.objects.get(pk=response.json()['id']).status, 'completed')
+
+
+class WebhookTargetTests(TestCase):
+    def resolves_to(self, address):
+        return mock.patch('socket.getaddrinfo', return_value=[(socket.AF_INET, socket.SOCK_STREAM, 6, '', (address, 443))])
+
+    def test_internal_addresses_are_refused(self):
+        for url in ('http://127.0.0.1/hook', 'http://169.254.169.254/latest/meta-data/', 'http://10.0.0.5/',
+                    'http://[::1]/', 'http://[::ffff:192.168.0.1]/', 'http://0.0.0.0/'):
+            self.assertFalse(callback_url_allowed(url), url)
+
+    def test_hostnames_are_resolved(self):
+        with self.resolves_to('10.1.2.3'):
+            self.assertFalse(callback_url_allowed('https://hooks.example.com/x'))
+        with self.resolves_to('93.184.216.34'):
+            self.assertTrue(callback_url_allowed('https://hooks.example.com/x'))
+
+    def test_only_http_schemes(self):
+        self.assertFalse(callback_url_allowed('ftp://93.184.216.34/'))
+        self.assertFalse(callback_url_allowed('file:///etc/passwd'))
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE_ADDRESSES=True)
+    def test_private_addresses_can_be_allowed(self):
+        self.assertTrue(callback_url_allowed('http://127.0.0.1:8000/hook'))
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE_ADDRESSES=True, WEBHOOK_MAX_ATTEMPTS=1)
+    def test_delivery_connects_to_the_validated_address(self):
+        received = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                received.append((self.path, self.headers['Host']))
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        port = server.server_address[1]
+
+        real_getaddrinfo = socket.getaddrinfo
+        lookups = []
+
+        def getaddrinfo(host, *args, **kwargs):
+            if host != 'hooks.example.com':
+                return real_getaddrinfo(host, *args, **kwargs)
+            # First answer passes validation, any later one is a rebinding attack
+            lookups.append(host)
+            address = '127.0.0.1' if len(lookups) == 1 else '10.9.9.9'
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (address, port))]
+
+        with mock.patch('socket.getaddrinfo', side_effect=getaddrinfo):
+            self.assertTrue(deliver_webhook(f'http://hooks.example.com:{port}/hook', {'id': 1}))
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(received, [('/hook', f'hooks.example.com:{port}')])
+
+    def test_tls_is_verified_for_the_hostname(self):
+        url, host, session = pinned_request('https://user:pw@hooks.example.com:8443/x?a=1', '93.184.216.34')
+        self.addCleanup(session.close)
+        self.assertEqual(url, 'https://user:pw@93.184.216.34:8443/x?a=1')
+        self.assertEqual(host, 'hooks.example.com:8443')
+        pool_kw = session.get_adapter(url).poolmanager.connection_pool_kw
+        self.assertEqual((pool_kw['server_hostname'], pool_kw['assert_hostname']),
+                         ('hooks.example.com', 'hooks.example.com'))
+        self.assertEqual(pinned_request('http://h.example.com/', '2001:db8::1')[0], 'http://[2001:db8::1]/')
+
+    def test_worker_needs_a_shared_cache(self):
+        with self.assertRaisesMessage(CommandError, 'REDIS_URL'):
+            call_command('run_download_worker', once=True, stdout=io.StringIO())
+
+
+class EventLogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_events_are_replayed_after_last_event_id(self):
+        video_download = make_download(status='queued')
+        publish_status(video_download)
+        video_download.status = 'downloading'
+        publish_status(video_download)
+
+        events = read_events(job_channel(video_download.pk))
+        self.assertEqual([event['status'] for _, event in events], ['queued', 'downloading'])
+        self.assertEqual(read_events(job_channel(video_download.pk), events[0][0]), events[1:])
+
+    def test_publish_waits_for_a_held_lock(self):
+        video_download = make_download(status='queued')
+        channel = job_channel(video_download.pk)
+        cache.add(f'{channel}:lock', 1, 5)
+        # Another publisher releases the lock shortly
+        with mock.patch('downloader.notifications.time.sleep', side_effect=lambda _: cache.delete(f'{channel}:lock')):
+            publish_status(video_download)
+        self.assertEqual(len(read_events(channel)), 1)
+        self.assertIsNone(cache.get(f'{channel}:lock'))
+
+
+class FakeObjectStorage:
+    """Object storage double: every key exists and is served by a presigned URL"""
+    name = 's3'
+
+    def __init__(self, files=None):
+        self.files = files or {}
+
+    def url(self, key, filename=None):
+        return f'https://bucket.example.com/{key}?X-Amz-Signature=abc'
+
+    def exists(self, key):
+        return key in self.files
+
+    def size(self, key):
+        return len(self.files[key])
+
+    def open(self, key):
+        return io.BytesIO(self.files[key])
+
+    def delete(self, key):
+        self.files.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        for key in [key for key in self.files if key.startswith(prefix + '/')]:
+            del self.files[key]
+
+
+class PreviewTests(TestCase):
+    def test_playlist_uris_point_at_the_api(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'source.m3u8')
+            with open(path, 'w') as f:
+                f.write('#EXTM3U\n#EXT-X-MAP:URI="source_init.mp4"\n#EXTINF:6.0,\nsource_0000.m4s\n#EXT-X-ENDLIST\n')
+            _rewrite_uris(path, 7)
+            with open(path) as f:
+                lines = f.read().splitlines()
+        self.assertEqual(lines[1], '#EXT-X-MAP:URI="/api/preview/7/source_init.mp4"')
+        self.assertEqual(lines[3], '/api/preview/7/source_0000.m4s')
+        self.assertEqual(lines[4], '#EXT-X-ENDLIST')
+
+    def test_pending_preview_is_packaged_by_the_worker(self):
+        video_download = make_download(status='completed', file_path='downloads/video_1.mp4', preview_status='pending')
+        claimed = claim_preview()
+        self.assertEqual(claimed.pk, video_download.pk)
+        self.assertIsNone(claim_preview())
+
+        with mock.patch('downloader.tasks.package_hls', return_value=f'hls/{video_download.pk}/master.m3u8'):
+            self.assertTrue(run_preview_packaging(claimed))
+        video_download.refresh_from_db()
+        self.assertEqual(video_download.preview_status, 'ready')
+        self.assertEqual(video_download.hls_path, f'hls/{video_download.pk}/master.m3u8')
+        self.assertIsNone(video_download.lease_expires_at)
+
+    def test_stale_packaging_is_requeued(self):
+        video_download = make_download(status='completed', preview_status='packaging',
+                                       lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(requeue_stale_previews(), 1)
+        video_download.refresh_from_db()
+        self.assertEqual(video_download.preview_status, 'pending')
+
+    def test_pending_preview_answers_503(self):
+        video_download = make_download(status='completed', preview_status='pending')
+        response = self.client.get(f'/api/preview/{video_download.pk}/master.m3u8')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '10')
+
+    def test_playlists_are_served_and_segments_redirected(self):
+        video_download = make_download(status='completed', storage_backend='s3', preview_status='ready',
+                                       hls_path='hls/5/master.m3u8')
+        storage = FakeObjectStorage({'hls/5/master.m3u8': b'#EXTM3U\n/api/preview/5/low.m3u8\n'})
+        with mock.patch('downloader.views.get_storage', return_value=storage):
+            playlist = self.client.get(f'/api/preview/{video_download.pk}/master.m3u8')
+            segment = self.client.get(f'/api/preview/{video_download.pk}/low_0001.m4s')
+        self.assertEqual(playlist.status_code, 200)
+        self.assertEqual(playlist.content, b'#EXTM3U\n/api/preview/5/low.m3u8\n')
+        self.assertEqual(segment.status_code, 302)
+        self.assertTrue(segment['Location'].startswith('https://bucket.example.com/hls/5/low_0001.m4s'))
+
+
+class ParseCuesTests(TestCase):
+    ROLLING_VTT = (
+        'WEBVTT\nKind: captions\nLanguage: en\n\n'
+        '00:00:00.160 --> 00:00:02.070 align:start position:0%\n \nhello<00:00:00.480><c> world</c>\n\n'
+        '00:00:02.070 --> 00:00:02.080 align:start position:0%\nhello world\n \n\n'
+        '00:00:02.080 --> 00:00:04.550 align:start position:0%\nhello world\n'
+        'this<00:00:02.400><c> is</c><00:00:03.000><c> a test</c>\n'
+    )
+
+    def test_rolling_captions_keep_their_first_cue(self):
+        # The whitespace-only line after the timing is cue text, not a block separator
+        self.assertEqual(parse_cues(self.ROLLING_VTT, rolling=True), [
+            {'start': 0.16, 'end': 2.07, 'text': 'hello world'},
+            {'start': 2.08, 'end': 4.55, 'text': 'this is a test'},
+        ])
+
+    def test_crlf_line_endings(self):
+        self.assertEqual(parse_cues(self.ROLLING_VTT.replace('\n', '\r\n'), rolling=True),
+                         parse_cues(self.ROLLING_VTT, rolling=True))
+
+    def test_srt_with_styling(self):
+        srt = ('1\n00:00:01,000 --> 00:00:02,500\n<i>Hello</i> &amp; welcome\n\n'
+               '2\n00:00:03,000 --> 00:00:04,000\nSecond line\nwraps\n')
+        self.assertEqual(parse_cues(srt), [
+            {'start': 1.0, 'end': 2.5, 'text': 'Hello & welcome'},
+            {'start': 3.0, 'end': 4.0, 'text': 'Second line\nwraps'},
+        ])
+
+    def test_header_and_note_blocks_are_skipped(self):
+        vtt = 'WEBVTT\n\nNOTE made by hand\n\nintro\n01:02.000 --> 01:03.000\nHi\n'
+        self.assertEqual(parse_cues(vtt), [{'start': 62.0, 'end': 63.0, 'text': 'Hi'}])
+
+
+class AdminActionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_retry_requeues_failed_video_downloads(self):
+        video_download = make_download(status='failed', quality='720p', attempts=3)
+        self.assertTrue(retry_download(video_download))
+        video_download.refresh_from_db()
+        self.assertEqual(video_download.status, 'queued')
+        self.assertEqual(video_download.attempts, 0)
+        # Rows without recorded options are retried at their own quality
+        self.assertEqual(video_download.options, {'quality': '720p'})
+
+    def test_retry_refuses_audio_downloads(self):
+        for fields in ({'options': {'kind': 'audio', 'format': 'mp3', 'bitrate': '192'}}, {'quality': 'audio'}):
+            video_download = make_download(status='failed', **fields)
+            self.assertFalse(retry_download(video_download))
+            video_download.refresh_from_db()
+            self.assertEqual(video_download.status, 'failed')
+
+    def test_shared_files_are_counted_once(self):
+        make_download(status='completed', file_path='downloads/a.mp4', file_size=100)
+        # Exact duplicate sharing the stored file
+        make_download(status='completed', file_path='downloads/a.mp4', file_size=100)
+        make_download(status='completed', file_path='downloads/b.mp4', file_size=50)
+        make_download(status='failed', file_path='downloads/c.mp4', file_size=999)
+        self.assertEqual(disk_usage()['stored_bytes'], 150)
+
+
+class FingerprintTests(TestCase):
+    def fingerprinted(self, sha256, hashes, audio=None, **fields):
+        video_download = make_download(status='completed', sha256=sha256, file_path=f'downloads/{sha256}.mp4',
+                                       **fields)
+        video_hash = int(hashes[0], 16) if hashes else None
+        return MediaFingerprint.objects.create(
+            download=video_download,
+            frame_hashes=hashes,
+            video_hash=hashes[0] if hashes else '',
+            audio_fingerprint=audio or [],
+            **(dict(zip(('band0', 'band1', 'band2', 'band3'), bands(video_hash))) if hashes else {})
+        )
+
+    def test_exact_and_near_duplicates(self):
+        frames = ['0123456789abcdef'] * 4
+        original = self.fingerprinted('a' * 64, frames)
+        exact = self.fingerprinted('a' * 64, [])
+        # Re-encode: two bits differ in every frame hash
+        near = self.fingerprinted('b' * 64, ['0123456789abcdec'] * 4)
+        unrelated = self.fingerprinted('c' * 64, ['fedcba9876543210'] * 4)
+
+        matches = find_duplicates(original)
+        self.assertEqual([(m[0].pk, m[3]) for m in matches], [(exact.pk, True), (near.pk, False)])
+        self.assertEqual(matches[1][1], 2)
+        self.assertNotIn(unrelated.pk, [m[0].pk for m in matches])
+
+    def test_different_soundtrack_is_not_a_duplicate(self):
+        frames = ['0123456789abcdef'] * 4
+        original = self.fingerprinted('a' * 64, frames, audio=[0] * 20)
+        self.fingerprinted('b' * 64, frames, audio=[0xffffffff] * 20)
+        self.assertEqual(find_duplicates(original), [])
+
+    def test_stored_original_needs_no_fingerprint(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            os.makedirs(os.path.join(media_root, 'downloads'))
+            open(os.path.join(media_root, 'downloads', 'a.mp4'), 'wb').close()
+            original = make_download(status='completed', sha256='a' * 64, file_path='downloads/a.mp4')
+            make_download(status='completed', sha256='a' * 64, file_path='downloads/gone.mp4')
+            self.assertEqual(stored_original('a' * 64).pk, original.pk)
+            self.assertIsNone(stored_original('a' * 64, exclude_pk=original.pk))
+            self.assertIsNone(stored_original(''))
+
+    def test_frames_are_sampled_at_exact_times(self):
+        calls = []
+
+        def run(cmd, **kwargs):
+            calls.append(cmd)
+            return mock.Mock(returncode=0, stdout=bytes(range(72)), stderr=b'')
+
+        with mock.patch('downloader.fingerprint.subprocess.run', side_effect=run):
+            hashes = frame_hashes('clip.mp4', 40.0, 4)
+        self.assertEqual(len(hashes), 4)
+        self.assertEqual([cmd[cmd.index('-ss') + 1] for cmd in calls], ['5.000', '15.000', '25.000', '35.000'])
+        # Seeking to the nearest keyframe would misalign frames between encodes
+        self.assertTrue(all('-skip_frame' not in cmd for cmd in calls))
+
+
+class ArchiveTests(TestCase):
+    contents = {1: b'first clip ' * 300, 2: b'second clip ' * 200}
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root.name, ARCHIVE_CHUNK_SIZE=1000)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        os.makedirs(os.path.join(self.media_root.name, 'downloads'))
+        self.ids = []
+        for n, data in self.contents.items():
+            with open(os.path.join(self.media_root.name, 'downloads', f'clip_{n}.mp4'), 'wb') as f:
+                f.write(data)
+            video_download = make_download(status='completed', title=f'Clip {n}', file_path=f'downloads/clip_{n}.mp4')
+            self.ids.append(ensure_checksums(video_download).pk)
+
+    def archive(self, archive_format='zip', **headers):
+        ids = ','.join(str(pk) for pk in self.ids)
+        return self.client.get(f'/api/archive.{archive_format}?ids={ids}', **headers)
+
+    def test_zip_is_valid(self):
+        response = self.archive('zip')
+        self.assertEqual(response.status_code, 200)
+        body = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertIsNone(archive.testzip())
+            names = archive.namelist()
+            self.assertEqual(names[:2], ['manifest.json', 'SHA256SUMS'])
+            self.assertEqual(archive.read(names[2]), self.contents[1])
+            self.assertEqual(archive.read(names[3]), self.contents[2])
+
+    def test_tar_is_valid(self):
+        body = b''.join(self.archive('tar').streaming_content)
+        with tarfile.open(fileobj=io.BytesIO(body)) as archive:
+            members = archive.getmembers()
+            self.assertEqual([m.name for m in members[:2]], ['manifest.json', 'SHA256SUMS'])
+            self.assertEqual(archive.extractfile(members[3]).read(), self.contents[2])
+
+    def test_byte_ranges_resume_the_same_bytes(self):
+        full = b''.join(self.archive('zip').streaming_content)
+        response = self.archive('zip', HTTP_RANGE='bytes=1500-2999')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 1500-2999/{len(full)}')
+        self.assertEqual(b''.join(response.streaming_content), full[1500:3000])
+
+        suffix = self.archive('zip', HTTP_RANGE='bytes=-100')
+        self.assertEqual(b''.join(suffix.streaming_content), full[-100:])
+
+    def test_unsatisfiable_range(self):
+        size = len(b''.join(self.archive('zip').streaming_content))
+        response = self.archive('zip', HTTP_RANGE=f'bytes={size}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+
+    def test_changed_selection_is_sent_whole(self):
+        response = self.archive('zip', HTTP_RANGE='bytes=10-20', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_downloads_without_checksums_are_refused(self):
+        VideoDownload.objects.filter(pk=self.ids[1]).update(sha256='', crc32=None)
+        response = self.archive('zip')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['details'], [self.ids[1]])
+
+    def test_backfill_command_checksums_old_downloads(self):
+        VideoDownload.objects.filter(pk=self.ids[1]).update(sha256='', crc32=None, file_size=None)
+        call_command('backfill_checksums', stdout=io.StringIO())
+        self.assertEqual(self.archive('zip').status_code, 200)
+
+
+class ClientError(Exception):
+    """Stands in for botocore's ClientError (boto3 is an optional dependency)"""
+
+
+class S3StorageTests(TestCase):
+    def setUp(self):
+        self.client_stub = mock.Mock()
+        self.client_stub.get_object.return_value = {'Body': io.BytesIO(b'data')}
+        self.storage = S3Storage('media', prefix='/videos/', url_expiry=600)
+        self.storage._client = self.client_stub
+        # Fake botocore / boto3 modules for the imports done inside the methods
+        exceptions = mock.Mock(ClientError=ClientError)
+        transfer = mock.Mock(TransferConfig=lambda **kwargs: kwargs)
+        modules = mock.patch.dict(sys.modules, {
+            'botocore': mock.Mock(exceptions=exceptions), 'botocore.exceptions': exceptions,
+            'boto3': mock.Mock(), 'boto3.s3': mock.Mock(), 'boto3.s3.transfer': transfer,
+        })
+        modules.start()
+        self.addCleanup(modules.stop)
+
+    def test_keys_are_prefixed(self):
+        self.assertEqual(self.storage.object_key('downloads/a.mp4'), 'videos/downloads/a.mp4')
+        self.assertEqual(S3Storage('media').object_key('downloads/a.mp4'), 'downloads/a.mp4')
+
+    def test_open_range_requests_only_those_bytes(self):
+        self.assertEqual(self.storage.open_range('downloads/a.mp4', 100, 50).read(), b'data')
+        self.client_stub.get_object.assert_called_once_with(
+            Bucket='media', Key='videos/downloads/a.mp4', Range='bytes=100-149')
+
+    def test_url_is_presigned_with_filename(self):
+        self.client_stub.generate_presigned_url.return_value = 'https://signed'
+        self.assertEqual(self.storage.url('downloads/a.mp4', 'Clip.mp4'), 'https://signed')
+        self.client_stub.generate_presigned_url.assert_called_once_with('get_object', Params={
+            'Bucket': 'media',
+            'Key': 'videos/downloads/a.mp4',
+            'ResponseContentDisposition': 'attachment; filename="Clip.mp4"',
+        }, ExpiresIn=600)
+
+    def test_exists(self):
+        self.assertTrue(self.storage.exists('downloads/a.mp4'))
+        self.client_stub.head_object.side_effect = ClientError('404')
+        self.assertFalse(self.storage.exists('downloads/a.mp4'))
+        self.assertFalse(self.storage.exists(''))
+
+    def test_save_uploads_with_content_type(self):
+        self.storage.save('/tmp/clip.mp4', 'downloads/clip.mp4')
+        args, kwargs = self.client_stub.upload_file.call_args
+        self.assertEqual(args, ('/tmp/clip.mp4', 'media', 'videos/downloads/clip.mp4'))
+        self.assertEqual(kwargs['ExtraArgs'], {'ContentType': 'video/mp4'})
+
+    def test_delete_prefix_removes_every_page(self):
+        self.client_stub.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [{'Key': 'videos/hls/7/master.m3u8'}, {'Key': 'videos/hls/7/source_0001.m4s'}]},
+            {},
+        ]
+        self.storage.delete_prefix('hls/7')
+        self.client_stub.get_paginator.return_value.paginate.assert_called_once_with(
+            Bucket='media', Prefix='videos/hls/7/')
+        self.client_stub.delete_objects.assert_called_once_with(Bucket='media', Delete={
+            'Objects': [{'Key': 'videos/hls/7/master.m3u8'}, {'Key': 'videos/hls/7/source_0001.m4s'}],
+            'Quiet': True,
+        })
+
+    def test_store_file_removes_the_local_copy(self):
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as f:
+            path = f.name
+        with mock.patch('downloader.storage.get_storage', return_value=self.storage), \
+                override_settings(MEDIA_STORAGE_KEEP_LOCAL=False):
+            self.assertEqual(store_file(path, 'downloads/clip.mp4'), 's3')
+        self.assertFalse(os.path.exists(path))
+
+
+class TransitionTests(TestCase):
+    def setUp(self):
+        publish = mock.patch('downloader.jobs.publish_status')
+        self.publish_status = publish.start()
+        self.addCleanup(publish.stop)
+
+    def test_allowed_transition_writes_status_and_fields(self):
+        video_download = make_download(status='downloading')
+        self.assertTrue(transition(video_download, 'merging', progress=100.0))
+        self.assertEqual(video_download.status, 'merging')
+        self.assertEqual(video_download.progress, 100.0)
+        stored = VideoDownload.objects.get(pk=video_download.pk)
+        self.assertEqual((stored.status, stored.progress), ('merging', 100.0))
+
+    def test_event_keys_are_published(self):
+        video_download = make_download(status='merging')
+        transition(video_download, 'completed', event={'download_url': '/file'}, file_path='downloads/a.mp4')
+        self.publish_status.assert_called_once_with(video_download, download_url='/file')
+
+    def test_disallowed_transition_changes_nothing(self):
+        video_download = make_download(status='completed')
+        self.assertFalse(transition(video_download, 'merging', progress=5.0))
+        self.assertEqual(video_download.status, 'completed')
+        self.assertEqual(VideoDownload.objects.get(pk=video_download.pk).status, 'completed')
+        self.publish_status.assert_not_called()
+
+    def test_stale_copy_loses_the_race(self):
+        video_download = make_download(status='downloading')
+        VideoDownload.objects.filter(pk=video_download.pk).update(status='failed')
+        self.assertFalse(transition(video_download, 'completed'))
+        self.assertEqual(VideoDownload.objects.get(pk=video_download.pk).status, 'failed')
+
+    def test_expected_overrides_allowed_statuses(self):
+        video_download = make_download(status='failed')
+        self.assertFalse(transition(video_download, 'queued'))
+        self.assertTrue(transition(video_download, 'queued', expected=('failed',)))
+        self.assertEqual(VideoDownload.objects.get(pk=video_download.pk).status, 'queued')
+
+    def test_final_status_drops_buffered_progress(self):
+        video_download = make_download(status='downloading')
+        progress_buffer.record(video_download.pk, 42.0)
+        transition(video_download, 'failed')
+        self.assertEqual(progress_buffer.flush(), 0)
+
+
+def fmt(format_id, vcodec, acodec, height=None, size=None, **fields):
+    return {'format_id': format_id, 'url': f'https://cdn.example.com/{format_id}', 'vcodec': vcodec,
+            'acodec': acodec, 'height': height, 'filesize': size, **fields}
+
+
+class ChooseFormatTests(TestCase):
+    MB = 1024 * 1024
+    info = {'duration': 60, 'formats': [
+        fmt('prog360', 'avc1.42001E', 'mp4a.40.2', 360, 10 * MB, ext='mp4'),
+        fmt('avc1080', 'avc1.640028', 'none', 1080, 40 * MB, ext='mp4'),
+        fmt('av1080', 'av01.0.08M.08', 'none', 1080, 25 * MB, ext='mp4'),
+        fmt('vp720', 'vp9', 'none', 720, 15 * MB, ext='webm'),
+        fmt('m4a', 'none', 'mp4a.40.2', size=3 * MB, abr=128, ext='m4a'),
+        fmt('opus', 'none', 'opus', size=3 * MB, abr=160, ext='webm'),
+        fmt('nourl', 'avc1', 'mp4a', 2160, 90 * MB, url=None),
+    ]}
+
+    def test_best_quality_prefers_the_containers_native_codecs(self):
+        self.assertEqual(choose_format(self.info).format_spec, 'avc1080+m4a')
+
+    def test_webm_skips_codecs_it_cannot_hold(self):
+        self.assertEqual(choose_format(self.info, container='webm').format_spec, 'av1080+opus')
+
+    def test_quality_caps_the_height(self):
+        self.assertEqual(choose_format(self.info, quality='720p').format_spec, 'vp720+m4a')
+        self.assertEqual(choose_format(self.info, quality='480p').format_spec, 'prog360')
+
+    def test_nothing_under_the_cap_falls_back_to_the_smallest(self):
+        info = {'formats': [f for f in self.info['formats'] if f['format_id'] != 'prog360']}
+        self.assertEqual(choose_format(info, quality='360p').format_spec, 'vp720+m4a')
+
+    def test_without_ffmpeg_only_progressive_formats(self):
+        choice = choose_format(self.info, can_merge=False)
+        self.assertEqual(choice.format_spec, 'prog360')
+        self.assertFalse(choice.needs_merge)
+
+    def test_fastest_fetches_the_fewest_bytes(self):
+        self.assertEqual(choose_format(self.info, preference='fastest').format_spec, 'prog360')
+        # With a target resolution it stays there and picks the cheapest delivery
+        choice = choose_format(self.info, quality='1080p', preference='fastest')
+        self.assertEqual(choice.format_spec, 'av1080+m4a')
+        self.assertEqual(choice.estimated_size, 28 * self.MB)
+
+    def test_max_size_keeps_under_the_limit(self):
+        choice = choose_format(self.info, preference='max_size', max_filesize=20 * self.MB)
+        self.assertEqual(choice.format_spec, 'vp720+m4a')
+
+    def test_size_is_estimated_from_bitrate(self):
+        info = {'duration': 10, 'formats': [fmt('tbr', 'avc1', 'mp4a', 480, tbr=800)]}
+        self.assertEqual(choose_format(info).estimated_size, 1000000)
+
+    def test_no_formats(self):
+        self.assertIsNone(choose_format({}))
+
+    def test_clip_sizes_are_a_share_of_the_whole_file(self):
+        # A 6 second clip of the 60 second video fetches a tenth of each file
+        choice = choose_format(self.info, duration=6)
+        self.assertEqual(choice.estimated_size, (40 + 3) * self.MB // 10)
+        # So the 1080p merge fits a limit the whole video would not
+        choice = choose_format(self.info, preference='max_size', max_filesize=5 * self.MB, duration=6)
+        self.assertEqual(choice.format_spec, 'avc1080+m4a')
+        choice = choose_format(self.info, preference='max_size', max_filesize=5 * self.MB)
+        self.assertEqual(choice.format_spec, 'prog360')
+
+    def test_unknown_heights_rank_below_known_ones(self):
+        info = {'formats': [fmt('unknown', 'avc1', 'mp4a', None, 5 * self.MB, tbr=9000),
+                            fmt('p240', 'avc1', 'mp4a', 240, 2 * self.MB),
+                            fmt('p1080', 'avc1', 'mp4a', 1080, 50 * self.MB)]}
+        self.assertEqual(choose_format(info).format_spec, 'p1080')
+        self.assertEqual(choose_format(info, quality='360p').format_spec, 'p240')
+        # Only unknown heights under the cap: better than a known height above it
+        info['formats'] = info['formats'][::2]
+        self.assertEqual(choose_format(info, quality='360p').format_spec, 'unknown')
+        self.assertEqual(choose_format({'formats': info['formats'][1:]}, quality='360p').format_spec, 'p1080')
+
+
+class ClipRangeTests(TestCase):
+    info = {'duration': 600, 'chapters': [
+        {'title': 'Intro', 'start_time': 0, 'end_time': 30},
+        {'title': 'Demo', 'start_time': 30, 'end_time': 400},
+        {'title': 'Outro', 'start_time': 400, 'end_time': 600},
+    ], 'formats': [fmt('prog', 'avc1', 'mp4a', 720, 1000)]}
+
+    def clip(self, **data):
+        serializer = DownloadRequestSerializer(data={'url': 'https://example.com/v', **data})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        return serializer.validated_data.get('start_time'), serializer.validated_data.get('end_time')
+
+    def test_times_in_seconds_or_timestamps(self):
+        self.assertEqual(self.clip(start_time=90, end_time='125.5'), (90, 125.5))
+        self.assertEqual(self.clip(start_time='1:30', end_time='01:02:03.5'), (90, 3723.5))
+        self.assertEqual(self.clip(end_time='0:45'), (None, 45))
+
+    def test_invalid_times_are_rejected(self):
+        for data in ({'start_time': '1:75'}, {'start_time': '1::2'}, {'start_time': 'a:10'},
+                     {'start_time': '1:2:3:4'}, {'start_time': 20, 'end_time': '0:20'}):
+            self.assertFalse(DownloadRequestSerializer(data={'url': 'https://example.com/v', **data}).is_valid(), data)
+
+    def test_open_ends(self):
+        self.assertEqual(resolve_clip_range(self.info, start_time=500), (500, 600))
+        self.assertEqual(resolve_clip_range(self.info, end_time=60), (0, 60))
+        self.assertEqual(resolve_clip_range(self.info, 100, 900), (100, 600))
+        self.assertEqual(resolve_clip_range({}, start_time=10), (10, float('inf')))
+        self.assertIsNone(resolve_clip_range(self.info))
+
+    def test_ranges_outside_the_video_are_rejected(self):
+        with self.assertRaises(ValueError):
+            resolve_clip_range(self.info, start_time=600)
+        with self.assertRaises(ValueError):
+            resolve_clip_range(self.info, 50, 50)
+
+    def test_chapters_span_the_matched_ones(self):
+        self.assertEqual(resolve_clip_range(self.info, chapters=['demo', 'Outro']), (30, 600))
+        with self.assertRaises(ValueError):
+            resolve_clip_range(self.info, chapters=['Credits'])
+
+    def test_download_ranges_only_for_clips(self):
+        with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+            clip_range, choice = plan_download(ydl, self.info, {'start_time': 10, 'end_time': 20}, True)
+            self.assertEqual(clip_range, (10, 20))
+            self.assertIn('download_ranges', ydl.params)
+            self.assertFalse(ydl.params['force_keyframes_at_cuts'])
+            self.assertEqual(choice.format_spec, 'prog')
+
+        with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+            plan_download(ydl, self.info, {'chapters': ['Intro'], 'precise_cuts': True}, True)
+            self.assertTrue(ydl.params['force_keyframes_at_cuts'])
+
+        with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+            clip_range, _ = plan_download(ydl, self.info, {'quality': 'best'}, True)
+            self.assertIsNone(clip_range)
+            self.assertNotIn('download_ranges', ydl.params)
+            self.assertNotIn('force_keyframes_at_cuts', ydl.params)
+
+
+class ReadinessTests(TestCase):
+    def setUp(self):
+        state = mock.patch.dict(warmup._state, started=False, ready=False, stages={}, error=None)
+        state.start()
+        self.addCleanup(state.stop)
+
+    def ready(self):
+        # The view would otherwise start a warm-up thread of its own
+        with mock.patch('downloader.views.start_warm_up'):
+            return self.client.get('/api/ready/')
+
+    def test_not_ready_before_warm_up(self):
+        response = self.ready()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], 'warming')
+
+    def test_ready_after_warm_up(self):
+        with mock.patch.object(warmup, 'STAGES', (('noop', lambda: None),)):
+            self.assertTrue(warmup.warm_up())
+        response = self.ready()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('noop', response.json()['stages'])
+
+    def test_failed_warm_up_stays_unready_and_retries(self):
+        def broken():
+            raise RuntimeError('no extractors')
+
+        with mock.patch.object(warmup, 'STAGES', (('yt_dlp_extractors', broken),)):
+            self.assertFalse(warmup.warm_up())
+        response = self.ready()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['status'], 'failed')
+        self.assertEqual(response.json()['stages']['error'], 'yt_dlp_extractors: no extractors')
+
+        with mock.patch.object(warmup, 'STAGES', (('yt_dlp_extractors', lambda: None),)):
+            self.assertTrue(warmup.warm_up())
+        self.assertEqual(self.ready().status_code, 200)
+
+
+class HistoryFieldsTests(TestCase):
+    def setUp(self):
+        make_download(title='Clip', status='completed', owner='ip:10.0.0.7', callback_url='https://hooks.example.com/',
+                      options={'quality': 'best'}, worker_id='host:1', file_path='downloads/video_1.mp4')
+
+    def test_default_fields(self):
+        row = self.client.get('/api/history/').json()['downloads'][0]
+        self.assertEqual(set(row), {'id', 'title', 'platform', 'thumbnail', 'duration', 'quality',
+                                    'status', 'progress', 'file_size', 'created_at'})
+
+    def test_fields_narrow_the_output(self):
+        row = self.client.get('/api/history/?fields=title,url').json()['downloads'][0]
+        self.assertEqual(row, {'title': 'Clip', 'url': 'https://example.com/watch?v=1'})
+
+    def test_private_fields_are_refused(self):
+        for name in ('owner', 'callback_url', 'options', 'worker_id', 'api_key', 'file_path', 'nope'):
+            response = self.client.get(f'/api/history/?fields=title,{name}')
+            self.assertEqual(response.status_code, 400, name)
+            self.assertNotIn(b'10.0.0.7', response.content)
+
+
+class RenderingTests(TestCase):
+    def test_orjson_renders_compact_json_with_fallbacks(self):
+        body = ORJSONRenderer().render({'a': Decimal('1.5'), 'b': gettext_lazy('text'), 1: [None]})
+        self.assertEqual(body, b'{"a":1.5,"b":"text","1":[null]}')
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_accept_encoding_is_parsed(self):
+        self.assertEqual(parse_accept_encoding('gzip, br;q=0.5, zstd;q=0, *;q=bad'),
+                         {'gzip': 1.0, 'br': 0.5, 'zstd': 0.0, '*': 0.0})
+
+    def test_negotiation_follows_q_values_then_server_preference(self):
+        encoders = [('zstd', 'Z'), ('br', 'B'), ('gzip', 'G')]
+        with mock.patch('downloader.middleware.ENCODERS', encoders):
+            self.assertEqual(negotiate_encoding('gzip, br, zstd'), ('zstd', 'Z'))
+            self.assertEqual(negotiate_encoding('gzip, br;q=0.8, zstd;q=0.5'), ('gzip', 'G'))
+            self.assertEqual(negotiate_encoding('zstd;q=0, br'), ('br', 'B'))
+            self.assertEqual(negotiate_encoding('*, zstd;q=0'), ('br', 'B'))
+            self.assertEqual(negotiate_encoding('identity'), (None, None))
+            self.assertEqual(negotiate_encoding('gzip;q=0'), (None, None))
+            self.assertEqual(negotiate_encoding(''), (None, None))
+
+    def test_json_responses_are_compressed(self):
+        for n in range(20):
+            make_download(title=f'Clip number {n}', status='completed')
+        with mock.patch('downloader.middleware.ENCODERS', [('gzip', gzip.compress)]):
+            response = self.client.get('/api/history/', HTTP_ACCEPT_ENCODING='gzip')
+            plain = self.client.get('/api/history/', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+
+    def test_playlists_are_compressed(self):
+        playlist = b'#EXTM3U\n' + b''.join(b'#EXTINF:6.0,\n/api/preview/5/low_%04d.m4s\n' % i for i in range(50))
+        video_download = make_download(status='completed', preview_status='ready', hls_path='hls/5/master.m3u8')
+        storage = FakeObjectStorage({'hls/5/low.m3u8': playlist})
+        with mock.patch('downloader.views.get_storage', return_value=storage), \
+                mock.patch('downloader.middleware.ENCODERS', [('gzip', gzip.compress)]):
+            response = self.client.get(f'/api/preview/{video_download.pk}/low.m3u8', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), playlist)
+
+
+class IdentityPoolTests(TestCase):
+    def setUp(self):
+        self.first = Identity(name='first')
+        self.second = Identity(name='second')
+        self.pool = IdentityPool([self.first, self.second])
+
+    def test_rate_limited_identity_cools_down_with_backoff(self):
+        identity = self.pool.acquire()
+        self.pool.release(identity, error=Exception('HTTP Error 429: Too Many Requests'))
+        self.assertAlmostEqual(identity.cooldown_until - time.time(), 30, delta=2)
+        other = self.pool.acquire()
+        self.assertIsNot(other, identity)
+        self.pool.release(other)
+
+        self.pool.release(identity, error=Exception('429'))
+        self.assertAlmostEqual(identity.cooldown_until - time.time(), 60, delta=2)
+
+    def test_everything_benched_uses_the_first_to_recover(self):
+        self.first.cooldown_until = time.time() + 100
+        self.second.cooldown_until = time.time() + 50
+        self.assertIs(self.pool.acquire(), self.second)
+
+    def test_auth_failures_bench_after_three_in_a_row(self):
+        for _ in range(2):
+            self.pool.release(self.first, error=Exception('Login required'))
+        self.assertEqual(self.first.cooldown_until, 0)
+        self.pool.release(self.first, error=Exception('HTTP Error 403: Forbidden'))
+        self.assertGreater(self.first.cooldown_until, time.time() + 200)
+
+    def test_success_resets_the_failure_streak_and_health_orders_choice(self):
+        self.pool.release(self.first, error=Exception('login required'))
+        self.pool.release(self.first, error=Exception('login required'))
+        self.assertIs(self.pool.acquire(), self.second)
+        self.pool.release(self.first)
+        self.assertEqual(self.first.consecutive_failures, 0)
+        # Unrelated errors say nothing about the identity
+        self.pool.release(self.second, error=Exception('Unsupported URL'))
+        self.assertEqual(self.second.failures, 0)
+
+    def test_error_in_the_block_releases_the_identity(self):
+        with mock.patch('downloader.identities.get_pool', return_value=self.pool):
+            with self.assertRaises(Exception):
+                with identity_for('https://example.com/v', {}):
+                    raise Exception('HTTP Error 429')
+        identity = self.first if self.first.failures else self.second
+        self.assertEqual((identity.in_flight, identity.failures), (0, 1))
+
+    def test_latency_stops_at_the_first_download_progress(self):
+        ydl_opts = {}
+        with mock.patch('downloader.identities.get_pool', return_value=self.pool), \
+                mock.patch('downloader.identities.time.monotonic', side_effect=[10.0, 12.5, 99.0]):
+            with identity_for('https://example.com/v', ydl_opts) as identity:
+                for hook in ydl_opts['progress_hooks']:
+                    hook({'status': 'downloading'})
+                    hook({'status': 'downloading'})
+        self.assertEqual(identity.avg_latency, 2.5)
+
+
+def queued(cost: float, owner: str = 'ip:1'):
+    return VideoDownload(url=f'https://example.com/watch?v={owner}-{cost}', owner=owner, estimated_cost=cost)
+
+
+class EnqueueTests(TestCase):
+    def tags(self, downloads):
+        return [(d.estimated_cost, d.fair_tag) for d in downloads]
+
+    def test_one_submission_runs_shortest_first(self):
+        downloads = enqueue([queued(30), queued(10), queued(20)], lane='bulk')
+        self.assertEqual(self.tags(downloads), [(10, 10), (20, 30), (30, 60)])
+        self.assertTrue(all(d.status == 'queued' and d.lane == 'bulk' for d in downloads))
+
+    def test_owner_backlog_only_delays_the_same_owner(self):
+        enqueue([queued(30), queued(30)], lane='bulk')
+        # Continues after its own backlog...
+        self.assertEqual(enqueue([queued(5)], lane='bulk')[0].fair_tag, 65)
+        # ...while a newcomer starts from the lane's virtual time
+        self.assertEqual(enqueue([queued(5, owner='ip:2')], lane='bulk')[0].fair_tag, 5)
+
+    def test_owner_weight_divides_cost(self):
+        with override_settings(DOWNLOAD_OWNER_WEIGHTS={'ip:2': 4}):
+            self.assertEqual(enqueue([queued(40, owner='ip:2')])[0].fair_tag, 10)
+
+    def test_newcomer_starts_at_the_virtual_time(self):
+        make_download(lane='bulk', status='completed', fair_tag=100, started_at=timezone.now())
+        self.assertEqual(enqueue([queued(5)], lane='bulk')[0].fair_tag, 105)
+        # Other lanes keep their own clock
+        self.assertEqual(enqueue([queued(5)], lane='interactive')[0].fair_tag, 5)
+
+
+@override_settings(DOWNLOAD_LANE_WEIGHTS={'interactive': 8, 'bulk': 2, 'prefetch': 1})
+class SchedulerTests(TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler(worker_id='worker:1')
+
+    def claimed_lanes(self, count: int) -> list:
+        return [self.scheduler.claim_next().lane for _ in range(count)]
+
+    def test_lanes_share_claims_by_weight(self):
+        enqueue([queued(10 + i) for i in range(10)], lane='interactive')
+        enqueue([queued(10 + i) for i in range(10)], lane='bulk')
+        lanes = self.claimed_lanes(10)
+        self.assertEqual((lanes.count('interactive'), lanes.count('bulk')), (8, 2))
+        # Bulk is not starved: its first job goes second
+        self.assertEqual(lanes[:2], ['interactive', 'bulk'])
+
+    def test_idle_lane_does_not_bank_credit(self):
+        enqueue([queued(10 + i) for i in range(20)], lane='interactive')
+        self.claimed_lanes(8)
+        enqueue([queued(10 + i) for i in range(4)], lane='bulk')
+        lanes = self.claimed_lanes(4)
+        self.assertEqual(lanes.count('bulk'), 1)
+
+    def test_claim_takes_the_lowest_tag_and_leases_it(self):
+        enqueue([queued(30), queued(5, owner='ip:2')])
+        video_download = self.scheduler.claim_next()
+        self.assertEqual((video_download.owner, video_download.status), ('ip:2', 'downloading'))
+        self.assertEqual((video_download.worker_id, video_download.attempts), ('worker:1', 1))
+        self.assertIsNotNone(video_download.lease_expires_at)
+
+    def test_empty_queue(self):
+        self.assertIsNone(self.scheduler.claim_next())
+
+    def test_requeued_job_keeps_its_place(self):
+        enqueue([queued(30)])
+        make_download(status='downloading', lane='interactive', fair_tag=3, attempts=1, worker_id='worker:2',
+                      lease_expires_at=timezone.now() - timedelta(seconds=10))
+        self.assertEqual(requeue_stale_jobs(), (1, 0))
+        video_download = self.scheduler.claim_next()
+        self.assertEqual((video_download.fair_tag, video_download.attempts), (3, 2))
+
+    def test_reprioritize_moves_to_the_front_of_the_lane(self):
+        make_download(lane='interactive', status='completed', fair_tag=4, started_at=timezone.now())
+        enqueue([queued(10), queued(20)])
+        video_download = enqueue([queued(5, owner='ip:2')], lane='bulk')[0]
+        self.assertTrue(reprioritize(video_download, 'interactive'))
+        claimed = Scheduler(['interactive'], worker_id='worker:1').claim_next()
+        self.assertEqual((claimed.pk, claimed.lane, claimed.fair_tag), (video_download.pk, 'interactive', 4))
+        # Only queued jobs can move
+        self.assertFalse(reprioritize(claimed, 'bulk'))
+
+
+class QueueFallbackTests(TestCase):
+    def tearDown(self):
+        tasks._queue_runner = None
+
+    def test_heartbeat_needs_a_shared_cache(self):
+        WorkerHeartbeat('worker:1').beat()
+        # A process-local cache cannot see another process's worker
+        self.assertFalse(worker_alive())
+        with mock.patch('downloader.scheduler.cache_is_shared', return_value=True):
+            self.assertTrue(worker_alive())
+
+    def test_runner_starts_once_without_a_worker(self):
+        with mock.patch('downloader.tasks.threading.Thread') as thread:
+            self.assertTrue(run_queue_in_process())
+            self.assertFalse(run_queue_in_process())
+        thread.return_value.start.assert_called_once_with()
+
+    def test_no_runner_when_a_worker_is_alive_or_disabled(self):
+        with mock.patch('downloader.tasks.threading.Thread') as thread:
+            with mock.patch('downloader.tasks.worker_alive', return_value=True):
+                self.assertFalse(run_queue_in_process())
+            with override_settings(DOWNLOAD_INPROCESS_FALLBACK=False):
+                self.assertFalse(run_queue_in_process())
+        thread.assert_not_called()
+
+    def test_drain_runs_every_queued_job(self):
+        first, second = enqueue([queued(10), queued(20)])
+        tasks._queue_runner = object()
+        # connection.close() would end the test's transaction
+        with mock.patch('downloader.tasks.run_queued_download') as run, mock.patch('downloader.tasks.connection'):
+            tasks._drain_queue()
+        self.assertEqual([call.args[0].pk for call in run.call_args_list], [first.pk, second.pk])
+        self.assertIsNone(tasks._queue_runner)
+
+
+class PopularityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_canonical_key_ignores_the_url_form(self):
+        key = canonical_key('https://www.youtube.com/watch?v=dQw4w9WgXcQ&feature=share')
+        self.assertEqual(key, 'Youtube:dQw4w9WgXcQ')
+        self.assertEqual(canonical_key('https://youtu.be/dQw4w9WgXcQ?si=abc'), key)
+        self.assertEqual(canonical_key('https://m.youtube.com/shorts/dQw4w9WgXcQ'), key)
+
+    def test_canonical_key_normalizes_other_urls(self):
+        key = canonical_key('https://www.example.com/v/1/?b=2&a=1&utm_source=x&fbclid=y')
+        self.assertTrue(key.startswith('url:'))
+        self.assertEqual(canonical_key('https://example.com/v/1?a=1&b=2'), key)
+        self.assertNotEqual(canonical_key('https://example.com/v/1?a=2&b=2'), key)
+
+    def test_sliding_window_drops_old_buckets(self):
+        counter = SlidingWindowCounter('test', window=60, bucket=10)
+        counter.incr('video', now=1000)
+        counter.incr('video', now=1005)
+        self.assertEqual(counter.incr('video', now=1030), 3)
+        self.assertEqual(counter.count('video', now=1059), 3)
+        # The 1000-1009 bucket has left the window
+        self.assertEqual(counter.count('video', now=1065), 1)
+        self.assertEqual(counter.count('other', now=1030), 0)
+
+    @override_settings(PREFETCH_ENABLED=True, PREFETCH_THRESHOLD=3)
+    def test_trending_at_the_threshold(self):
+        url = 'https://example.com/v/1'
+        counts = [record_request(url, quality='720p')[1] for _ in range(2)]
+        counts.append(record_request(url + '?utm_medium=social', quality='1080p')[1])
+        self.assertEqual(counts, [1, 2, 3])
+        self.assertEqual([is_trending(count) for count in counts], [False, False, True])
+        self.assertEqual(top_quality(canonical_key(url)), '720p')
+        with override_settings(PREFETCH_ENABLED=False):
+            self.assertFalse(is_trending(10))
+
+
+class PrefetchBudgetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def stored(self, name: str, size: int, lane: str = 'prefetch', age: int = 0, **fields):
+        key = f'downloads/{name}'
+        path = os.path.join(self.media_root.name, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        video_download = make_download(status='completed', lane=lane, file_path=key, file_size=size,
+                                       storage_backend='local', **fields)
+        VideoDownload.objects.filter(pk=video_download.pk).update(created_at=timezone.now() - timedelta(hours=age))
+        return video_download
+
+    def statuses(self, *downloads):
+        return [VideoDownload.objects.get(pk=d.pk).status for d in downloads]
+
+    def test_oldest_prefetched_files_are_evicted_first(self):
+        oldest = self.stored('a.mp4', 40, age=3)
+        older = self.stored('b.mp4', 40, age=2)
+        newest = self.stored('c.mp4', 40, age=1)
+        user = self.stored('d.mp4', 40, lane='interactive', age=4)
+        self.assertTrue(free_prefetch_space(50, 100))
+        self.assertEqual(self.statuses(oldest, older, newest, user), ['evicted', 'evicted', 'completed', 'completed'])
+        self.assertFalse(os.path.exists(os.path.join(self.media_root.name, 'downloads/a.mp4')))
+        self.assertFalse(free_prefetch_space(200, 100))
+
+    def test_evict_removes_the_preview_ladder(self):
+        video_download = self.stored('a.mp4', 10, hls_path='hls/7/master.m3u8', preview_status='ready')
+        hls_dir = os.path.join(self.media_root.name, 'hls/7')
+        os.makedirs(hls_dir)
+        open(os.path.join(hls_dir, 'master.m3u8'), 'w').close()
+        self.assertTrue(evict(video_download))
+        self.assertFalse(os.path.exists(hls_dir))
+        video_download.refresh_from_db()
+        self.assertEqual((video_download.status, video_download.hls_path), ('evicted', ''))
+
+    def test_evict_on_object_storage_removes_the_kept_copy(self):
+        video_download = self.stored('a.mp4', 10, hls_path='hls/7/master.m3u8')
+        VideoDownload.objects.filter(pk=video_download.pk).update(storage_backend='s3')
+        video_download.refresh_from_db()
+        storage = FakeObjectStorage({'downloads/a.mp4': b'x', 'hls/7/master.m3u8': b'#', 'hls/7/source_0001.m4s': b'',
+                                     'hls/70/master.m3u8': b'#'})
+        with mock.patch('downloader.storage.get_storage', return_value=storage):
+            self.assertTrue(evict(video_download))
+        self.assertEqual(list(storage.files), ['hls/70/master.m3u8'])
+        self.assertFalse(os.path.exists(os.path.join(self.media_root.name, 'downloads/a.mp4')))
+
+    def test_duplicates_keep_the_shared_file(self):
+        video_download = self.stored('a.mp4', 10)
+        make_download(status='completed', file_path='downloads/a.mp4', storage_backend='local')
+        self.assertTrue(evict(video_download))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root.name, 'downloads/a.mp4')))
+
+    @override_settings(PREFETCH_ENABLED=True, PREFETCH_MAX_DISK_BYTES=100)
+    def test_scheduling_leaves_evictions_to_the_worker(self):
+        full = self.stored('a.mp4', 90)
+        info = {'webpage_url': 'https://example.com/v/2', 'title': 'Trending', 'duration': 10}
+        with mock.patch('downloader.prefetch.estimated_bytes', return_value=50), \
+                mock.patch('downloader.tasks.run_queue_in_process'):
+            job = maybe_prefetch('url:2', 'https://example.com/v/2', info)
+        self.assertEqual((job.lane, job.options['estimated_bytes']), ('prefetch', 50))
+        self.assertEqual(self.statuses(full), ['completed'])
+        self.assertTrue(make_prefetch_room(job))
+        self.assertEqual(self.statuses(full), ['evicted'])
+        # A job bigger than the whole budget is never queued
+        with mock.patch('downloader.prefetch.estimated_bytes', return_value=150):
+            self.assertIsNone(maybe_prefetch('url:3', 'https://example.com/v/3', info))
+
+
+class ApiKeyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api_key, self.raw_key = ApiKey.generate('integration')
+        self.other_key, _ = ApiKey.generate('other')
+        # Requests made here are metered by UsageMiddleware
+        self.addCleanup(usage_meter.flush)
+
+    def get(self, path: str, raw_key: str = None):
+        return self.client.get(path, HTTP_X_API_KEY=raw_key or self.raw_key)
+
+    def test_revoked_key_is_refused(self):
+        self.assertEqual(self.get('/api/history/').status_code, 200)
+        ApiKey.objects.filter(pk=self.api_key.pk).update(is_active=False)
+        cache.clear()
+        self.assertEqual(self.get('/api/history/').status_code, 401)
+        self.assertEqual(self.client.get(f'/api/history/?api_key={self.raw_key}').status_code, 401)
+        self.assertEqual(self.get('/api/history/', raw_key='not-a-key').status_code, 401)
+
+    def test_over_hard_quota_is_refused(self):
+        ApiKey.objects.filter(pk=self.api_key.pk).update(quotas={'requests': {'soft': 2, 'hard': 5}})
+        usage = ApiKeyUsage.objects.create(api_key=self.api_key, period=current_period(), requests=3)
+        cache.clear()
+        self.assertEqual(self.get('/api/history/')['X-Quota-Warning'], 'Soft quota exceeded: requests')
+        ApiKeyUsage.objects.filter(pk=usage.pk).update(requests=5)
+        cache.clear()
+        response = self.get('/api/history/')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('requests', response.json()['detail'])
+
+    def test_usage_is_persisted_on_flush(self):
+        meter = UsageMeter(flush_interval=3600)
+        meter.record(self.api_key.pk, requests=1, bytes_served=100)
+        meter.record(self.api_key.pk, requests=1, bytes_served=50)
+        meter.record(None, requests=1)
+        self.assertFalse(ApiKeyUsage.objects.exists())
+        self.assertEqual(meter.flush(), 1)
+        meter.record(self.api_key.pk, requests=1)
+        meter.flush()
+        usage = ApiKeyUsage.objects.get(api_key=self.api_key, period=current_period())
+        self.assertEqual((usage.requests, usage.bytes_served), (3, 150))
+        self.assertEqual(meter.pending(self.api_key.pk)['requests'], 0)
+
+    def test_keys_only_see_their_own_downloads(self):
+        own = make_download(api_key=self.api_key, status='completed', file_path='downloads/own.mp4')
+        other = make_download(api_key=self.other_key, status='completed', file_path='downloads/other.mp4')
+        history = self.get('/api/history/').json()['downloads']
+        self.assertEqual([d['id'] for d in history], [own.pk])
+        self.assertEqual(self.get(f'/api/file/{other.pk}/').status_code, 404)
+        archive = self.get(f'/api/archive.zip?ids={own.pk},{other.pk}')
+        self.assertEqual((archive.status_code, archive.json()['details']), (404, [other.pk]))
+        # Requests without a key are not scoped
+        anonymous = self.client.get('/api/history/').json()['downloads']
+        self.assertEqual({d['id'] for d in anonymous}, {own.pk, other.pk})
@@ -1,22 +1,40 @@
 from django.urls import path
 from .views import (
     VideoInfoView,
+    SubtitlesView,
     DownloadVideoView,
+    BatchDownloadView,
     DirectURLView,
     DownloadAudioView,
     DownloadFileView,
+    ArchiveView,
+    HLSPreviewView,
     SupportedSitesView,
     HealthCheckView,
+    ReadinessView,
+    DuplicatesView,
+    UsageView,
     DownloadHistoryView,
+    JobEventsView,
+    ClientEventsView,
 )
 
 urlpatterns = [
     path('info/', VideoInfoView.as_view(), name='video-info'),
+    path('subtitles/', SubtitlesView.as_view(), name='subtitles'),
     path('download/', DownloadVideoView.as_view(), name='download-video'),
+    path('download/batch/', BatchDownloadView.as_view(), name='download-batch'),
     path('direct-url/', DirectURLView.as_view(), name='direct-url'),
     path('download-audio/', DownloadAudioView.as_view(), name='download-audio'),
     path('file/<int:pk>/', DownloadFileView.as_view(), name='download-file'),
+    path('archive.<str:archive_format>', ArchiveView.as_view(), name='download-archive'),
+    path('preview/<int:pk>/<str:name>', HLSPreviewView.as_view(), name='hls-preview'),
     path('supported-sites/', SupportedSitesView.as_view(), name='supported-sites'),
     path('health/', HealthCheckView.as_view(), name='health-check'),
+    path('ready/', ReadinessView.as_view(), name='readiness'),
+    path('duplicates/<int:pk>/', DuplicatesView.as_view(), name='duplicates'),
+    path('usage/', UsageView.as_view(), name='usage'),
     path('history/', DownloadHistoryView.as_view(), name='download-history'),
+    path('events/<int:pk>/', JobEventsView.as_view(), name='job-events'),
+    path('events/client/<str:client_id>/', ClientEventsView.as_view(), name='client-events'),
 ]
@@ -1,34 +1,102 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from django.http import FileResponse, Http404
 from django.conf import settings
 import yt_dlp
 import os
-import json
-from pathlib import Path
 import time
-import shutil
-import subprocess
-from django.http import FileResponse, Http404, StreamingHttpResponse
+from functools import lru_cache
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.core.cache import cache
-import requests
-import hashlib
-from .models import VideoDownload
+from django.utils import timezone
+from .models import MediaFingerprint, VideoDownload
+from .notifications import publish_status, event_stream, job_channel, client_channel
+from .jobs import transition, fail_download, track_progress, lease_fields, worker_name, LeaseHeartbeat
+from .metering import current_period, measure, record_usage, usage_totals
+from .permissions import request_api_key
+from .renderers import DownloadRenderer, EventStreamRenderer, ORJSONRenderer
+from .storage import get_storage, store_file
+from .packaging import CONTENT_TYPES, preview_url
+from .formats import detect_platform, choose_format, apply_format
+from .identities import identity_for, request_headers
+from .scheduler import enqueue, estimate_cost
+from .archive import ARCHIVE_FORMATS, build_archive, file_checksums, has_checksums, parse_range
+from .fingerprint import find_duplicates
+from .subtitles import batch_subtitles
+from .prefetch import (
+    record_request,
+    is_trending,
+    is_cacheable,
+    cached_info,
+    cache_info,
+    cached_download,
+    count_lookup,
+    maybe_prefetch,
+)
+from .tasks import (
+    check_ffmpeg,
+    get_ffmpeg_location,
+    get_ffmpeg_version,
+    remove_partial_files,
+    is_clip_request,
+    build_ydl_options,
+    plan_download,
+    info_fields,
+    run_download,
+    run_queue_in_process,
+    expand_playlist,
+    video_info_payload,
+)
+from .warmup import is_warm, start_warm_up, warm_up_report
+from .audio import (
+    AUDIO_CODECS,
+    pick_audio_source,
+    extract_audio_stream,
+    get_cached_audio,
+    cache_audio,
+)
 from .serializers import (
-    VideoDownloadSerializer,
+    HISTORY_PUBLIC_FIELDS,
+    VideoDownloadListSerializer,
     VideoInfoSerializer,
     DownloadRequestSerializer,
-    AudioDownloadSerializer
+    BatchDownloadSerializer,
+    SubtitlesRequestSerializer,
+    AudioDownloadSerializer,
+    parse_fields_param,
 )
 
 def absolute_url(request, path: str) -> str:
     return request.build_absolute_uri(path)
 
 
+def api_key_id(request):
+    api_key = request_api_key(request)
+    return api_key.pk if api_key is not None else None
+
+
+def visible_downloads(request):
+    """Downloads the caller may see: a request made with an API key only sees that key's jobs"""
+    api_key = request_api_key(request)
+    if api_key is None:
+        return VideoDownload.objects.all()
+    return VideoDownload.objects.filter(api_key=api_key)
+
+
+def request_owner(request, client_id: str = None) -> str:
+    """Who a job is accounted to for fair scheduling: the API key, client id, or caller's IP"""
+    api_key = request_api_key(request)
+    if api_key is not None:
+        return f'key:{api_key.pk}'
+    if client_id:
+        return client_id
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    address = forwarded.split(',')[0].strip() or request.META.get('REMOTE_ADDR', '')
+    return f'ip:{address}'
+
+
 def is_tiktok_url(url: str) -> bool:
-    u = (url or "").lower()
-    return "tiktok.com" in u or "vm.tiktok.com" in u or "vt.tiktok.com" in u
+    return detect_platform(url) == "tiktok"
 
 
 def tiktok_stream_format(quality: str) -> str:
@@ -54,23 +122,20 @@ def tiktok_stream_format(quality: str) -> str:
     return base(None)
 
 
-def pick_progressive_url(info: dict) -> str:
+def pick_progressive_url(info: dict, quality: str = "best") -> str:
     # Prefer a single mp4 with audio+video
     if info.get("url") and (info.get("ext") == "mp4" or ".mp4" in str(info.get("url"))):
         return info["url"]
 
-    fmts = info.get("formats") or []
-    for f in reversed(fmts):
-        u = f.get("url")
-        if not u:
-            continue
-        if f.get("ext") == "mp4" and f.get("vcodec") != "none" and f.get("acodec") != "none":
-            return u
+    # Best ranked progressive (no merge) format for the requested quality
+    choice = choose_format(info, quality, "mp4", can_merge=False)
+    if choice:
+        return choice.video["url"]
 
     # Fallback: any url
     if info.get("url"):
         return info["url"]
-    for f in reversed(fmts):
+    for f in reversed(info.get("formats") or []):
         u = f.get("url")
         if u:
             return u
@@ -79,6 +144,8 @@ def pick_progressive_url(info: dict) -> str:
 
 
 def stream_upstream(url: str, headers: dict, chunk_size: int = 1024 * 512):
+    import requests  # only needed for proxied streams
+
     r = requests.get(url, headers=headers, stream=True, timeout=45, allow_redirects=True)
     try:
         r.raise_for_status()
@@ -91,86 +158,11 @@ def stream_upstream(url: str, headers: dict, chunk_size: int = 1024 * 512):
         except Exception:
             pass
 
-def check_ffmpeg():
-    """Check if FFmpeg is installed"""
-    return shutil.which('ffmpeg') is not None
-
-
-def get_ffmpeg_location():
-    """Get FFmpeg location or return None"""
-    # Check common Windows locations first
-    common_windows_paths = [
-        r"C:\ffmpeg\bin",
-        r"C:\Program Files\ffmpeg\bin",
-        r"C:\Program Files (x86)\ffmpeg\bin",
-    ]
-    
-    for path in common_windows_paths:
-        if os.path.exists(os.path.join(path, 'ffmpeg.exe')):
-            return path
-    
-    # Check system PATH
-    ffmpeg_path = shutil.which('ffmpeg')
-    if ffmpeg_path:
-        return os.path.dirname(ffmpeg_path)
-    
-    return None
-
-
-def get_platform_specific_format(url, quality, has_ffmpeg):
-    """Get platform-specific format string"""
-    url_lower = url.lower()
-    
-    # Facebook-specific formats
-    if 'facebook.com' in url_lower or 'fb.watch' in url_lower or 'fb.com' in url_lower:
-        if has_ffmpeg:
-            return 'best[ext=mp4]/best'
-        else:
-            return 'best'
-    
-    # Instagram-specific formats
-    elif 'instagram.com' in url_lower:
-        return 'best[ext=mp4]/best'
-    
-    # Twitter/X-specific formats
-    elif 'twitter.com' in url_lower or 'x.com' in url_lower:
-        if has_ffmpeg:
-            quality_map = {
-                'best': 'best[ext=mp4]/best',
-                '1080p': 'best[height<=1080][ext=mp4]/best[height<=1080]',
-                '720p': 'best[height<=720][ext=mp4]/best[height<=720]',
-                '480p': 'best[height<=480][ext=mp4]/best[height<=480]',
-                '360p': 'best[height<=360][ext=mp4]/best[height<=360]'
-            }
-        else:
-            quality_map = {
-                'best': 'best',
-                '1080p': 'best[height<=1080]',
-                '720p': 'best[height<=720]',
-                '480p': 'best[height<=480]',
-                '360p': 'best[height<=360]'
-            }
-        return quality_map.get(quality, quality_map['best'])
-    
-    # YouTube and other sites that support separate video+audio streams
-    else:
-        if has_ffmpeg:
-            quality_map = {
-                'best': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best[ext=mp4]/best',
-                '1080p': 'bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=1080]+bestaudio/best[height<=1080][ext=mp4]/best[height<=1080]',
-                '720p': 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=720]+bestaudio/best[height<=720][ext=mp4]/best[height<=720]',
-                '480p': 'bestvideo[height<=480][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=480]+bestaudio/best[height<=480][ext=mp4]/best[height<=480]',
-                '360p': 'bestvideo[height<=360][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=360]+bestaudio/best[height<=360][ext=mp4]/best[height<=360]'
-            }
-        else:
-            quality_map = {
-                'best': 'best[ext=mp4]/best',
-                '1080p': 'best[height<=1080][ext=mp4]/best[height<=1080]',
-                '720p': 'best[height<=720][ext=mp4]/best[height<=720]',
-                '480p': 'best[height<=480][ext=mp4]/best[height<=480]',
-                '360p': 'best[height<=360][ext=mp4]/best[height<=360]'
-            }
-        return quality_map.get(quality, quality_map['best'])
+@lru_cache(maxsize=None)
+def get_extractor_names():
+    """Sorted names of every yt-dlp extractor (loads the extractor registry)"""
+    extractors = yt_dlp.extractor.gen_extractor_classes()
+    return tuple(sorted(e.IE_NAME for e in extractors if hasattr(e, 'IE_NAME')))
 
 
 class VideoInfoView(APIView):
@@ -182,6 +174,18 @@ class VideoInfoView(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         url = serializer.validated_data['url']
+        fields = parse_fields_param(request)
+
+        # Trending videos are answered from the pre-extracted info
+        key, requests_in_window = record_request(url)
+        trending = is_trending(requests_in_window)
+        video_info = cached_info(key) if trending else None
+        if trending:
+            count_lookup('info', video_info is not None)
+        if video_info is not None:
+            if fields is not None:
+                video_info = {k: v for k, v in video_info.items() if k in fields or k == 'success'}
+            return Response(video_info, status=status.HTTP_200_OK)
         
         ydl_opts = {
             'quiet': True,
@@ -191,41 +195,18 @@ class VideoInfoView(APIView):
         }
         
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
+            with identity_for(url, ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                with measure(api_key_id(request)):
+                    info = ydl.extract_info(url, download=False)
                 
-                # Extract available formats
-                formats = []
-                if 'formats' in info:
-                    for f in info['formats']:
-                        # Include both combined formats and separate video/audio
-                        if f.get('vcodec') != 'none' or f.get('acodec') != 'none':
-                            formats.append({
-                                'format_id': f.get('format_id'),
-                                'quality': f.get('format_note', f.get('quality', 'unknown')),
-                                'ext': f.get('ext'),
-                                'filesize': f.get('filesize'),
-                                'resolution': f.get('resolution'),
-                                'fps': f.get('fps'),
-                                'has_video': f.get('vcodec') != 'none',
-                                'has_audio': f.get('acodec') != 'none',
-                            })
-                
-                video_info = {
-                    'success': True,
-                    'id': info.get('id'),
-                    'title': info.get('title'),
-                    'thumbnail': info.get('thumbnail'),
-                    'duration': info.get('duration'),
-                    'uploader': info.get('uploader') or info.get('channel'),
-                    'upload_date': info.get('upload_date'),
-                    'view_count': info.get('view_count'),
-                    'description': info.get('description', '')[:500],
-                    'platform': info.get('extractor_key'),
-                    'webpage_url': info.get('webpage_url'),
-                    'formats': formats[:20],
-                    'ffmpeg_available': check_ffmpeg(),
-                }
+                # Only the returned subset of formats is built (all of them when caching)
+                video_info = video_info_payload(info, include_formats=trending or fields is None or 'formats' in fields)
+                if trending:
+                    cache_info(key, video_info)
+                    maybe_prefetch(key, url, info)
+
+                if fields is not None:
+                    video_info = {k: v for k, v in video_info.items() if k in fields or k == 'success'}
                 
                 return Response(video_info, status=status.HTTP_200_OK)
                 
@@ -236,6 +217,46 @@ class VideoInfoView(APIView):
                 'details': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class SubtitlesView(APIView):
+    """
+    Subtitles / automatic captions of one or many videos as VTT, SRT or text.
+    URL: /api/subtitles/
+    """
+
+    def post(self, request):
+        serializer = SubtitlesRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        urls = data.get('urls') or [data['url']]
+        results = batch_subtitles(
+            urls,
+            languages=data.get('languages'),
+            include_auto=data['include_auto'],
+            output_format=data['format'],
+            timestamps=data['timestamps'],
+            api_key_id=api_key_id(request),
+        )
+
+        if data.get('url'):
+            result = results[0]
+            if not result['success']:
+                return Response({
+                    'success': False,
+                    'error': 'Failed to fetch subtitles',
+                    'details': result['error']
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return Response(result, status=status.HTTP_200_OK)
+
+        return Response({
+            'success': True,
+            'count': len(results),
+            'failed': sum(1 for r in results if not r['success']),
+            'results': results,
+        }, status=status.HTTP_200_OK)
+
+
 class TikTokStreamView(APIView):
     """
     Streams TikTok via our server (no disk write).
@@ -258,30 +279,21 @@ class TikTokStreamView(APIView):
                 "quiet": True,
                 "no_warnings": True,
                 "nocheckcertificate": True,
-                "http_headers": {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                    "Referer": "https://www.tiktok.com/",
-                    "Accept-Language": "en-US,en;q=0.9",
-                },
             }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with identity_for(video_download.url, ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 info = ydl.extract_info(video_download.url, download=False)
-                direct_url = pick_progressive_url(info)
+                direct_url = pick_progressive_url(info, video_download.quality or "best")
 
             cache.set(cache_key, direct_url, 1800)
 
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Referer": "https://www.tiktok.com/",
-            "Accept-Language": "en-US,en;q=0.9",
-        }
+        headers = request_headers(platform="tiktok")
 
         resp = StreamingHttpResponse(stream_upstream(direct_url, headers), content_type="video/mp4")
         resp["Access-Control-Allow-Origin"] = "*"
         return resp
 
 class DownloadVideoView(APIView):
-    """Download video to server"""
+    """Download video to server (or queue it with `queue: true`)"""
     
     def post(self, request):
         serializer = DownloadRequestSerializer(data=request.data)
@@ -290,76 +302,118 @@ class DownloadVideoView(APIView):
         
         url = serializer.validated_data['url']
         quality = serializer.validated_data['quality']
-        video_format = serializer.validated_data['format']
-        
+        options = serializer.job_options()
+        chapters = options.get('chapters') or []
+        is_clip = is_clip_request(options)
+
         # Check FFmpeg availability
         has_ffmpeg = check_ffmpeg()
         ffmpeg_location = get_ffmpeg_location()
-        
-        # Create media directory if it doesn't exist
-        media_path = os.path.join(settings.MEDIA_ROOT, 'downloads')
-        os.makedirs(media_path, exist_ok=True)
-        
-        # Generate unique filename
-        timestamp = int(time.time())
-        output_template = os.path.join(media_path, f'video_{timestamp}.%(ext)s')
-        
-        # Get platform-specific format string
-        format_string = get_platform_specific_format(url, quality, has_ffmpeg)
-        
-        ydl_opts = {
-            'format': format_string,
-            'outtmpl': output_template,
-            'quiet': True,
-            'no_warnings': True,
-            'nocheckcertificate': True,
-            'ignoreerrors': False,
-        }
-        
-        # Add FFmpeg location and merge format if available
-        if has_ffmpeg:
-            ydl_opts['merge_output_format'] = video_format
-            if ffmpeg_location:
-                ydl_opts['ffmpeg_location'] = ffmpeg_location
-                print(f"Using FFmpeg from: {ffmpeg_location}")
+
+        # Range downloads are cut by FFmpeg
+        if is_clip and not has_ffmpeg:
+            return Response({
+                'success': False,
+                'error': 'FFmpeg is required for clip downloads',
+                'solution': 'Please install FFmpeg or download the full video',
+            }, status=status.HTTP_424_FAILED_DEPENDENCY)
+
+        # Popular renditions are answered straight from the media store
+        key, requests_in_window = record_request(url, quality)
+        hit = cached_download(url, options)
+        if is_cacheable(options):
+            count_lookup('media', hit is not None)
+        if hit is not None:
+            response_data = {
+                'success': True,
+                'message': 'Video downloaded successfully',
+                'id': hit.id,
+                'filename': os.path.basename(hit.file_path),
+                'size': hit.file_size,
+                'download_url': f'/api/file/{hit.id}/',
+                'title': hit.title,
+                'platform': hit.platform,
+                'cached': True,
+            }
+            if hit.hls_path or hit.preview_status in ('pending', 'packaging'):
+                response_data['preview_url'] = preview_url(hit.id, 'master.m3u8')
+                response_data['preview_status'] = hit.preview_status or 'ready'
+            return Response(response_data, status=status.HTTP_200_OK)
+
+        # Platform-specific format string, FFmpeg location and merge format
+        # (the output file is named after the record, see run_download)
+        ydl_opts = build_ydl_options(url, options, has_ffmpeg, ffmpeg_location)
+        if ffmpeg_location:
+            print(f"Using FFmpeg from: {ffmpeg_location}")
         
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with identity_for(url, ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 # Get info first
-                info = ydl.extract_info(url, download=False)
-                
-                # Create database record
-                video_download = VideoDownload.objects.create(
+                with measure(api_key_id(request)):
+                    info = ydl.extract_info(url, download=False)
+
+                try:
+                    clip_range, choice = plan_download(ydl, info, options, has_ffmpeg)
+                except ValueError as e:
+                    return Response({
+                        'success': False,
+                        'error': 'Invalid clip range',
+                        'details': str(e)
+                    }, status=status.HTTP_400_BAD_REQUEST)
+
+                if is_trending(requests_in_window):
+                    cache_info(key, video_info_payload(info))
+                    maybe_prefetch(key, url, info, skip_quality=quality)
+
+                job = VideoDownload(
                     url=url,
-                    title=info.get('title', ''),
-                    platform=info.get('extractor_key', ''),
-                    thumbnail=info.get('thumbnail', ''),
-                    duration=info.get('duration'),
                     quality=quality,
-                    status='downloading'
+                    clip_chapters=chapters,
+                    callback_url=serializer.validated_data.get('callback_url', ''),
+                    client_id=serializer.validated_data.get('client_id', ''),
+                    owner=request_owner(request, serializer.validated_data.get('client_id')),
+                    api_key=request_api_key(request),
+                    options=options,
+                    estimated_cost=estimate_cost(info, choice, clip_range, options),
+                    **info_fields(info, clip_range)
                 )
-                
-                # Download video
-                ydl.download([url])
-                
-                # Find downloaded file
-                downloaded_files = [f for f in os.listdir(media_path) 
-                                  if f.startswith(f'video_{timestamp}')]
-                
-                if not downloaded_files:
-                    video_download.status = 'failed'
-                    video_download.save()
-                    raise Exception('Downloaded file not found')
-                
-                filename = downloaded_files[0]
-                file_path = os.path.join(media_path, filename)
-                file_size = os.path.getsize(file_path)
-                
-                # Update database record
-                video_download.file_path = f'downloads/{filename}'
-                video_download.file_size = file_size
-                video_download.status = 'completed'
-                video_download.save()
+
+                # Queued: a worker re-extracts and downloads it in fair order
+                if serializer.validated_data['queue']:
+                    video_download = enqueue([job], lane='interactive')[0]
+                    run_queue_in_process()
+                    return Response({
+                        'success': True,
+                        'message': 'Download queued',
+                        'id': video_download.id,
+                        'status': video_download.status,
+                        'lane': video_download.lane,
+                        'estimated_cost': video_download.estimated_cost,
+                        'title': video_download.title,
+                        'events_url': f'/api/events/{video_download.id}/',
+                    }, status=status.HTTP_202_ACCEPTED)
+
+                # Create database record; the lease lets a worker take over
+                # (and resume the .part files) if this request's process dies
+                if choice:
+                    job.options = {**options, 'format_spec': choice.format_spec}
+                job.status = 'downloading'
+                job.started_at = timezone.now()
+                job.attempts = 1
+                for name, value in lease_fields(worker_name()).items():
+                    setattr(job, name, value)
+                job.save()
+                video_download = job
+                publish_status(video_download)
+
+                lease = LeaseHeartbeat(video_download)
+                with lease:
+                    result = run_download(ydl, info, video_download, job.options, has_ffmpeg, ffmpeg_location,
+                                          choice=choice, clip_range=clip_range, lease=lease,
+                                          defer_packaging=True)
+                filename = result['filename']
+                file_size = result['file_size']
+                preview_status = result['preview_status']
                 
                 response_data = {
                     'success': True,
@@ -371,6 +425,21 @@ class DownloadVideoView(APIView):
                     'title': video_download.title,
                     'platform': video_download.platform,
                 }
+
+                if choice:
+                    response_data['format'] = choice.summary()
+
+                if preview_status in ('ready', 'pending'):
+                    # A pending preview is packaged by the queue worker; until then the URL answers 503
+                    response_data['preview_url'] = preview_url(video_download.id, 'master.m3u8')
+                    response_data['preview_status'] = preview_status
+
+                if clip_range:
+                    response_data['clip'] = {
+                        'start_time': video_download.clip_start,
+                        'end_time': video_download.clip_end,
+                        'chapters': video_download.clip_chapters,
+                    }
                 
                 # Add warning if FFmpeg is not available
                 if not has_ffmpeg:
@@ -380,14 +449,21 @@ class DownloadVideoView(APIView):
                 
         except Exception as e:
             error_message = str(e)
+
+            if 'lease' in locals() and lease.lost:
+                # Requeued while this request stalled: the worker that took it
+                # over continues from the .part files, so leave the row alone
+                return Response({
+                    'success': True,
+                    'message': 'Download handed over to the queue',
+                    'id': video_download.id,
+                    'status': 'queued',
+                    'events_url': f'/api/events/{video_download.id}/',
+                }, status=status.HTTP_202_ACCEPTED)
             
             # Update database record if it exists
-            try:
-                if 'video_download' in locals():
-                    video_download.status = 'failed'
-                    video_download.save()
-            except:
-                pass
+            if 'video_download' in locals() and fail_download(video_download, error_message):
+                remove_partial_files(video_download)
             
             # Provide helpful error message if FFmpeg is missing
             if 'ffmpeg' in error_message.lower() or 'merging' in error_message.lower():
@@ -427,6 +503,72 @@ class DownloadVideoView(APIView):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class BatchDownloadView(APIView):
+    """Queue many videos (a URL list or a playlist) in the bulk lane"""
+
+    def post(self, request):
+        serializer = BatchDownloadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        options = serializer.job_options()
+        client_id = serializer.validated_data.get('client_id', '')
+        playlist_url = serializer.validated_data.get('playlist_url')
+
+        if playlist_url:
+            try:
+                with measure(api_key_id(request)):
+                    entries = expand_playlist(playlist_url, BatchDownloadSerializer.MAX_ITEMS)
+            except Exception as e:
+                return Response({
+                    'success': False,
+                    'error': 'Could not read playlist',
+                    'details': str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
+            if not entries:
+                return Response({
+                    'success': False,
+                    'error': 'Playlist has no downloadable entries'
+                }, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            entries = [{'url': url} for url in serializer.validated_data['urls']]
+
+        owner = request_owner(request, client_id)
+        jobs = [
+            VideoDownload(
+                url=entry['url'],
+                title=entry.get('title', ''),
+                platform=entry.get('platform', ''),
+                duration=int(entry['duration']) if entry.get('duration') else None,
+                quality=options['quality'],
+                callback_url=serializer.validated_data.get('callback_url', ''),
+                client_id=client_id,
+                owner=owner,
+                api_key=request_api_key(request),
+                options=options,
+                # Flat playlist entries carry the duration: enough for a shortest-job-first hint
+                estimated_cost=estimate_cost(entry, options=options),
+            )
+            for entry in entries
+        ]
+        queued = enqueue(jobs, lane='bulk')
+        run_queue_in_process()
+
+        response_data = {
+            'success': True,
+            'message': 'Downloads queued',
+            'count': len(queued),
+            'lane': 'bulk',
+            'jobs': [
+                {'id': job.id, 'url': job.url, 'title': job.title, 'estimated_cost': job.estimated_cost}
+                for job in queued
+            ],
+        }
+        if client_id:
+            response_data['events_url'] = f'/api/events/client/{client_id}/'
+        return Response(response_data, status=status.HTTP_202_ACCEPTED)
+
+
 class DirectURLView(APIView):
     """Get direct download URL without downloading to server"""
     
@@ -455,8 +597,9 @@ class DirectURLView(APIView):
         }
         
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
+            with identity_for(url, ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                with measure(api_key_id(request)):
+                    info = ydl.extract_info(url, download=False)
                 
                 # Get the direct URL
                 if 'url' in info:
@@ -488,62 +631,12 @@ class DownloadAudioView(APIView):
     
     def post(self, request):
         serializer = AudioDownloadSerializer(data=request.data)
-        quality = request.data.resolution
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         url = serializer.validated_data['url']
         audio_format = serializer.validated_data['format']
-                # TikTok: stream-proxy flow (no disk write). Keep other platforms unchanged.
-        if is_tiktok_url(url):
-            ydl_opts = {
-                "format": tiktok_stream_format(quality),
-                "quiet": True,
-                "no_warnings": True,
-                "nocheckcertificate": True,
-                "http_headers": {
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                    "Referer": "https://www.tiktok.com/",
-                    "Accept-Language": "en-US,en;q=0.9",
-                },
-            }
-
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                direct_url = pick_progressive_url(info)
-
-            # Create DB record (no file_path) so your history still works
-            video_download = VideoDownload.objects.create(
-                url=url,
-                title=info.get("title", ""),
-                platform=info.get("extractor_key", "tiktok"),
-                thumbnail=info.get("thumbnail", ""),
-                duration=info.get("duration"),
-                quality=quality,
-                status="completed",
-                file_path="",
-                file_size=0,
-            )
-
-            # Cache the direct url for the stream endpoint
-            cache.set(f"tiktok:direct:{video_download.id}", direct_url, 1800)
-
-            stream_path = f"/api/tiktok-stream/{video_download.id}/"
-            return Response(
-                {
-                    "success": True,
-                    "message": "TikTok video ready to stream",
-                    "id": video_download.id,
-                    "title": video_download.title,
-                    "platform": video_download.platform,
-                    "thumbnail": video_download.thumbnail,
-                    "duration": video_download.duration,
-                    "mode": "stream",
-                    "download_url": absolute_url(request, stream_path),
-                    "direct_url": direct_url,
-                },
-                status=status.HTTP_200_OK,
-            )
+        bitrate = serializer.validated_data['bitrate']
 
         # Check FFmpeg for audio conversion
         has_ffmpeg = check_ffmpeg()
@@ -556,29 +649,35 @@ class DownloadAudioView(APIView):
         output_template = os.path.join(media_path, f'audio_{timestamp}.%(ext)s')
         
         ydl_opts = {
-            'format': 'bestaudio/best',
             'outtmpl': output_template,
             'quiet': True,
             'no_warnings': True,
             'nocheckcertificate': True,
         }
-        
-        # Only add audio extraction if FFmpeg is available
-        if has_ffmpeg and audio_format in ['mp3', 'aac', 'flac', 'wav', 'opus']:
-            ydl_opts['postprocessors'] = [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': audio_format,
-                'preferredquality': '192',
-            }]
-            if ffmpeg_location:
-                ydl_opts['ffmpeg_location'] = ffmpeg_location
-        else:
-            # Without FFmpeg, download in original format
-            ydl_opts['format'] = 'bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio/best'
+        if ffmpeg_location:
+            ydl_opts['ffmpeg_location'] = ffmpeg_location
         
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
+            with identity_for(url, ydl_opts), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                with measure(api_key_id(request)):
+                    info = ydl.extract_info(url, download=False)
+
+                # Same video already converted to this codec/bitrate
+                if has_ffmpeg:
+                    cached = get_cached_audio(info, audio_format, bitrate)
+                    count_lookup('audio', cached is not None)
+                    if cached:
+                        return Response({
+                            'success': True,
+                            'message': 'Audio served from cache',
+                            'id': cached.id,
+                            'filename': os.path.basename(cached.file_path),
+                            'size': cached.file_size,
+                            'download_url': f'/api/file/{cached.id}/',
+                            'cached': True,
+                        }, status=status.HTTP_200_OK)
+
+                source, audio_only = pick_audio_source(info)
                 
                 video_download = VideoDownload.objects.create(
                     url=url,
@@ -587,27 +686,68 @@ class DownloadAudioView(APIView):
                     thumbnail=info.get('thumbnail', ''),
                     duration=info.get('duration'),
                     quality='audio',
-                    status='downloading'
+                    callback_url=serializer.validated_data.get('callback_url', ''),
+                    client_id=serializer.validated_data.get('client_id', ''),
+                    api_key=request_api_key(request),
+                    # Recorded so recovery and retries never run it as a video download
+                    options={'kind': 'audio', 'format': audio_format, 'bitrate': bitrate},
+                    status='downloading',
+                    started_at=timezone.now(),
+                    attempts=1,
+                    **lease_fields(worker_name())
                 )
+                publish_status(video_download)
+                lease = LeaseHeartbeat(video_download)
+                with lease:
+                    if not audio_only and has_ffmpeg:
+                        # Only muxed streams: pull the audio track out while reading,
+                        # never storing the video
+                        ext, _ = AUDIO_CODECS[audio_format]
+                        extract_audio_stream(
+                            source,
+                            os.path.join(media_path, f'audio_{timestamp}.{ext}'),
+                            audio_format,
+                            bitrate,
+                            ffmpeg_location,
+                        )
+                    else:
+                        # Audio-only stream (or no FFmpeg: keep the original file)
+                        apply_format(ydl, source['format_id'])
+                        if has_ffmpeg:
+                            ydl.add_post_processor(
+                                yt_dlp.postprocessor.FFmpegExtractAudioPP(
+                                    ydl,
+                                    preferredcodec=audio_format,
+                                    preferredquality=bitrate,
+                                ),
+                                when='post_process',
+                            )
+                        ydl.add_progress_hook(lambda d: track_progress(video_download, d))
+                        ydl.process_ie_result(info, download=True)
                 
-                ydl.download([url])
-                
-                downloaded_files = [f for f in os.listdir(media_path) 
-                                  if f.startswith(f'audio_{timestamp}')]
+                    downloaded_files = [f for f in os.listdir(media_path) 
+                                      if f.startswith(f'audio_{timestamp}')]
                 
-                if not downloaded_files:
-                    video_download.status = 'failed'
-                    video_download.save()
-                    raise Exception('Downloaded file not found')
+                    if not downloaded_files:
+                        raise Exception('Downloaded file not found')
                 
-                filename = downloaded_files[0]
-                file_path = os.path.join(media_path, filename)
-                file_size = os.path.getsize(file_path)
+                    filename = downloaded_files[0]
+                    file_path = os.path.join(media_path, filename)
+                    file_size = os.path.getsize(file_path)
+                    crc32, sha256 = file_checksums(file_path)
+                    # Failed by recovery meanwhile (the lease ran out): do not complete it
+                    lease.check()
                 
-                video_download.file_path = f'downloads/{filename}'
-                video_download.file_size = file_size
-                video_download.status = 'completed'
-                video_download.save()
+                    storage_backend = store_file(file_path, f'downloads/{filename}')
+                    transition(
+                        video_download, 'completed',
+                        file_path=f'downloads/{filename}', file_size=file_size, progress=100.0,
+                        crc32=crc32, sha256=sha256, storage_backend=storage_backend,
+                        worker_id='', lease_expires_at=None
+                    )
+                record_usage(video_download.api_key_id, bytes_downloaded=file_size)
+                if has_ffmpeg:
+                    cache_audio(info, audio_format, bitrate, video_download)
                 
                 response_data = {
                     'success': True,
@@ -616,6 +756,7 @@ class DownloadAudioView(APIView):
                     'filename': filename,
                     'size': file_size,
                     'download_url': f'/api/file/{video_download.id}/',
+                    'source': 'audio_only' if audio_only else 'muxed',
                 }
                 
                 if not has_ffmpeg:
@@ -626,13 +767,9 @@ class DownloadAudioView(APIView):
         except Exception as e:
             error_message = str(e)
             
-            # Update database record if it exists
-            try:
-                if 'video_download' in locals():
-                    video_download.status = 'failed'
-                    video_download.save()
-            except:
-                pass
+            # Update database record if it exists (and is still ours)
+            if 'video_download' in locals() and not ('lease' in locals() and lease.lost):
+                fail_download(video_download, error_message)
             
             if 'ffmpeg' in error_message.lower():
                 return Response({
@@ -650,39 +787,188 @@ class DownloadAudioView(APIView):
 
 
 class DownloadFileView(APIView):
-    """Serve downloaded file"""
+    """Serve downloaded file (or redirect to a presigned object-storage URL)"""
     
     def get(self, request, pk):
         try:
-            video_download = VideoDownload.objects.get(pk=pk)
-            file_path = os.path.join(settings.MEDIA_ROOT, video_download.file_path)
-            
-            if not os.path.exists(file_path):
-                raise Http404('File not found')
-            
-            response = FileResponse(
-                open(file_path, 'rb'),
-                content_type='application/octet-stream'
-            )
-            response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_path)}"'
-            return response
-            
+            video_download = visible_downloads(request).get(pk=pk)
         except VideoDownload.DoesNotExist:
             raise Http404('Download record not found')
 
+        if not video_download.file_path:
+            raise Http404('File not found')
+
+        storage = get_storage(video_download.storage_backend)
+        filename = os.path.basename(video_download.file_path)
+
+        # Object storage: the client fetches the bytes directly from the bucket
+        presigned_url = storage.url(video_download.file_path, filename)
+        if presigned_url:
+            record_usage(api_key_id(request), bytes_served=video_download.file_size or 0)
+            return HttpResponseRedirect(presigned_url)
+
+        if not storage.exists(video_download.file_path):
+            raise Http404('File not found')
+        
+        record_usage(api_key_id(request), bytes_served=video_download.file_size or storage.size(video_download.file_path))
+        response = FileResponse(
+            storage.open(video_download.file_path),
+            content_type='application/octet-stream'
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class ArchiveView(APIView):
+    """
+    Stream completed downloads as one stored ZIP or tar, with a manifest.
+    URL: /api/archive.<zip|tar>?ids=1,2,3
+    The layout is deterministic, so interrupted transfers resume with Range.
+    """
+    renderer_classes = [ORJSONRenderer, DownloadRenderer]
+
+    def get(self, request, archive_format: str):
+        if archive_format not in ARCHIVE_FORMATS:
+            raise Http404('Unknown archive format')
+
+        try:
+            ids = list(dict.fromkeys(int(i) for i in request.query_params.get('ids', '').split(',') if i.strip()))
+        except ValueError:
+            return Response({
+                'success': False,
+                'error': 'ids must be a comma-separated list of download ids'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        max_items = getattr(settings, 'ARCHIVE_MAX_ITEMS', 200)
+        if not ids or len(ids) > max_items:
+            return Response({
+                'success': False,
+                'error': f'Provide between 1 and {max_items} download ids'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        downloads = visible_downloads(request).in_bulk(ids)
+        missing = [pk for pk in ids
+                   if pk not in downloads or downloads[pk].status != 'completed' or not downloads[pk].file_path]
+        if missing:
+            return Response({
+                'success': False,
+                'error': 'Some downloads are not available',
+                'details': missing
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        # Files stored before checksums existed are checksummed by the download
+        # worker (or `manage.py backfill_checksums`): reading them here would
+        # outlast the request timeout
+        unchecked = [pk for pk in ids if not has_checksums(downloads[pk])]
+        if unchecked:
+            return Response({
+                'success': False,
+                'error': 'Some downloads are not checksummed yet, try again later',
+                'details': unchecked
+            }, status=status.HTTP_409_CONFLICT)
+
+        try:
+            layout = build_archive([downloads[pk] for pk in ids], archive_format)
+        except Exception as e:
+            return Response({
+                'success': False,
+                'error': 'Failed to prepare archive',
+                'details': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        etag = f'"{layout.etag}"'
+        byte_range = None
+        # A changed selection (different ETag) must not be resumed
+        if request.META.get('HTTP_IF_RANGE', etag) == etag:
+            try:
+                byte_range = parse_range(request.META.get('HTTP_RANGE'), layout.size)
+            except ValueError:
+                response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response['Content-Range'] = f'bytes */{layout.size}'
+                return response
+
+        start, end = byte_range or (0, layout.size - 1)
+        response = StreamingHttpResponse(
+            layout.iter_range(start, end),
+            status=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+            content_type=ARCHIVE_FORMATS[archive_format],
+        )
+        response['Content-Length'] = str(end - start + 1)
+        if byte_range:
+            response['Content-Range'] = f'bytes {start}-{end}/{layout.size}'
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Content-Disposition'] = f'attachment; filename="downloads-{layout.etag[:8]}.{archive_format}"'
+        record_usage(api_key_id(request), bytes_served=end - start + 1)
+        return response
+
+
+class HLSPreviewView(APIView):
+    """
+    Serve HLS playlists/segments of a packaged download.
+    URL: /api/preview/<int:pk>/<str:name>
+    """
+    # Players fetch segment URLs from the playlist and cannot add a key to them
+    permission_classes = []
+
+    def get(self, request, pk: int, name: str):
+        video_download = (VideoDownload.objects
+                          .filter(pk=pk)
+                          .only('hls_path', 'storage_backend', 'preview_status')
+                          .first())
+        if video_download and video_download.preview_status in ('pending', 'packaging'):
+            response = Response({
+                'success': False,
+                'error': 'Preview is still being packaged',
+                'preview_status': video_download.preview_status,
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = '10'
+            return response
+        if not video_download or not video_download.hls_path:
+            raise Http404('Preview not available')
+
+        ext = os.path.splitext(name)[1]
+        if ext not in CONTENT_TYPES or name.startswith('.'):
+            raise Http404('Preview file not found')
+
+        key = f'{os.path.dirname(video_download.hls_path)}/{name}'
+        storage = get_storage(video_download.storage_backend)
+
+        # Segments come straight from object storage; playlists are served
+        # here so the URIs inside them resolve against this API
+        presigned_url = storage.url(key) if ext != '.m3u8' else None
+        if presigned_url:
+            return HttpResponseRedirect(presigned_url)
+
+        if not storage.exists(key):
+            raise Http404('Preview file not found')
+        record_usage(api_key_id(request), bytes_served=storage.size(key))
+
+        if ext == '.m3u8':
+            # A few KB of text: sent whole so CompressionMiddleware can compress it
+            body = storage.open(key)
+            try:
+                response = HttpResponse(body.read(), content_type=CONTENT_TYPES[ext])
+            finally:
+                body.close()
+        else:
+            response = FileResponse(storage.open(key), content_type=CONTENT_TYPES[ext])
+        # Packaged output never changes, so it can be cached for good
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        response['Access-Control-Allow-Origin'] = '*'
+        return response
+
 
 class SupportedSitesView(APIView):
     """List all supported sites"""
     
     def get(self, request):
         try:
-            extractors = yt_dlp.extractor.gen_extractor_classes()
-            extractor_names = [e.IE_NAME for e in extractors if hasattr(e, 'IE_NAME')]
+            extractor_names = get_extractor_names()
             
             return Response({
                 'success': True,
                 'count': len(extractor_names),
-                'extractors': sorted(extractor_names)[:100],
+                'extractors': extractor_names[:100],
                 'message': f'Total {len(extractor_names)} sites supported'
             }, status=status.HTTP_200_OK)
             
@@ -695,6 +981,8 @@ class SupportedSitesView(APIView):
 
 class HealthCheckView(APIView):
     """API health check"""
+    authentication_classes = []
+    permission_classes = []
     
     def get(self, request):
         try:
@@ -704,22 +992,7 @@ class HealthCheckView(APIView):
             # Check FFmpeg
             has_ffmpeg = check_ffmpeg()
             ffmpeg_location = get_ffmpeg_location()
-            ffmpeg_version = None
-            
-            if has_ffmpeg:
-                try:
-                    result = subprocess.run(
-                        ['ffmpeg', '-version'],
-                        capture_output=True,
-                        text=True,
-                        timeout=5
-                    )
-                    if result.returncode == 0:
-                        # Extract version from first line
-                        first_line = result.stdout.split('\n')[0]
-                        ffmpeg_version = first_line
-                except:
-                    ffmpeg_version = 'Installed (version check failed)'
+            ffmpeg_version = get_ffmpeg_version()
             
             return Response({
                 'status': 'ok',
@@ -742,14 +1015,170 @@ class HealthCheckView(APIView):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class ReadinessView(APIView):
+    """
+    Readiness probe: 503 until the warm-up stage has finished (and while it fails).
+    URL: /api/ready/
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        if not is_warm():
+            # Nothing preloaded this process (e.g. runserver), or warm-up
+            # failed: (re)try in the background
+            start_warm_up()
+            report = warm_up_report()
+            return Response({
+                'status': 'failed' if 'error' in report else 'warming',
+                'ready': False,
+                'stages': report,
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        return Response({
+            'status': 'ok',
+            'ready': True,
+            'stages': warm_up_report(),
+        }, status=status.HTTP_200_OK)
+
+
+class DuplicatesView(APIView):
+    """
+    Stored downloads with the same or near-identical media as a
+    fingerprinted download (needs FINGERPRINT_ENABLED).
+    URL: /api/duplicates/<int:pk>/?max_distance=<bits>
+    """
+
+    def get(self, request, pk):
+        try:
+            fingerprint = MediaFingerprint.objects.select_related('download').get(download_id=pk)
+        except MediaFingerprint.DoesNotExist:
+            raise Http404('Download not found or not fingerprinted')
+
+        try:
+            max_distance = float(request.query_params['max_distance']) if 'max_distance' in request.query_params else None
+        except ValueError:
+            return Response({
+                'success': False,
+                'error': 'max_distance must be a number'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        duplicates = []
+        for candidate, distance, audio, exact in find_duplicates(fingerprint, max_distance=max_distance):
+            video_download = candidate.download
+            duplicates.append({
+                'id': video_download.id,
+                'url': video_download.url,
+                'title': video_download.title,
+                'platform': video_download.platform,
+                'file_size': video_download.file_size,
+                'duration': candidate.duration,
+                'exact': exact,
+                'frame_distance': round(distance, 2) if distance is not None else None,
+                'audio_similarity': audio,
+                'download_url': f'/api/file/{video_download.id}/',
+            })
+
+        return Response({
+            'success': True,
+            'id': pk,
+            'sha256': fingerprint.download.sha256,
+            'count': len(duplicates),
+            'duplicates': duplicates,
+        }, status=status.HTTP_200_OK)
+
+
+class UsageView(APIView):
+    """
+    The calling API key's usage and quotas for the current period.
+    URL: /api/usage/
+    """
+
+    def get(self, request):
+        api_key = request_api_key(request)
+        if api_key is None:
+            return Response({
+                'success': False,
+                'error': 'An API key is required (X-API-Key header)'
+            }, status=status.HTTP_401_UNAUTHORIZED)
+
+        return Response({
+            'success': True,
+            'key': {'name': api_key.name, 'prefix': api_key.prefix},
+            'period': current_period().isoformat(),
+            'usage': usage_totals(api_key),
+            'quotas': api_key.quotas or {},
+        }, status=status.HTTP_200_OK)
+
+
 class DownloadHistoryView(APIView):
-    """Get download history"""
+    """Get download history (only the key's own downloads when called with an API key)"""
     
     def get(self, request):
-        downloads = VideoDownload.objects.all().order_by('-created_at')[:50]
-        serializer = VideoDownloadSerializer(downloads, many=True)
+        fields = parse_fields_param(request) or VideoDownloadListSerializer.DEFAULT_FIELDS
+        unknown = [f for f in fields if f not in HISTORY_PUBLIC_FIELDS]
+        if unknown:
+            return Response({
+                'success': False,
+                'error': f"Unknown or private fields: {', '.join(unknown)}",
+                'details': HISTORY_PUBLIC_FIELDS
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Only load the columns that are rendered
+        downloads = (
+            visible_downloads(request)
+            .only(*fields)
+            .order_by('-created_at')[:50]
+        )
+        data = VideoDownloadListSerializer(downloads, many=True, fields=fields).data
         return Response({
             'success': True,
-            'count': downloads.count(),
-            'downloads': serializer.data
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+            'count': len(data),
+            'downloads': data
+        }, status=status.HTTP_200_OK)
+
+
+class JobEventsView(APIView):
+    """
+    Server-Sent-Events stream of status transitions for one download.
+    URL: /api/events/<int:pk>/
+    """
+    renderer_classes = [EventStreamRenderer]
+
+    def get(self, request, pk: int):
+        if not VideoDownload.objects.filter(pk=pk).exists():
+            raise Http404("Download record not found")
+
+        last_event_id = request.headers.get('Last-Event-ID', '0')
+        resp = StreamingHttpResponse(
+            event_stream(
+                job_channel(pk),
+                int(last_event_id) if last_event_id.isdigit() else 0,
+                stop_on_terminal=True,
+            ),
+            content_type="text/event-stream",
+        )
+        resp["Cache-Control"] = "no-cache"
+        resp["X-Accel-Buffering"] = "no"
+        return resp
+
+
+class ClientEventsView(APIView):
+    """
+    Server-Sent-Events stream of status transitions for every download of a client.
+    URL: /api/events/client/<str:client_id>/
+    """
+    renderer_classes = [EventStreamRenderer]
+
+    def get(self, request, client_id: str):
+        last_event_id = request.headers.get('Last-Event-ID', '0')
+        resp = StreamingHttpResponse(
+            event_stream(
+                client_channel(client_id),
+                int(last_event_id) if last_event_id.isdigit() else 0,
+            ),
+            content_type="text/event-stream",
+        )
+        resp["Cache-Control"] = "no-cache"
+        resp["X-Accel-Buffering"] = "no"
+        return resp
\ No newline at end of file
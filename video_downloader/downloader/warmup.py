@@ -0,0 +1,84 @@
+"""
+Startup warm-up.
+
+With gunicorn's `--preload`, `video_downloader.wsgi` runs `warm_up()` once in
+the master process. Everything loaded here (URLconf, views, the yt-dlp
+extractor registry, FFmpeg probe results) is then shared copy-on-write by the
+forked workers, so the first request on a fresh worker is not a cold start.
+Nothing here may touch the database: connections must not cross a fork.
+"""
+import threading
+import time
+
+_lock = threading.Lock()
+_state = {
+    'started': False,
+    'ready': False,
+    'stages': {},
+    'error': None,
+}
+
+
+def _load_urlconf():
+    # Django only imports the URLconf (and so the views) on the first request
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+
+
+def _load_extractors():
+    from .views import get_extractor_names
+    get_extractor_names()
+
+
+def _probe_ffmpeg():
+    from .tasks import check_ffmpeg, get_ffmpeg_location, get_ffmpeg_version
+    check_ffmpeg()
+    get_ffmpeg_location()
+    get_ffmpeg_version()
+
+
+STAGES = (
+    ('urlconf', _load_urlconf),
+    ('yt_dlp_extractors', _load_extractors),
+    ('ffmpeg_probe', _probe_ffmpeg),
+)
+
+
+def warm_up():
+    """Run every warm-up stage once; later calls return immediately"""
+    with _lock:
+        if _state['started']:
+            return _state['ready']
+        _state['started'] = True
+
+    _state['error'] = None
+    try:
+        for name, stage in STAGES:
+            started = time.perf_counter()
+            stage()
+            _state['stages'][name] = round(time.perf_counter() - started, 3)
+        _state['ready'] = True
+    except Exception as e:
+        # Requests are still served (each view loads what it needs on demand),
+        # but readiness stays false; the next readiness check tries again
+        _state['error'] = f'{name}: {e}'
+        _state['started'] = False
+        print(f"Warm-up failed at {name}: {e}")
+    return _state['ready']
+
+
+def start_warm_up():
+    """Run warm_up() on a background thread (when nothing was preloaded, or it failed)"""
+    if not _state['started']:
+        threading.Thread(target=warm_up, daemon=True).start()
+
+
+def is_warm() -> bool:
+    return _state['ready']
+
+
+def warm_up_report() -> dict:
+    report = dict(_state['stages'])
+    if _state['error']:
+        report['error'] = _state['error']
+    return report
@@ -1,6 +1,6 @@
+import json
 import os
 from pathlib import Path
-from celery.schedules import crontab
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -30,6 +30,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'downloader.middleware.CompressionMiddleware',
+    'downloader.middleware.UsageMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,12 +65,46 @@ CORS_ALLOW_ALL_ORIGINS = True
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Where completed downloads live: 'local' (MEDIA_ROOT) or 's3' (any S3-compatible
+# store, e.g. MinIO via MEDIA_S3_ENDPOINT_URL). S3 files are served via presigned URLs.
+MEDIA_STORAGE_BACKEND = os.environ.get('MEDIA_STORAGE_BACKEND', 'local')
+MEDIA_STORAGE_KEEP_LOCAL = os.environ.get('MEDIA_STORAGE_KEEP_LOCAL', 'False') == 'True'
+MEDIA_S3_BUCKET = os.environ.get('MEDIA_S3_BUCKET', '')
+MEDIA_S3_ENDPOINT_URL = os.environ.get('MEDIA_S3_ENDPOINT_URL') or None
+MEDIA_S3_REGION = os.environ.get('MEDIA_S3_REGION') or None
+MEDIA_S3_ACCESS_KEY_ID = os.environ.get('MEDIA_S3_ACCESS_KEY_ID') or None
+MEDIA_S3_SECRET_ACCESS_KEY = os.environ.get('MEDIA_S3_SECRET_ACCESS_KEY') or None
+MEDIA_S3_PREFIX = os.environ.get('MEDIA_S3_PREFIX', '')
+MEDIA_S3_PATH_STYLE = os.environ.get('MEDIA_S3_PATH_STYLE', 'False') == 'True'
+MEDIA_S3_URL_EXPIRY = int(os.environ.get('MEDIA_S3_URL_EXPIRY', 3600))
+MEDIA_S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MEDIA_S3_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+MEDIA_S3_MAX_CONCURRENCY = 8
+
+# HLS preview packaging (always on when enabled, otherwise per request with preview=true)
+HLS_PACKAGING_ENABLED = os.environ.get('HLS_PACKAGING_ENABLED', 'False') == 'True'
+HLS_SEGMENT_SECONDS = 6
+HLS_LOW_RUNG = True
+HLS_PACKAGING_TIMEOUT = 600
+
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'downloader.renderers.ORJSONRenderer',
+    ],
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'downloader.authentication.ApiKeyAuthentication',
+    ],
+    'DEFAULT_PERMISSION_CLASSES': [
+        'downloader.permissions.ApiKeyQuota',
     ],
 }
 
+# Response compression (zstd / brotli when installed, otherwise gzip)
+COMPRESSION_MIN_SIZE = 500
+COMPRESSION_ZSTD_LEVEL = 3
+COMPRESSION_BROTLI_QUALITY = 5
+COMPRESSION_GZIP_LEVEL = 6
+
 # Database - Use PostgreSQL if DATABASE_URL is set (Railway provides this)
 # Otherwise fall back to SQLite for local development
 DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -103,7 +139,36 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 # Caching - Use Redis only if REDIS_URL is available
+# (shared across workers, needed for job events to reach every SSE stream;
+# run_download_worker refuses to start without a shared cache)
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
+        }
+    }
+
+# Job notifications (webhooks + Server-Sent-Events)
+WEBHOOK_SIGNING_SECRET = os.environ.get('WEBHOOK_SIGNING_SECRET', SECRET_KEY)
+WEBHOOK_MAX_ATTEMPTS = 3
+WEBHOOK_TIMEOUT = 5
+# Callbacks to private / loopback / link-local addresses are refused unless this is set (local testing)
+WEBHOOK_ALLOW_PRIVATE_ADDRESSES = os.environ.get('WEBHOOK_ALLOW_PRIVATE_ADDRESSES', 'False') == 'True'
+SSE_POLL_INTERVAL = 0.5
+SSE_KEEPALIVE_SECONDS = 15
+# Streams end after this long (each holds a gunicorn thread); clients reconnect with Last-Event-ID
+SSE_MAX_SECONDS = 30
+
+# Download progress is buffered and written in batches at most this often (seconds)
+PROGRESS_FLUSH_INTERVAL = 2.0
 
+# Audio downloads: converted files are reused per (video, codec, bitrate)
+AUDIO_CACHE_TTL = 60 * 60 * 24
+AUDIO_EXTRACT_TIMEOUT = 280
 
 # yt-dlp settings
 YTDLP_ENABLE_IMPERSONATION = True
@@ -112,5 +177,78 @@ YTDLP_TIKTOK_API_HOSTNAMES = [
     "api-h2.tiktokv.com",
     "api16-normal-c-useast1a.tiktokv.com",
 ]
+YTDLP_IMPERSONATE_PLATFORMS = ["tiktok", "instagram", "facebook"]
+
+# Identity pool: cookie jars / impersonation profiles rotated across requests.
+# JSON list of {"name", "cookiefile", "impersonate", "user_agent", "platforms", "max_per_minute"}
+YTDLP_IDENTITIES = json.loads(os.environ.get('YTDLP_IDENTITIES') or '[]')
+YTDLP_IDENTITY_MAX_PER_MINUTE = 30
+
+# Download queue (manage.py run_download_worker)
+# Share of worker slots per lane, per-owner fair-share weights (client_id or "ip:<addr>")
+DOWNLOAD_LANE_WEIGHTS = {'interactive': 8, 'bulk': 2, 'prefetch': 1}
+DOWNLOAD_OWNER_WEIGHTS = json.loads(os.environ.get('DOWNLOAD_OWNER_WEIGHTS') or '{}')
+# Cost estimates (seconds of work) used for fair share and shortest-job-first
+DOWNLOAD_ASSUMED_BANDWIDTH = 4 * 1024 * 1024
+DOWNLOAD_DEFAULT_COST = 60
+DOWNLOAD_WORKER_POLL_INTERVAL = 2.0
+# Workers announce themselves every DOWNLOAD_WORKER_HEARTBEAT_SECONDS; when none
+# has, the web process drains the queue on a background thread instead
+DOWNLOAD_WORKER_HEARTBEAT_SECONDS = 30
+DOWNLOAD_INPROCESS_FALLBACK = os.environ.get('DOWNLOAD_INPROCESS_FALLBACK', 'True') == 'True'
+
+# Popularity tracking and predictive prefetch of trending videos
+PREFETCH_ENABLED = os.environ.get('PREFETCH_ENABLED', 'True') == 'True'
+PREFETCH_WINDOW_SECONDS = 60 * 60
+PREFETCH_BUCKET_SECONDS = 5 * 60
+PREFETCH_THRESHOLD = int(os.environ.get('PREFETCH_THRESHOLD', '5'))
+PREFETCH_DEFAULT_QUALITY = 'best'
+PREFETCH_INFO_TTL = 30 * 60
+PREFETCH_MAX_IN_FLIGHT = 2
+PREFETCH_RATE_LIMIT = 2 * 1024 * 1024  # bytes/s per prefetch job
+PREFETCH_MAX_BYTES_PER_HOUR = 2 * 1024 ** 3
+PREFETCH_MAX_DISK_BYTES = int(os.environ.get('PREFETCH_MAX_DISK_BYTES', str(10 * 1024 ** 3)))
+# Finished full downloads are reused for identical requests this long
+MEDIA_CACHE_TTL = 60 * 60 * 24
+
+# Job leases: running jobs renew theirs every JOB_LEASE_SECONDS / 3; workers
+# requeue jobs whose lease ran out (up to JOB_MAX_ATTEMPTS) and resume their
+# .part files, so MEDIA_ROOT/downloads should be on a persistent volume
+JOB_LEASE_SECONDS = 90
+JOB_MAX_ATTEMPTS = 3
+JOB_RECOVERY_INTERVAL = 30
+
+# API keys (X-API-Key header) and per-key metering. Usage is summed in memory
+# and written every USAGE_FLUSH_INTERVAL seconds; quotas are set per key.
+API_KEY_REQUIRED = os.environ.get('API_KEY_REQUIRED', 'False') == 'True'
+USAGE_FLUSH_INTERVAL = 10
+USAGE_CACHE_SECONDS = 10
+# How often stored files are charged storage-seconds (by the download worker)
+USAGE_STORAGE_INTERVAL = 5 * 60
+
+# Content fingerprints of finished downloads (sampled-frame dHashes, Chromaprint
+# via fpcalc when installed) to find re-posts under other URLs. Exact duplicates
+# (same sha256) share the stored file whether or not this is enabled.
+FINGERPRINT_ENABLED = os.environ.get('FINGERPRINT_ENABLED', 'False') == 'True'
+FINGERPRINT_FRAMES = 16
+# Near-duplicate thresholds: mean differing bits per frame hash (of 64), audio bit agreement
+FINGERPRINT_MAX_DISTANCE = 10
+FINGERPRINT_MIN_AUDIO_SIMILARITY = 0.8
+FINGERPRINT_TIMEOUT = 120
+
+# /api/subtitles/: parsed tracks are cached per video and language
+SUBTITLES_CACHE_TTL = 60 * 60 * 24
+SUBTITLES_BATCH_WORKERS = 4
+
+# Operations dashboard (admin > Video downloads > Operations)
+OPS_CACHE_SECONDS = 5
+OPS_STORAGE_CACHE_SECONDS = 60
+OPS_WINDOW_SECONDS = 60 * 60
+# Expected size of the media store, shown against stored bytes (None: no quota)
+MEDIA_STORAGE_QUOTA = int(os.environ['MEDIA_STORAGE_QUOTA']) if os.environ.get('MEDIA_STORAGE_QUOTA') else None
+
+# /api/archive.zip|tar: streamed multi-download exports
+ARCHIVE_MAX_ITEMS = 200
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
 
 #
\ No newline at end of file
@@ -6,3 +6,9 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'video_downloader.settings')
 
 application = get_wsgi_application()
 application = WhiteNoise(application)
+
+# Load views, yt-dlp extractors and the FFmpeg probe up front. Under
+# `gunicorn --preload` this runs once in the master and workers share it.
+from downloader.warmup import warm_up  # noqa: E402
+
+warm_up()